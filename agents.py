@@ -1,21 +1,320 @@
+import asyncio
+import contextvars
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from pydantic import BaseModel
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-import os
+import metrics
+from cache import llm_cache
+from chunking import (
+    iter_chunks,
+    merge_protocol_analyses,
+    merge_safety_alerts,
+    merge_quality_issues,
+    merge_recommendations
+)
+from config import CHUNK_CONFIG, SUMMARY_CONFIG
+from resilience import call_with_retries, acall_with_retries
+from routing import client_route, route_for, escalation_for, get_model
+from rules import prescreen_documents
+from retrieval import use_retrieval, retrieve_context, safety_queries, quality_queries
+from summaries import (
+    summarize_protocol,
+    summarize_alerts,
+    summarize_issues,
+    summarize_recommendations,
+    severity_counts
+)
+from tokens import count_message_tokens
+from profiling import annotate, callback_config, span, traced_iter
 from models import (
     TrialState,
     ProtocolAnalysis,
     SafetyAlert,
-    DataQualityIssue
+    DataQualityIssue,
+    Recommendation
 )
+from reports import render_report
 
-# Initialize LLM
-llm = ChatOpenAI(
-    model="gpt-4o-mini",  
-    temperature=0,
-    api_key=os.getenv("OPENAI_API_KEY")
-)
+# LLM clients are built per model route on first use, so importing this module needs no credentials.
+# An override set with set_llm replaces the routed clients, e.g. with a local or fake chat model.
+_llm = None
+
+def get_llm(agent=None):
+    """Returns the LLM client for an agent's model route"""
+    if _llm is not None:
+        return _llm
+    return get_model(route_for(agent))
+
+def get_escalation_llm(agent=None):
+    """Returns the client to retry an agent's invalid structured output with, or None"""
+    if _llm is not None:
+        return None
+    route = escalation_for(agent)
+    return get_model(route) if route else None
+
+def set_llm(llm):
+    """Sends every agent's requests to llm instead of its routed model; None restores routing"""
+    global _llm
+    _llm = llm
+
+# Optional rate limiter awaited before every uncached async LLM request (see batch.py)
+rate_limiter = None
+
+# Provider batch run in progress (see provider_batch.py): serves its results and, while it is
+# collecting requests, records cache misses instead of sending them
+batch_run = contextvars.ContextVar("batch_run", default=None)
+
+class DeferredToBatch(Exception):
+    """Raised on a cache miss while a provider batch run is collecting requests"""
+
+class StructuredOutputError(ValueError):
+    """Raised when a model's structured output is missing, truncated or fails schema validation"""
+
+# Raised by the OpenAI client when structured output stops at max_tokens before it is complete
+TRUNCATION_ERRORS = {"LengthFinishReasonError"}
+
+def raise_if_truncated(error):
+    """Re-raises an incomplete structured output as a StructuredOutputError, so it escalates"""
+    if type(error).__name__ in TRUNCATION_ERRORS:
+        raise StructuredOutputError(f"Structured output was cut off: {error}") from error
+
+def record_usage(message):
+    """Records the request and its token usage against the node in progress"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    metrics.record(
+        llm_requests=1,
+        prompt_tokens=usage.get("input_tokens", 0),
+        completion_tokens=usage.get("output_tokens", 0)
+    )
+
+def parse_structured(response):
+    """Unpacks an include_raw structured-output response, raising if parsing failed"""
+    record_usage(response["raw"])
+    if response.get("parsing_error") or response.get("parsed") is None:
+        raise StructuredOutputError(
+            f"Structured output failed validation: {response.get('parsing_error') or 'no output'}"
+        )
+    return response["parsed"]
+
+def get_cached(llm, messages, schema):
+    """Looks up the response cache, returning (key, cached response or None)"""
+    key = llm_cache.make_key(client_route(llm), messages, schema)
+    run = batch_run.get()
+    # Batch results are also written to the cache, so they are checked first to be counted as such
+    cached = run.results.get(key) if run is not None else None
+    if cached is not None:
+        metrics.record(batch_served=1)
+        annotate(batch_served=True)
+    elif (cached := llm_cache.get(key)) is not None:
+        metrics.record(cache_hits=1)
+        annotate(cache_hit=True)
+    else:
+        metrics.record(cache_misses=1 if llm_cache.enabled else 0)
+        if run is not None:
+            # Records the request and raises DeferredToBatch while the run is collecting
+            run.lookup(key, llm, messages, schema)
+        return key, None
+    if not schema:
+        return key, cached
+    with span("validate_cached", schema=schema.__name__):
+        return key, schema.model_validate_json(cached)
+
+def invoke_structured(llm, messages, schema):
+    structured = llm.with_structured_output(schema, include_raw=True)
+    try:
+        response = call_with_retries(lambda: structured.invoke(messages, config=callback_config()), llm.model_name)
+    except Exception as e:
+        raise_if_truncated(e)
+        raise
+    return parse_structured(response)
+
+async def ainvoke_structured(llm, messages, schema):
+    structured = llm.with_structured_output(schema, include_raw=True)
+    try:
+        response = await acall_with_retries(
+            lambda: structured.ainvoke(messages, config=callback_config()), llm.model_name)
+    except Exception as e:
+        raise_if_truncated(e)
+        raise
+    return parse_structured(response)
+
+def llm_span(agent, schema):
+    return span("llm_call", agent=agent or "default", schema=schema.__name__ if schema else "text", cache_hit=False)
+
+def invoke_llm(messages, schema=None, agent=None):
+    """Invokes the agent's LLM, with structured output when a schema is given, serving repeats from the response cache
+
+    Structured output that fails validation or is cut off at max_tokens is
+    retried once on the agent's escalation model, and the result is cached under the original model's key
+    so repeats do not fail again.
+    """
+    with llm_span(agent, schema):
+        return _invoke_llm(messages, schema, agent)
+
+def _invoke_llm(messages, schema, agent):
+    llm = get_llm(agent)
+    annotate(model=llm.model_name)
+    key, cached = get_cached(llm, messages, schema)
+    if cached is not None:
+        return cached
+
+    if schema:
+        try:
+            response = invoke_structured(llm, messages, schema)
+        except StructuredOutputError:
+            escalation = get_escalation_llm(agent)
+            if escalation is None:
+                raise
+            metrics.record(escalations=1)
+            annotate(escalated_to=escalation.model_name)
+            response = invoke_structured(escalation, messages, schema)
+        llm_cache.set(key, response.model_dump_json())
+        return response
+
+    response = call_with_retries(lambda: llm.invoke(messages, config=callback_config()), llm.model_name)
+    record_usage(response)
+    llm_cache.set(key, response.content)
+    return response.content
+
+async def ainvoke_llm(messages, schema=None, agent=None):
+    """Async variant of invoke_llm that awaits the LLM with ainvoke"""
+    with llm_span(agent, schema):
+        return await _ainvoke_llm(messages, schema, agent)
+
+async def _ainvoke_llm(messages, schema, agent):
+    llm = get_llm(agent)
+    annotate(model=llm.model_name)
+    key, cached = get_cached(llm, messages, schema)
+    if cached is not None:
+        return cached
+
+    if rate_limiter is not None:
+        started = time.perf_counter()
+        await rate_limiter.acquire(count_message_tokens(messages))
+        metrics.record(wait_seconds=time.perf_counter() - started)
+
+    if schema:
+        try:
+            response = await ainvoke_structured(llm, messages, schema)
+        except StructuredOutputError:
+            escalation = get_escalation_llm(agent)
+            if escalation is None:
+                raise
+            metrics.record(escalations=1)
+            annotate(escalated_to=escalation.model_name)
+            response = await ainvoke_structured(escalation, messages, schema)
+        llm_cache.set(key, response.model_dump_json())
+        return response
+
+    response = await acall_with_retries(lambda: llm.ainvoke(messages, config=callback_config()), llm.model_name)
+    record_usage(response)
+    llm_cache.set(key, response.content)
+    return response.content
+
+def map_chunks(prompts, schema, agent=None):
+    """Runs the structured-output extraction for each chunk prompt in parallel threads
+
+    Prompts may be a lazy iterable; at most CHUNK_CONFIG["max_parallel_chunks"]
+    are built and in flight at a time, so large document sets are never held
+    in memory as prompts all at once.
+    """
+    prompts = traced_iter(prompts, "build_prompt")
+    first = next(prompts, None)
+    if first is None:
+        return []
+    second = next(prompts, None)
+    if second is None:
+        return [invoke_llm(first, schema=schema, agent=agent)]
+
+    def extract(messages, submitted):
+        metrics.record(wait_seconds=time.perf_counter() - submitted)
+        return invoke_llm(messages, schema=schema, agent=agent)
+
+    results = []
+    deferred = []
+
+    def collect(future):
+        # While a provider batch collects requests, every chunk is recorded before the node is interrupted
+        try:
+            results.append(future.result())
+        except DeferredToBatch as e:
+            deferred.append(e)
+
+    limit = CHUNK_CONFIG["max_parallel_chunks"]
+    with ThreadPoolExecutor(max_workers=limit) as pool:
+        pending = deque()
+        for messages in itertools.chain([first, second], prompts):
+            if len(pending) >= limit:
+                collect(pending.popleft())
+            # Each task gets its own copy of the context so callbacks and metrics follow the node
+            pending.append(pool.submit(contextvars.copy_context().run, extract, messages, time.perf_counter()))
+        while pending:
+            collect(pending.popleft())
+    if deferred:
+        raise deferred[0]
+    return results
+
+async def amap_chunks(prompts, schema, agent=None):
+    """Async variant of map_chunks, bounded by CHUNK_CONFIG["max_parallel_chunks"]"""
+    semaphore = asyncio.Semaphore(CHUNK_CONFIG["max_parallel_chunks"])
+
+    async def extract(messages):
+        try:
+            return await ainvoke_llm(messages, schema=schema, agent=agent)
+        finally:
+            semaphore.release()
+
+    prompts = traced_iter(prompts, "build_prompt")
+    tasks = []
+    try:
+        while True:
+            waited = time.perf_counter()
+            # A slot is taken before the next prompt is built, so at most the in-flight prompts are in memory
+            await semaphore.acquire()
+            metrics.record(wait_seconds=time.perf_counter() - waited)
+            messages = next(prompts, None)
+            if messages is None:
+                semaphore.release()
+                break
+            tasks.append(asyncio.ensure_future(extract(messages)))
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # One failed chunk fails the node, so the other requests are not left running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def documents_to_review(state: TrialState):
+    """Returns all documents, or only the new and changed ones on an incremental run"""
+    changed_doc_ids = state.get("changed_doc_ids")
+    if changed_doc_ids is None:
+        return state["documents"]
+    changed_doc_ids = set(changed_doc_ids)
+    return [doc for doc in state["documents"] if doc.doc_id in changed_doc_ids]
+
+def review_contents(state: TrialState, queries, documents=None):
+    """Returns the document text to review, one entry per prompt, lazily for chunked documents
+
+    Large document sets are narrowed to the passages retrieved for the given
+    questions so the prompt stays a constant size; smaller ones are chunked in full.
+    """
+    documents = documents_to_review(state) if documents is None else documents
+    if use_retrieval(documents):
+        return [retrieve_context(state["trial_id"], state["documents"], documents, queries)]
+    return iter_chunks(documents)
+
+def protocol_unchanged(state: TrialState):
+    """True on an incremental run where a prior protocol analysis exists and no protocol document changed"""
+    return (
+        state.get("changed_doc_ids") is not None
+        and state.get("protocol_analysis") is not None
+        and not any(doc.doc_type == "protocol" for doc in documents_to_review(state))
+    )
 
 
 # Define structured output models for lists
@@ -25,115 +324,208 @@ class SafetyAlertList(BaseModel):
 class QualityIssueList(BaseModel):
     issues: List[DataQualityIssue]
 
+class RecommendationList(BaseModel):
+    recommendations: List[Recommendation]
+
 class ProtocolAgent:
     @staticmethod
-    def analyze_protocol(state: TrialState):
-        """Analyzes clinical trial protocol documents"""
-        
+    def build_chunk_messages(state: TrialState):
+        """Lazily builds one protocol analysis prompt per chunk of the protocol documents"""
+
         system_prompt = """You are an expert clinical trial protocol analyzer. Review the protocol and extract:
         1. Key eligibility criteria
         2. Inclusion/exclusion criteria
         3. Study endpoints
         4. Safety monitoring requirements"""
-        
+
         protocol_docs = [doc for doc in state["documents"] if doc.doc_type == "protocol"]
-        if not protocol_docs:
-            return {"protocol_analysis": None}
-            
-        protocol_content = "\n\n".join([doc.content for doc in protocol_docs])
-        
-        response = llm.with_structured_output(ProtocolAnalysis).invoke(
+
+        return (
             [
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=f"Analyze this protocol: {protocol_content}")
             ]
+            for protocol_content in iter_chunks(protocol_docs)
         )
-        
-        return {"protocol_analysis": response}
+
+    @staticmethod
+    def analyze_protocol(state: TrialState):
+        """Analyzes clinical trial protocol documents"""
+        if protocol_unchanged(state):
+            return {}
+        responses = map_chunks(ProtocolAgent.build_chunk_messages(state), ProtocolAnalysis, agent="protocol_analyzer")
+
+        return {"protocol_analysis": merge_protocol_analyses(responses)}
+
+    @staticmethod
+    async def aanalyze_protocol(state: TrialState):
+        """Async variant of analyze_protocol"""
+        if protocol_unchanged(state):
+            return {}
+        responses = await amap_chunks(
+            ProtocolAgent.build_chunk_messages(state), ProtocolAnalysis, agent="protocol_analyzer")
+
+        return {"protocol_analysis": merge_protocol_analyses(responses)}
 
 class SafetyAgent:
     @staticmethod
-    def monitor_safety(state: TrialState):
-        """Monitors for safety concerns and generates alerts"""
-        
+    def build_chunk_messages(state: TrialState):
+        """Lazily builds one safety review prompt per chunk of the documents under review"""
+
         system_prompt = """You are an expert clinical trial safety monitor. Review the documents and:
         1. Identify potential safety concerns
         2. Assess severity levels
         3. Provide specific recommendations
         4. Link concerns to relevant protocol criteria"""
-        
-        docs_content = "\n\n".join([doc.content for doc in state["documents"]])
-        protocol = state["protocol_analysis"]
-        
-        response = llm.with_structured_output(SafetyAlertList).invoke(
+
+        protocol = summarize_protocol(state["protocol_analysis"])
+
+        return (
             [
                 SystemMessage(content=system_prompt),
-                HumanMessage(content=f"Review these documents: {docs_content}\nProtocol analysis: {protocol}")
+                HumanMessage(content=f"Review these documents: {docs_content}\nProtocol analysis:\n{protocol}")
             ]
+            for docs_content in review_contents(state, safety_queries(state["protocol_analysis"]))
         )
-        
-        return {"safety_alerts": response.alerts}
+
+    @staticmethod
+    def monitor_safety(state: TrialState):
+        """Monitors for safety concerns and generates alerts"""
+        responses = map_chunks(SafetyAgent.build_chunk_messages(state), SafetyAlertList, agent="safety_monitor")
+
+        return {"safety_alerts": merge_safety_alerts([alert for response in responses for alert in response.alerts])}
+
+    @staticmethod
+    async def amonitor_safety(state: TrialState):
+        """Async variant of monitor_safety"""
+        responses = await amap_chunks(SafetyAgent.build_chunk_messages(state), SafetyAlertList, agent="safety_monitor")
+
+        return {"safety_alerts": merge_safety_alerts([alert for response in responses for alert in response.alerts])}
 
 class QualityAgent:
     @staticmethod
-    def monitor_data_quality(state: TrialState):
-        """Monitors for data quality issues"""
-        
+    def build_chunk_messages(state: TrialState, documents=None):
+        """Lazily builds one data quality review prompt per chunk of the documents under review"""
+
         system_prompt = """You are an expert clinical data quality analyst. Review the documents and:
         1. Identify potential data quality issues
         2. Categorize issues by type
         3. Assess impact levels
         4. Suggest resolutions"""
-        
-        docs_content = "\n\n".join([doc.content for doc in state["documents"]])
-        
-        response = llm.with_structured_output(QualityIssueList).invoke(
+
+        return (
             [
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=f"Review these documents: {docs_content}")
             ]
+            for docs_content in review_contents(state, quality_queries(state["protocol_analysis"]), documents)
         )
-        
-        return {"quality_issues": response.issues}
+
+    @staticmethod
+    def monitor_data_quality(state: TrialState):
+        """Monitors for data quality issues"""
+        rule_issues, residue = prescreen_documents(documents_to_review(state))
+        if not residue:
+            return {"quality_issues": merge_quality_issues(rule_issues)}
+
+        responses = map_chunks(QualityAgent.build_chunk_messages(state, residue), QualityIssueList, agent="quality_monitor")
+
+        return {"quality_issues": merge_quality_issues(rule_issues + [issue for response in responses for issue in response.issues])}
+
+    @staticmethod
+    async def amonitor_data_quality(state: TrialState):
+        """Async variant of monitor_data_quality"""
+        rule_issues, residue = prescreen_documents(documents_to_review(state))
+        if not residue:
+            return {"quality_issues": merge_quality_issues(rule_issues)}
+
+        responses = await amap_chunks(QualityAgent.build_chunk_messages(state, residue), QualityIssueList, agent="quality_monitor")
+
+        return {"quality_issues": merge_quality_issues(rule_issues + [issue for response in responses for issue in response.issues])}
 
 class RecommendationsAgent:
+    @staticmethod
+    @span("build_prompt")
+    def build_messages(state: TrialState):
+        """Builds the recommendations prompt from compact summaries of the findings"""
+
+        system_prompt = """You are an expert clinical trial advisor. Based on the protocol analysis,
+        safety alerts, and quality issues, provide strategic recommendations for trial optimization.
+        Give each recommendation a priority (high, medium or low), a one-sentence rationale, and the
+        IDs of the safety alerts and quality issues it addresses."""
+
+        return [
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=f"""Review this information:
+Protocol:
+{summarize_protocol(state['protocol_analysis'])}
+Safety Alerts:
+{summarize_alerts(state['safety_alerts'])}
+Quality Issues:
+{summarize_issues(state['quality_issues'])}""")
+        ]
+
+    @staticmethod
+    def clean_recommendations(state: TrialState, response):
+        """Deduplicates recommendations and drops links to alerts or issues that do not exist"""
+        alert_ids = {alert.alert_id for alert in state["safety_alerts"]}
+        issue_ids = {issue.issue_id for issue in state["quality_issues"]}
+        recommendations = merge_recommendations(response.recommendations)
+        for rec in recommendations:
+            rec.related_alert_ids = [alert_id for alert_id in rec.related_alert_ids if alert_id in alert_ids]
+            rec.related_issue_ids = [issue_id for issue_id in rec.related_issue_ids if issue_id in issue_ids]
+        return recommendations
+
     @staticmethod
     def generate_recommendations(state: TrialState):
         """Generates overall trial recommendations"""
-        
-        system_prompt = """You are an expert clinical trial advisor. Based on the protocol analysis, 
-        safety alerts, and quality issues, provide strategic recommendations for trial optimization."""
-        
-        response = llm.invoke(
-            [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=f"""Review this information:
-                Protocol: {state['protocol_analysis']}
-                Safety Alerts: {state['safety_alerts']}
-                Quality Issues: {state['quality_issues']}""")
-            ]
-        )
-        
-        return {"recommendations": response.content.split('\n')}
+        response = invoke_llm(
+            RecommendationsAgent.build_messages(state), schema=RecommendationList, agent="recommendations")
+
+        return {"recommendations": RecommendationsAgent.clean_recommendations(state, response)}
+
+    @staticmethod
+    async def agenerate_recommendations(state: TrialState):
+        """Async variant of generate_recommendations"""
+        response = await ainvoke_llm(
+            RecommendationsAgent.build_messages(state), schema=RecommendationList, agent="recommendations")
+
+        return {"recommendations": RecommendationsAgent.clean_recommendations(state, response)}
 
 class ReportGenerator:
+    @staticmethod
+    @span("build_prompt")
+    def build_messages(state: TrialState):
+        """Builds the executive summary prompt; findings are sent as headlines since the recommendations already distill their details"""
+
+        system_prompt = """You are an expert clinical trial report writer. Write the executive summary
+        of an analysis report in two or three short paragraphs: the overall risk picture, the most
+        important safety and data quality concerns, and the top priorities. Do not list every finding
+        or add headings; the report already includes full tables of findings and recommendations."""
+
+        return [
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=f"""Summarize these findings:
+Protocol:
+{summarize_protocol(state['protocol_analysis'], SUMMARY_CONFIG['report_protocol_tokens'])}
+Safety ({severity_counts(state['safety_alerts'], 'severity')}):
+{summarize_alerts(state['safety_alerts'], SUMMARY_CONFIG['report_findings_tokens'], details=False)}
+Quality ({severity_counts(state['quality_issues'], 'impact_level')}):
+{summarize_issues(state['quality_issues'], SUMMARY_CONFIG['report_findings_tokens'], details=False)}
+Recommendations:
+{summarize_recommendations(state['recommendations'])}""")
+        ]
+
     @staticmethod
     def generate_final_report(state: TrialState):
-        """Generates comprehensive trial analysis report"""
-        
-        system_prompt = """You are an expert clinical trial report writer. Create a comprehensive 
-        analysis report that includes protocol insights, safety concerns, data quality issues, 
-        and strategic recommendations."""
-        
-        response = llm.invoke(
-            [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=f"""Generate report based on:
-                Protocol: {state['protocol_analysis']}
-                Safety: {state['safety_alerts']}
-                Quality: {state['quality_issues']}
-                Recommendations: {state['recommendations']}""")
-            ]
-        )
-        
-        return {"final_report": response.content}
\ No newline at end of file
+        """Generates comprehensive trial analysis report; only the executive summary is written by the LLM"""
+        summary = invoke_llm(ReportGenerator.build_messages(state), agent="report_generator")
+
+        return {"final_report": render_report(state, summary)}
+
+    @staticmethod
+    async def agenerate_final_report(state: TrialState):
+        """Async variant of generate_final_report"""
+        summary = await ainvoke_llm(ReportGenerator.build_messages(state), agent="report_generator")
+
+        return {"final_report": render_report(state, summary)}
@@ -0,0 +1,180 @@
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
+
+from fastapi import FastAPI, HTTPException, Query, Response
+from pydantic import BaseModel
+
+from config import JOBS_CONFIG, MAX_DOCUMENTS
+from jobs import JobQueue, start_workers, stop_workers
+from monitor import monitor_documents
+from results import Page, recommendations_from_json, results_store
+from models import DataQualityIssue, DocumentInput, ProtocolAnalysis, Recommendation, SafetyAlert
+
+
+class AnalyzeRequest(BaseModel):
+    trial_id: str
+    documents: List[DocumentInput]
+    incremental: bool = False
+
+
+class TrialMonitoringRequest(BaseModel):
+    trial_id: str
+    documents: List[DocumentInput]
+
+
+class MonitoringResults(BaseModel):
+    trial_id: str
+    reviewed_doc_ids: List[str]
+    new_alerts: List[SafetyAlert]
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    trial_id: str
+    status: str
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class AnalysisReport(BaseModel):
+    job_id: str
+    trial_id: str
+    protocol_analysis: Optional[ProtocolAnalysis] = None
+    safety_alerts: List[SafetyAlert] = []
+    quality_issues: List[DataQualityIssue] = []
+    recommendations: List[Recommendation] = []
+    final_report: str = ""
+
+
+queue = JobQueue()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Workers run in their own processes so analyses never block request handling.
+    # Set JOB_WORKER_PROCESSES=0 when workers are run separately with `python jobs.py`.
+    stop_event, workers = start_workers()
+    try:
+        yield
+    finally:
+        stop_workers(stop_event, workers, timeout=JOBS_CONFIG["poll_interval"] * 5)
+
+
+app = FastAPI(title="Clinical Trial AI", lifespan=lifespan)
+
+
+def job_status(job):
+    return JobStatus(**{field: job[field] for field in JobStatus.model_fields})
+
+
+@app.post("/analyze", response_model=JobStatus, status_code=202)
+def analyze(request: AnalyzeRequest):
+    """Queues an analysis of a trial's documents and returns the job to poll"""
+    if not request.documents:
+        raise HTTPException(status_code=422, detail="At least one document is required")
+    if len(request.documents) > MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_DOCUMENTS} documents per analysis")
+    # Text is stored server-side; clients never pass content store references
+    documents = [doc.to_document() for doc in request.documents]
+    job_id = queue.submit(request.trial_id, documents, request.incremental)
+    return job_status(queue.get(job_id))
+
+
+@app.post("/monitor", response_model=Union[MonitoringResults, JobStatus])
+def monitor(request: TrialMonitoringRequest, response: Response):
+    """Reviews new safety reports for a trial right away and returns the alerts they raise
+
+    Reports already in the trial's checkpoint are skipped, and new ones are
+    reviewed by the safety agent alone against the stored protocol analysis.
+    A trial without a checkpoint, or a new protocol, needs a full analysis,
+    which is queued as an incremental job and returned with a 202 instead.
+    """
+    if not request.documents:
+        raise HTTPException(status_code=422, detail="At least one document is required")
+    if len(request.documents) > MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_DOCUMENTS} documents per request")
+    documents = [doc.to_document() for doc in request.documents]
+    reviewed, alerts, job_id = monitor_documents(request.trial_id, documents, queue)
+    if job_id is not None:
+        response.status_code = 202
+        return job_status(queue.get(job_id))
+    return MonitoringResults(trial_id=request.trial_id, reviewed_doc_ids=reviewed, new_alerts=alerts)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+def get_job(job_id: str):
+    job = queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job_status(job)
+
+
+@app.get("/report", response_model=AnalysisReport)
+def get_report(job_id: Optional[str] = Query(None), trial_id: Optional[str] = Query(None)):
+    """Returns the stored results of a job, or of a trial's most recent job"""
+    if job_id:
+        job = queue.get(job_id)
+    elif trial_id:
+        job = queue.latest(trial_id)
+    else:
+        raise HTTPException(status_code=422, detail="Pass job_id or trial_id")
+    if job is None:
+        raise HTTPException(status_code=404, detail="No analysis found")
+    if job["status"] != "completed":
+        detail = f"Job {job['job_id']} is {job['status']}"
+        raise HTTPException(status_code=409, detail=f"{detail}: {job['error']}" if job["error"] else detail)
+
+    findings = {key: value for key, value in job["result"].items() if value is not None}
+    findings["recommendations"] = recommendations_from_json(findings.get("recommendations", []))
+    return AnalysisReport(**{**findings, "job_id": job["job_id"], "trial_id": job["trial_id"]})
+
+
+@app.get("/trials", response_model=Page)
+def list_trials(limit: Optional[int] = None, offset: int = 0):
+    """Trials with stored results, most recently analyzed first"""
+    return results_store.list_trials(limit, offset)
+
+
+@app.get("/trials/{trial_id}/history", response_model=Page)
+def trial_history(trial_id: str, limit: Optional[int] = None, offset: int = 0):
+    """A trial's stored analyses over time with their alert and issue counts"""
+    return results_store.history(trial_id, limit, offset)
+
+
+@app.get("/alerts", response_model=Page)
+def query_alerts(
+    trial_id: Optional[str] = None,
+    severity: Optional[List[str]] = Query(None),
+    min_severity: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    latest_only: bool = True,
+    limit: Optional[int] = None,
+    offset: int = 0
+):
+    """Stored safety alerts across trials, most severe first"""
+    return results_store.query_alerts(trial_id, severity, min_severity, since, until, latest_only, limit, offset)
+
+
+@app.get("/issues", response_model=Page)
+def query_issues(
+    trial_id: Optional[str] = None,
+    category: Optional[List[str]] = Query(None),
+    impact: Optional[List[str]] = Query(None),
+    min_impact: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    latest_only: bool = True,
+    limit: Optional[int] = None,
+    offset: int = 0
+):
+    """Stored data quality issues across trials, highest impact first"""
+    return results_store.query_issues(trial_id, category, impact, min_impact, since, until, latest_only, limit, offset)
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "jobs": queue.counts()}
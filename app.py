@@ -14,11 +14,19 @@ elif not os.getenv('OPENAI_API_KEY'):
 
 # Now import the rest of the dependencies
 import pandas as pd
+import altair as alt
+from contextlib import nullcontext
 from typing import List
-import time
-import chardet
 from models import ClinicalDocument
-from main import analyze_clinical_trial
+from ingestion import ingest_uploads
+from content_store import content_store
+from main import stream_clinical_trial
+from cache import llm_cache
+from results import results_store
+from datetime import datetime
+from config import PROFILING_CONFIG
+from profiling import list_traces, load_spans, self_times, span, tracing
+import metrics
 
 # Custom CSS
 st.markdown("""
@@ -46,34 +54,8 @@ def load_config():
         st.warning("Configuration file not found. Using default settings.")
         return {}
 
-def read_file_content(uploaded_file):
-    """Safely read uploaded file content with encoding detection"""
-    try:
-        # Read the binary content
-        bytes_data = uploaded_file.getvalue()
-        
-        # Detect the encoding
-        result = chardet.detect(bytes_data)
-        encoding = result['encoding']
-        
-        # If no encoding is detected, default to utf-8
-        if not encoding:
-            encoding = 'utf-8'
-        
-        # Try to decode with detected encoding
-        try:
-            content = bytes_data.decode(encoding)
-        except UnicodeDecodeError:
-            # If that fails, try with utf-8 and ignore errors
-            content = bytes_data.decode('utf-8', errors='ignore')
-            
-        return content
-    except Exception as e:
-        st.error(f"Error reading file: {str(e)}")
-        return None
-
 def upload_documents():
-    """Handle document uploads with proper encoding detection"""
+    """Handle document uploads, extracting text in parallel and reusing earlier extractions"""
     uploaded_files = st.file_uploader(
         "Upload Clinical Trial Documents",
         accept_multiple_files=True,
@@ -82,7 +64,12 @@ def upload_documents():
     
     documents = []
     if uploaded_files:
-        for idx, file in enumerate(uploaded_files):
+        # Hashes are remembered per upload so reruns do not rehash large files
+        hashes = st.session_state.setdefault("upload_hashes", {})
+        with st.spinner("Extracting text..."), span("ingest_uploads", files=len(uploaded_files)):
+            extracted = ingest_uploads(uploaded_files, hashes)
+
+        for idx, (file, (file_hash, text_path, error)) in enumerate(zip(uploaded_files, extracted)):
             st.write(f"Processing file: {file.name}")
             
             doc_type = st.selectbox(
@@ -91,25 +78,29 @@ def upload_documents():
                 key=f"doc_type_{idx}"
             )
             
+            if error:
+                st.error(f"Error processing {file.name}: {error}")
+                continue
+
             try:
-                content = read_file_content(file)
-                if content is not None:
-                    documents.append(ClinicalDocument(
-                        doc_id=f"DOC-{idx+1:03d}",
-                        doc_type=doc_type,
-                        content=content,
-                        metadata={
-                            "filename": file.name,
-                            "size": len(content)
-                        }
-                    ))
-                    st.success(f"Successfully processed {file.name}")
-                else:
-                    st.error(f"Failed to process {file.name}")
+                # Documents reference their text in the content store rather than holding it in session state
+                content_refs = st.session_state.setdefault("content_refs", {})
+                if file_hash not in content_refs:
+                    with span("store_content", filename=file.name):
+                        content_refs[file_hash] = content_store.put_file(text_path)
+                documents.append(ClinicalDocument(
+                    doc_id=f"DOC-{idx+1:03d}",
+                    doc_type=doc_type,
+                    content_ref=content_refs[file_hash],
+                    metadata={
+                        "filename": file.name,
+                        "size": content_store.size(content_refs[file_hash]),
+                        "sha256": file_hash
+                    }
+                ))
+                st.success(f"Successfully processed {file.name}")
             except Exception as e:
                 st.error(f"Error processing {file.name}: {str(e)}")
-            finally:
-                file.seek(0)
     
     return documents
 
@@ -119,13 +110,23 @@ def display_header():
         st.title("Clinical Trials AI Assistant")
         st.write("Powered by Multi-Agent AI System")
 
+# Analysis Mode choices and the main.ANALYSIS_MODES they run
+ANALYSIS_MODE_LABELS = {
+    "Comprehensive": "comprehensive",
+    "Safety Focus": "safety",
+    "Quality Focus": "quality"
+}
+
 def display_analysis_settings():
     with st.expander("Analysis Settings", expanded=False):
         col1, col2 = st.columns(2)
         with col1:
-            st.selectbox(
+            # Kept outside the widget's own state, which is dropped while the Settings page is not shown
+            labels = list(ANALYSIS_MODE_LABELS)
+            st.session_state.analysis_mode = st.selectbox(
                 "Analysis Mode",
-                ["Comprehensive", "Safety Focus", "Quality Focus"]
+                labels,
+                index=labels.index(st.session_state.get("analysis_mode", "Comprehensive"))
             )
         with col2:
             st.slider(
@@ -135,12 +136,161 @@ def display_analysis_settings():
                 value=3
             )
 
-def display_progress():
-    progress_bar = st.progress(0)
-    for percent_complete in range(100):
-        time.sleep(0.01)
-        progress_bar.progress(percent_complete + 1)
-    st.success("Analysis Complete!")
+def display_profiling_settings():
+    with st.expander("Profiling", expanded=False):
+        # Kept outside the widgets' own state, like the analysis mode
+        st.session_state.profiling = st.toggle(
+            "Trace analysis runs",
+            value=st.session_state.get("profiling", False),
+            help="Records ingestion, each agent, LLM call, prompt construction and output parsing as spans"
+        )
+        st.session_state.cprofile_nodes = st.checkbox(
+            "Also run each agent under cProfile",
+            value=st.session_state.get("cprofile_nodes", PROFILING_CONFIG["cprofile_nodes"]),
+            disabled=not st.session_state.profiling
+        )
+
+def flame_chart(rows):
+    """Altair chart with one bar per span, laid out by start time and nesting depth"""
+    frame = pd.DataFrame([
+        {
+            "name": row["name"],
+            "depth": row["depth"],
+            "start_ms": row["start_ms"],
+            "end_ms": row["end_ms"],
+            "duration_ms": round(row["duration_ms"], 2),
+            "details": ", ".join(f"{key}={value}" for key, value in row["attributes"].items())
+        }
+        for row in rows
+    ])
+    return alt.Chart(frame).mark_bar(stroke="white", strokeWidth=0.5).encode(
+        x=alt.X("start_ms:Q", title="Time since start (ms)"),
+        x2="end_ms:Q",
+        y=alt.Y("depth:O", title="Depth"),
+        color=alt.Color("name:N", legend=None),
+        tooltip=["name", "duration_ms", "start_ms", "details"]
+    ).properties(height=max(120, 40 * (frame["depth"].max() + 1))).interactive(bind_y=False)
+
+def display_trace_viewer():
+    """Shows a recorded trace as a flame chart with the time spent per span name"""
+    st.header("Trace Viewer")
+    traces = list_traces()
+    if not traces:
+        st.info("No traces recorded yet. Turn on tracing above and run an analysis.")
+        return
+    names = [path.name for path in traces]
+    latest = st.session_state.get("trace_path")
+    index = names.index(os.path.basename(latest)) if latest and os.path.basename(latest) in names else 0
+    path = traces[st.selectbox("Trace", range(len(names)), index=index, format_func=names.__getitem__)]
+
+    rows = load_spans(path)
+    if not rows:
+        st.warning("This trace has no spans.")
+        return
+    limit = PROFILING_CONFIG["flame_chart_max_spans"]
+    if len(rows) > limit:
+        st.caption(f"Showing the first {limit} of {len(rows)} spans.")
+    st.altair_chart(flame_chart(rows[:limit]), use_container_width=True)
+
+    totals = pd.DataFrame(self_times(rows))
+    totals[["total_ms", "self_ms"]] = totals[["total_ms", "self_ms"]].round(1)
+    st.dataframe(totals, use_container_width=True, hide_index=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download trace (OTLP JSON)", path.read_bytes(), file_name=path.name,
+                           mime="application/json")
+    profiles = sorted(path.with_suffix("").glob("*.prof"))
+    with col2:
+        if profiles:
+            profile = st.selectbox("cProfile dump", profiles, format_func=lambda profile: profile.name)
+            st.download_button("Download cProfile dump", profile.read_bytes(), file_name=profile.name)
+
+# Trials and analyses offered in the results pickers
+RESULTS_PAGE_LIMIT = 500
+
+NODE_LABELS = {
+    "analyze_protocol": "Protocol analysis",
+    "monitor_safety": "Safety review",
+    "monitor_quality": "Quality review",
+    "generate_recommendations": "Recommendations",
+    "generate_report": "Final report"
+}
+
+def run_streaming_analysis(trial_id, documents, analysis_mode="comprehensive"):
+    """Runs the analysis graph, rendering each agent's output as soon as it finishes"""
+    status = st.status("Analyzing documents...", expanded=True)
+    protocol_slot = st.empty()
+    safety_slot = st.empty()
+    quality_slot = st.empty()
+    recommendations_slot = st.empty()
+    report_slot = st.empty()
+    report_text = ""
+    results = None
+
+    for event, node, data in stream_clinical_trial(trial_id, documents, analysis_mode):
+        if event == "token":
+            report_text += data
+            report_slot.markdown(report_text)
+        elif event == "update":
+            status.write(f"✓ {NODE_LABELS.get(node, node)} complete")
+            if "protocol_analysis" in data:
+                with protocol_slot.container():
+                    display_protocol_analysis(data["protocol_analysis"])
+            if "safety_alerts" in data:
+                with safety_slot.container():
+                    display_safety_alerts(data["safety_alerts"])
+            if "quality_issues" in data:
+                with quality_slot.container():
+                    display_quality_issues(data["quality_issues"])
+            if "recommendations" in data:
+                with recommendations_slot.container():
+                    display_recommendations(data["recommendations"])
+            if "final_report" in data:
+                with report_slot.container():
+                    display_final_report(data["final_report"])
+        elif event == "done":
+            results = data
+
+    status.update(label="Analysis Complete!", state="complete", expanded=False)
+    return results
+
+def display_metrics_summary():
+    with st.expander("Performance Metrics", expanded=True):
+        nodes = metrics.registry.node_summary()
+        if nodes:
+            metrics_df = pd.DataFrame([
+                {
+                    "Node": node,
+                    "Calls": totals["calls"],
+                    "Errors": totals["errors"],
+                    "Avg Wall (s)": round(totals["wall_seconds"] / totals["calls"], 2) if totals["calls"] else 0.0,
+                    "Wait (s)": round(totals["wait_seconds"], 2),
+                    "LLM Requests": totals["llm_requests"],
+                    "Prompt Tokens": totals["prompt_tokens"],
+                    "Completion Tokens": totals["completion_tokens"],
+                    "Retries": totals["retries"],
+                    "Cache Hits": totals["cache_hits"],
+                    "Batch Served": totals["batch_served"]
+                }
+                for node, totals in nodes.items()
+            ])
+            st.dataframe(metrics_df, use_container_width=True)
+        else:
+            st.info("No analyses have run in this process yet")
+
+        cache_stats = llm_cache.stats()
+        st.write(
+            f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']}/{cache_stats['max_entries']} entries"
+        )
+
+        if st.button("Start Prometheus endpoint"):
+            try:
+                host, port = metrics.start_metrics_server()
+                st.success(f"Serving metrics at http://{host}:{port}/metrics")
+            except OSError as e:
+                st.error(f"Could not start metrics endpoint: {str(e)}")
 
 def display_protocol_analysis(protocol_analysis):
     with st.expander("Protocol Analysis", expanded=True):
@@ -210,8 +360,17 @@ def display_quality_issues(quality_issues):
 def display_recommendations(recommendations):
     with st.expander("Recommendations", expanded=True):
         if recommendations:
-            for idx, rec in enumerate(recommendations, 1):
-                st.write(f"{idx}. {rec}")
+            recs_df = pd.DataFrame([
+                {
+                    "Priority": rec.priority,
+                    "Recommendation": rec.recommendation,
+                    "Rationale": rec.rationale,
+                    "Alerts": ", ".join(rec.related_alert_ids),
+                    "Issues": ", ".join(rec.related_issue_ids)
+                }
+                for rec in recommendations
+            ])
+            st.dataframe(recs_df, use_container_width=True)
         else:
             st.info("No recommendations available")
 
@@ -222,6 +381,68 @@ def display_final_report(final_report):
         else:
             st.info("Final report not yet generated")
 
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+def select_stored_analysis():
+    """Lets the user pick a trial and one of its stored analyses, returning it loaded from the results store"""
+    trials = results_store.list_trials(limit=RESULTS_PAGE_LIMIT).items
+    if not trials:
+        return None
+    trial_ids = [trial["trial_id"] for trial in trials]
+    current = st.session_state.get("results", {}) or {}
+    col1, col2 = st.columns(2)
+    with col1:
+        trial_id = st.selectbox(
+            "Trial",
+            trial_ids,
+            index=trial_ids.index(current["trial_id"]) if current.get("trial_id") in trial_ids else 0
+        )
+    with col2:
+        history = results_store.history(trial_id, limit=RESULTS_PAGE_LIMIT).items
+        analysis = st.selectbox(
+            "Analysis",
+            history,
+            format_func=lambda item: (
+                f"{format_time(item['created_at'])} - {item['alerts']} alerts, {item['issues']} issues"
+            )
+        )
+    return results_store.load(analysis["analysis_id"])
+
+def display_results_search():
+    """Filters stored alerts and issues across trials, a page at a time"""
+    kind = st.radio("Show", ["Safety alerts", "Quality issues"], horizontal=True)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        trial_id = st.text_input("Trial ID filter", value="")
+    with col2:
+        level = st.selectbox("Minimum severity / impact", ["low", "medium", "high", "critical"])
+    with col3:
+        latest_only = st.checkbox("Latest analysis per trial only", value=True)
+    page_size = 50
+    page = st.number_input("Page", min_value=1, value=1, step=1)
+
+    if kind == "Safety alerts":
+        result = results_store.query_alerts(
+            trial_id=trial_id or None, min_severity=level, latest_only=latest_only,
+            limit=page_size, offset=(page - 1) * page_size
+        )
+        columns = ["trial_id", "alert_id", "severity", "description", "created_at"]
+    else:
+        category = st.selectbox("Category", ["All"] + results_store.categories())
+        result = results_store.query_issues(
+            trial_id=trial_id or None, categories=None if category == "All" else [category],
+            min_impact=level, latest_only=latest_only, limit=page_size, offset=(page - 1) * page_size
+        )
+        columns = ["trial_id", "issue_id", "category", "impact_level", "description", "created_at"]
+
+    if result.items:
+        frame = pd.DataFrame(result.items)[columns]
+        frame["created_at"] = frame["created_at"].map(format_time)
+        st.dataframe(frame, use_container_width=True)
+    pages = max(1, -(-result.total // page_size))
+    st.caption(f"{result.total} matches, page {page} of {pages}")
+
 def main():
     # Load configuration
     config = load_config()
@@ -249,21 +470,35 @@ def main():
     
     # Main content
     if st.session_state.nav == "Document Upload":
-        documents = upload_documents()
-        
-        if documents and st.button("Start Analysis"):
-            st.session_state.documents = documents
-            st.session_state.nav = "Analysis Results"
-            
-            with st.spinner("Analyzing documents..."):
-                display_progress()
-                results = analyze_clinical_trial("TRIAL-001", documents)
-                st.session_state.results = results
-            st.rerun()
+        # With tracing on, a run that starts an analysis is traced from ingestion onwards
+        recording = tracing(
+            "app analysis", cprofile=st.session_state.get("cprofile_nodes", False)
+        ) if st.session_state.get("profiling") else nullcontext()
+        analyzed = False
+        with recording as trace:
+            documents = upload_documents()
+
+            trial_id = st.text_input("Trial ID", value="TRIAL-001")
+            mode_label = st.session_state.get("analysis_mode", "Comprehensive")
+            st.caption(f"Analysis mode: {mode_label} (change it under Settings)")
+            if documents and st.button("Start Analysis"):
+                st.session_state.documents = documents
+                # Results render in place as each agent finishes; no rerun needed
+                with span("analysis", trial_id=trial_id, analysis_mode=ANALYSIS_MODE_LABELS[mode_label]):
+                    results = run_streaming_analysis(trial_id, documents, ANALYSIS_MODE_LABELS[mode_label])
+                with span("save_results"):
+                    st.session_state.results = results
+                    st.session_state.analysis_id = results_store.save(results, source="app")
+                analyzed = True
+                st.info("Results are saved and available under Analysis Results.")
+        if trace is not None and analyzed:
+            st.session_state.trace_path = str(trace.export())
+            st.caption("Trace recorded; view it under Settings.")
     
     elif st.session_state.nav == "Analysis Results":
-        if results := st.session_state.get("results"):
-            tab1, tab2, tab3 = st.tabs(["Analysis", "Alerts", "Report"])
+        results = select_stored_analysis()
+        if results:
+            tab1, tab2, tab3, tab4 = st.tabs(["Analysis", "Alerts", "Report", "Search All Trials"])
             
             with tab1:
                 display_protocol_analysis(results.get("protocol_analysis"))
@@ -275,11 +510,17 @@ def main():
             
             with tab3:
                 display_final_report(results.get("final_report"))
+
+            with tab4:
+                display_results_search()
         else:
             st.warning("No analysis results available. Please upload documents first.")
     
     elif st.session_state.nav == "Settings":
         display_analysis_settings()
+        display_profiling_settings()
+        display_metrics_summary()
+        display_trace_viewer()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
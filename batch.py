@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+import agents
+from config import BATCH_CONFIG
+from main import get_trial_graph, create_initial_state
+from models import DocumentInput
+
+
+class RateLimiter:
+    """Async token bucket limiting LLM requests and prompt tokens per minute"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.wait_time = 0.0
+
+    def _refill(self):
+        """Adds the allowance accrued since the last refill, capped at one minute's worth"""
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute,
+                self._request_allowance + elapsed_minutes * self.requests_per_minute
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute,
+                self._token_allowance + elapsed_minutes * self.tokens_per_minute
+            )
+
+    def _seconds_until_available(self, tokens):
+        """Returns how long to wait before one request of the given size fits, or 0 if it fits now"""
+        wait = 0.0
+        if self.requests_per_minute and self._request_allowance < 1:
+            wait = max(wait, (1 - self._request_allowance) / self.requests_per_minute * 60)
+        if self.tokens_per_minute and self._token_allowance < tokens:
+            wait = max(wait, (tokens - self._token_allowance) / self.tokens_per_minute * 60)
+        return wait
+
+    async def acquire(self, tokens=0):
+        """Waits until one request of the given prompt size is within both limits"""
+        if self.tokens_per_minute:
+            # A single request larger than the whole budget would otherwise wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        started = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while (wait := self._seconds_until_available(tokens)) > 0:
+                await asyncio.sleep(wait)
+                self._refill()
+            if self.requests_per_minute:
+                self._request_allowance -= 1
+            if self.tokens_per_minute:
+                self._token_allowance -= tokens
+            self.requests += 1
+            self.tokens += tokens
+        self.wait_time += time.monotonic() - started
+
+
+class BatchResult(BaseModel):
+    trial_id: str
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    elapsed: float
+
+
+class BatchStats:
+    """Tracks progress and throughput of a batch run"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.limiter = None
+
+    def record(self, result: BatchResult):
+        if result.error:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self.total_latency += result.elapsed
+
+    def report(self):
+        """Returns a throughput summary suitable for sizing a batch job"""
+        elapsed = time.monotonic() - self.started_at
+        finished = self.completed + self.failed
+        report = {
+            "completed": self.completed,
+            "failed": self.failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "trials_per_minute": round(finished / elapsed * 60, 2) if elapsed else 0.0,
+            "mean_trial_latency_seconds": round(self.total_latency / finished, 2) if finished else 0.0
+        }
+        if self.limiter is not None:
+            report.update({
+                "llm_requests": self.limiter.requests,
+                "prompt_tokens": self.limiter.tokens,
+                "rate_limit_wait_seconds": round(self.limiter.wait_time, 2)
+            })
+        return report
+
+
+async def analyze_trials_batch(
+    trials,
+    max_concurrency=BATCH_CONFIG["max_concurrency"],
+    requests_per_minute=BATCH_CONFIG["requests_per_minute"],
+    tokens_per_minute=BATCH_CONFIG["tokens_per_minute"],
+    stats=None
+):
+    """Analyzes an iterable of (trial_id, documents) pairs, yielding a BatchResult as each trial finishes
+
+    At most max_concurrency trials are in flight and trials are pulled from the
+    iterable lazily, so very large portfolios are never fully loaded into memory.
+    """
+    stats = stats or BatchStats()
+    stats.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    graph = get_trial_graph()
+
+    async def run_trial(trial_id, documents):
+        started = time.monotonic()
+        try:
+            final_state = await graph.ainvoke(create_initial_state(trial_id, documents))
+            return BatchResult(trial_id=trial_id, result=final_state, elapsed=time.monotonic() - started)
+        except Exception as e:
+            return BatchResult(trial_id=trial_id, error=str(e), elapsed=time.monotonic() - started)
+
+    previous_limiter = agents.rate_limiter
+    agents.rate_limiter = stats.limiter
+    try:
+        trials = iter(trials)
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_concurrency:
+                try:
+                    trial_id, documents = next(trials)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.create_task(run_trial(trial_id, documents)))
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                stats.record(result)
+                yield result
+    finally:
+        agents.rate_limiter = previous_limiter
+
+
+def load_trials(path):
+    """Reads (trial_id, documents) pairs from a JSONL file, one trial per line"""
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            documents = [DocumentInput(**doc).to_document() for doc in record["documents"]]
+            yield record["trial_id"], documents
+
+
+def to_jsonable(obj):
+    return obj.model_dump() if isinstance(obj, BaseModel) else str(obj)
+
+
+def state_to_dict(state):
+    """Returns a final graph state without its input documents, ready for json.dumps(default=to_jsonable)"""
+    return {key: value for key, value in state.items() if key != "documents"}
+
+
+def serialize_result(result: BatchResult):
+    """Converts a batch result, including the Pydantic models in its state, to JSON"""
+    data = result.model_dump(exclude={"result"})
+    if result.result is not None:
+        data["result"] = state_to_dict(result.result)
+    return json.dumps(data, default=to_jsonable)
+
+
+async def run_batch(args):
+    stats = BatchStats()
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        async for result in analyze_trials_batch(
+            load_trials(args.input),
+            max_concurrency=args.concurrency,
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            stats=stats
+        ):
+            output.write(serialize_result(result) + "\n")
+            output.flush()
+            status = f"failed: {result.error}" if result.error else "done"
+            print(f"{result.trial_id} {status} ({result.elapsed:.1f}s)", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(json.dumps(stats.report(), indent=2), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze many clinical trials with bounded concurrency")
+    parser.add_argument("input", help="JSONL file with one {\"trial_id\", \"documents\"} record per line")
+    parser.add_argument("-o", "--output", help="JSONL file for results (defaults to stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONFIG["max_concurrency"])
+    parser.add_argument("--rpm", type=int, default=BATCH_CONFIG["requests_per_minute"],
+                        help="Maximum LLM requests per minute")
+    parser.add_argument("--tpm", type=int, default=BATCH_CONFIG["tokens_per_minute"],
+                        help="Maximum prompt tokens per minute")
+    asyncio.run(run_batch(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+# Local stand-in for an OpenAI-compatible batch API, for testing provider_batch.py.
+# Requests are forwarded to --upstream (any chat completions endpoint, e.g. a
+# local vLLM or Ollama server) or, without one, answered with stand-in content
+# that matches the requested JSON schema.
+
+app = FastAPI(title="Batch API stand-in")
+files = {}
+batches = {}
+settings = {"upstream": None, "api_key": None, "delay": 0.0}
+lock = threading.Lock()
+
+
+class BatchRequest(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str
+    metadata: dict = None
+
+
+def stand_in_value(schema, definitions, name, index):
+    """Builds a value matching a JSON schema"""
+    if "$ref" in schema:
+        return stand_in_value(definitions[schema["$ref"].split("/")[-1]], definitions, name, index)
+    if "anyOf" in schema:
+        option = next(option for option in schema["anyOf"] if option.get("type") != "null")
+        return stand_in_value(option, definitions, name, index)
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            field: stand_in_value(field_schema, definitions, field, index)
+            for field, field_schema in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [stand_in_value(schema.get("items", {}), definitions, name, f"{index}.{i}") for i in range(2)]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 0.5
+    if kind == "boolean":
+        return True
+    if "enum" in schema:
+        return schema["enum"][0]
+    return f"Stand-in {name.replace('_', ' ')} {index}"
+
+
+def stand_in_completion(body, index):
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        content = json.dumps(stand_in_value(schema, schema.get("$defs", {}), "value", index))
+    else:
+        content = "Stand-in response."
+    prompt_tokens = sum(len(message.get("content") or "") for message in body["messages"]) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4
+        }
+    }
+
+
+def complete(body, index):
+    """Returns (status code, response body) for one batched chat completion"""
+    if settings["upstream"] is None:
+        return 200, stand_in_completion(body, index)
+    headers = {"Authorization": f"Bearer {settings['api_key']}"} if settings["api_key"] else {}
+    response = httpx.post(f"{settings['upstream']}/chat/completions", json=body, headers=headers, timeout=600)
+    return response.status_code, response.json()
+
+
+def store_file(content, purpose, filename):
+    file_id = f"file-{uuid.uuid4().hex}"
+    with lock:
+        files[file_id] = {
+            "content": content,
+            "object": {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed"
+            }
+        }
+    return file_id
+
+
+def process_batch(batch_id):
+    batch = batches[batch_id]
+    batch["status"] = "in_progress"
+    batch["in_progress_at"] = int(time.time())
+    lines = [line for line in files[batch["input_file_id"]]["content"].decode("utf-8").splitlines() if line.strip()]
+    batch["request_counts"]["total"] = len(lines)
+    time.sleep(settings["delay"])
+
+    output = []
+    for index, line in enumerate(lines):
+        request = json.loads(line)
+        try:
+            status_code, body = complete(request["body"], index)
+            output.append({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": status_code, "body": body},
+                "error": None
+            })
+            batch["request_counts"]["completed" if status_code == 200 else "failed"] += 1
+        except Exception as e:
+            output.append({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": None,
+                "error": {"code": "server_error", "message": str(e)}
+            })
+            batch["request_counts"]["failed"] += 1
+
+    content = "\n".join(json.dumps(record) for record in output).encode("utf-8")
+    batch["output_file_id"] = store_file(content, "batch_output", f"{batch_id}_output.jsonl")
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+@app.post("/v1/files")
+async def upload_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    file_id = store_file(await file.read(), purpose, file.filename)
+    return files[file_id]["object"]
+
+
+@app.get("/v1/files/{file_id}")
+def get_file(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="No such file")
+    return files[file_id]["object"]
+
+
+@app.get("/v1/files/{file_id}/content")
+def get_file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="No such file")
+    return Response(content=files[file_id]["content"], media_type="application/octet-stream")
+
+
+@app.post("/v1/batches")
+def create_batch(request: BatchRequest):
+    if request.input_file_id not in files:
+        raise HTTPException(status_code=404, detail="No such file")
+    batch_id = f"batch_{uuid.uuid4().hex}"
+    batches[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": request.endpoint,
+        "input_file_id": request.input_file_id,
+        "completion_window": request.completion_window,
+        "status": "validating",
+        "output_file_id": None,
+        "error_file_id": None,
+        "created_at": int(time.time()),
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        "metadata": request.metadata
+    }
+    threading.Thread(target=process_batch, args=(batch_id,), daemon=True).start()
+    return batches[batch_id]
+
+
+@app.get("/v1/batches/{batch_id}")
+def get_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="No such batch")
+    return batches[batch_id]
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+def cancel_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="No such batch")
+    if batches[batch_id]["status"] not in ("completed", "failed"):
+        batches[batch_id]["status"] = "cancelled"
+    return batches[batch_id]
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local stand-in for an OpenAI-compatible batch API")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--upstream", help="Chat completions base URL to forward requests to, e.g. http://localhost:11434/v1")
+    parser.add_argument("--api-key", help="API key for the upstream server")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds each batch waits before processing")
+    args = parser.parse_args()
+    settings.update(upstream=args.upstream.rstrip("/") if args.upstream else None, api_key=args.api_key, delay=args.delay)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import statistics
+import time
+import tracemalloc
+import typing
+from datetime import datetime
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+import agents
+import metrics
+from batch import analyze_trials_batch
+from cache import llm_cache
+from config import DATA_DIR
+from main import analyze_clinical_trial, analyze_clinical_trial_async
+from models import ClinicalDocument
+from tokens import count_message_tokens, count_tokens
+
+
+def canned_value(annotation, label, seed, items_per_list):
+    """Builds a deterministic value for a field annotation"""
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin is typing.Union:
+        return canned_value(next(arg for arg in args if arg is not type(None)), label, seed, items_per_list)
+    if origin is typing.Literal:
+        return args[0]
+    if origin in (list, typing.List):
+        return [canned_value(args[0], label, f"{seed}-{i}", items_per_list) for i in range(items_per_list)]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return canned_output(annotation, seed, items_per_list)
+    if annotation is int:
+        return int(hashlib.sha256(seed.encode()).hexdigest(), 16) % 5 + 1
+    if annotation is float:
+        return 0.5
+    if annotation is bool:
+        return True
+    return f"Synthetic {label.replace('_', ' ')} {seed}"
+
+
+def canned_output(schema, seed, items_per_list=3):
+    """Builds a deterministic instance of a Pydantic schema"""
+    return schema(**{
+        name: canned_value(field.annotation, name, seed, items_per_list)
+        for name, field in schema.model_fields.items()
+    })
+
+
+class FakeChatModel(BaseChatModel):
+    """Local chat model with configurable latency and canned outputs, for offline benchmarks"""
+
+    model_name: str = "fake-benchmark-model"
+    temperature: float = 0
+    latency: float = 0.5
+    items_per_list: int = 3
+    report_text: str = "Synthetic report paragraph describing protocol, safety and quality findings."
+
+    @property
+    def _llm_type(self):
+        return "fake-benchmark"
+
+    def _usage(self, messages, completion):
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = count_tokens(completion)
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def _message(self, messages):
+        return AIMessage(content=self.report_text, usage_metadata=self._usage(messages, self.report_text))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    def with_structured_output(self, schema, *, include_raw=False, **kwargs):
+        def respond(messages):
+            # Seed on the prompt so different chunks yield different, but repeatable, findings
+            seed = hashlib.sha256(messages[-1].content.encode("utf-8")).hexdigest()[:8]
+            parsed = canned_output(schema, seed, self.items_per_list)
+            if not include_raw:
+                return parsed
+            raw = AIMessage(content="", usage_metadata=self._usage(messages, parsed.model_dump_json()))
+            return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+        def invoke(messages):
+            time.sleep(self.latency)
+            return respond(messages)
+
+        async def ainvoke(messages):
+            await asyncio.sleep(self.latency)
+            return respond(messages)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+
+SECTION_TITLES = {
+    "protocol": ["STUDY DESIGN", "ELIGIBILITY CRITERIA", "STUDY ENDPOINTS", "SAFETY MONITORING"],
+    "safety_report": ["ADVERSE EVENTS", "SERIOUS ADVERSE EVENTS", "LABORATORY FINDINGS"],
+    "case_report": ["SUBJECT HISTORY", "VISIT DATA", "CONCOMITANT MEDICATIONS"]
+}
+WORDS = (
+    "subject dose visit adverse event baseline laboratory value elevated reported investigator "
+    "randomized placebo cohort endpoint criteria hepatic renal follow-up deviation site"
+).split()
+
+
+def generate_documents(count, doc_tokens, seed=0):
+    """Generates a synthetic trial corpus: one protocol plus safety and case reports"""
+    rng = random.Random(seed)
+    documents = []
+    for index in range(count):
+        doc_type = "protocol" if index == 0 else rng.choice(["safety_report", "case_report"])
+        sections = []
+        tokens = 0
+        while tokens < doc_tokens:
+            title = rng.choice(SECTION_TITLES[doc_type])
+            paragraph = " ".join(rng.choice(WORDS) for _ in range(80)) + "."
+            section = f"{len(sections) + 1}. {title}\n\n{paragraph}"
+            sections.append(section)
+            tokens += count_tokens(section)
+        documents.append(ClinicalDocument.from_text(
+            doc_id=f"DOC-{index + 1:03d}",
+            doc_type=doc_type,
+            content="\n\n".join(sections),
+            metadata={"synthetic": True}
+        ))
+    return documents
+
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        "mean": round(statistics.mean(ordered), 4),
+        "p50": round(ordered[len(ordered) // 2], 4),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        "max": round(ordered[-1], 4)
+    }
+
+
+def node_summary():
+    return {
+        node: {
+            "calls": totals["calls"],
+            "mean_wall_seconds": round(totals["wall_seconds"] / totals["calls"], 4) if totals["calls"] else 0.0,
+            "llm_requests": totals["llm_requests"],
+            "prompt_tokens": totals["prompt_tokens"],
+            "completion_tokens": totals["completion_tokens"]
+        }
+        for node, totals in metrics.registry.node_summary().items()
+    }
+
+
+def run_scenario(mode, documents, runs, concurrency):
+    """Runs one benchmark scenario and returns its measurements"""
+    metrics.registry.reset()
+    samples = []
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    if mode == "sync":
+        for run in range(runs):
+            run_started = time.perf_counter()
+            analyze_clinical_trial(f"BENCH-{run}", documents)
+            samples.append(time.perf_counter() - run_started)
+    elif mode == "async":
+        for run in range(runs):
+            run_started = time.perf_counter()
+            asyncio.run(analyze_clinical_trial_async(f"BENCH-{run}", documents))
+            samples.append(time.perf_counter() - run_started)
+    elif mode == "batch":
+        async def run_batch():
+            trials = ((f"BENCH-{run}", documents) for run in range(runs))
+            async for result in analyze_trials_batch(
+                trials, max_concurrency=concurrency, requests_per_minute=None, tokens_per_minute=None
+            ):
+                if result.error:
+                    raise RuntimeError(result.error)
+                samples.append(result.elapsed)
+        asyncio.run(run_batch())
+
+    elapsed = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "mode": mode,
+        "documents": len(documents),
+        "corpus_tokens": sum(count_tokens(doc.content) for doc in documents),
+        "runs": runs,
+        "latency_seconds": latency_summary(samples),
+        "trials_per_second": round(runs / elapsed, 4),
+        "peak_memory_mb": round(peak_memory / 1024 / 1024, 2),
+        "nodes": node_summary()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the trial graph against a fake LLM")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake LLM latency per request in seconds")
+    parser.add_argument("--doc-counts", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--doc-tokens", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--modes", nargs="+", default=["sync", "async", "batch"], choices=["sync", "async", "batch"])
+    parser.add_argument("--runs", type=int, default=3, help="Trials per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Batch mode concurrency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Results JSON file (defaults to data/benchmarks/)")
+    args = parser.parse_args()
+
+    # Every request must reach the fake model for the numbers to be comparable
+    llm_cache.enabled = False
+    agents.set_llm(FakeChatModel(latency=args.latency))
+
+    scenarios = []
+    for doc_count in args.doc_counts:
+        for doc_tokens in args.doc_tokens:
+            documents = generate_documents(doc_count, doc_tokens, seed=args.seed)
+            for mode in args.modes:
+                result = run_scenario(mode, documents, args.runs, args.concurrency)
+                result["doc_tokens"] = doc_tokens
+                scenarios.append(result)
+                print(
+                    f"{mode:>5} docs={doc_count:<4} tokens/doc={doc_tokens:<6} "
+                    f"p50={result['latency_seconds']['p50']:.2f}s "
+                    f"trials/s={result['trials_per_second']:.2f} "
+                    f"peak={result['peak_memory_mb']:.1f}MB"
+                )
+
+    output = args.output
+    if output is None:
+        (DATA_DIR / "benchmarks").mkdir(parents=True, exist_ok=True)
+        output = DATA_DIR / "benchmarks" / f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump({"config": vars(args), "scenarios": scenarios}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from config import CACHE_CONFIG
+
+
+class LLMResponseCache:
+    """Persistent SQLite cache of LLM responses with size-bounded LRU eviction"""
+
+    def __init__(self, path, max_entries=10000, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Opens the cache database on first use"""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(route, messages, schema=None):
+        """Hashes everything that determines an LLM response into a cache key
+
+        route is the client's resolved settings (see routing.client_route), so
+        different endpoints or max_tokens caps never share entries.
+        """
+        payload = {
+            "route": route,
+            "messages": [{"role": message.type, "content": message.content} for message in messages],
+            "schema": schema.model_json_schema() if schema else None
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_accessed = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        """Stores value under key and evicts the least recently used entries"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            conn.execute(
+                """DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+            conn.commit()
+
+    def clear(self):
+        """Removes every cached response and resets the counters"""
+        with self._lock:
+            self._connect().execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns hit/miss counters and the current number of entries"""
+        entries = 0
+        if self.enabled:
+            with self._lock:
+                entries = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries
+        }
+
+
+# Shared cache instance
+llm_cache = LLMResponseCache(
+    CACHE_CONFIG["path"],
+    max_entries=CACHE_CONFIG["max_entries"],
+    enabled=CACHE_CONFIG["enabled"]
+)
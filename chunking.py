@@ -0,0 +1,165 @@
+import re
+
+from config import CHUNK_CONFIG
+from dedup import cluster
+from tokens import count_tokens, CHARS_PER_TOKEN
+
+# Lines that open a new section: markdown headings, numbered headings ("5.2 Safety") and ALL CAPS titles
+HEADING_PATTERN = re.compile(r"^(#{1,6}\s+\S|\d+(\.\d+)*\.?\s+[A-Z]|[A-Z][A-Z0-9 /&,()-]{3,}$)")
+
+SEVERITY_RANK = {"low": 0, "medium": 1, "moderate": 1, "high": 2, "severe": 2, "critical": 3}
+
+
+def is_heading(paragraph):
+    first_line = paragraph.lstrip().split("\n", 1)[0].strip()
+    return len(first_line) < 120 and bool(HEADING_PATTERN.match(first_line))
+
+
+def split_oversized(text, chunk_tokens):
+    """Splits a single paragraph that exceeds the chunk size on line, then character, boundaries"""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for line in text.split("\n"):
+        line_tokens = count_tokens(line)
+        if line_tokens > chunk_tokens:
+            window = chunk_tokens * CHARS_PER_TOKEN
+            pieces.extend(line[i:i + window] for i in range(0, len(line), window))
+            continue
+        if current and current_tokens + line_tokens > chunk_tokens:
+            pieces.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def iter_chunks(documents, chunk_tokens=None):
+    """Yields the content of documents packed into chunks of at most chunk_tokens, breaking on section boundaries
+
+    Documents are streamed paragraph by paragraph, so only the chunk being
+    built is held in memory. Small documents share a chunk, so a document set
+    that fits the budget yields exactly one chunk identical to joining the
+    documents with blank lines.
+    """
+    chunk_tokens = chunk_tokens or CHUNK_CONFIG["chunk_tokens"]
+    current = []
+    current_tokens = 0
+
+    for doc in documents:
+        for paragraph in doc.paragraphs():
+            paragraph_tokens = count_tokens(paragraph)
+            if paragraph_tokens > chunk_tokens:
+                if current:
+                    yield "\n\n".join(current)
+                    current, current_tokens = [], 0
+                yield from split_oversized(paragraph, chunk_tokens)
+                continue
+            # Prefer to break before a heading once the chunk is half full
+            at_section_break = is_heading(paragraph) and current_tokens > chunk_tokens // 2
+            if current and (current_tokens + paragraph_tokens > chunk_tokens or at_section_break):
+                yield "\n\n".join(current)
+                current, current_tokens = [], 0
+            current.append(paragraph)
+            current_tokens += paragraph_tokens
+    if current:
+        yield "\n\n".join(current)
+
+
+def chunk_documents(documents, chunk_tokens=None):
+    """Packs the content of documents into a list of chunks of at most chunk_tokens (see iter_chunks)"""
+    return list(iter_chunks(documents, chunk_tokens))
+
+
+def normalize_text(text):
+    return " ".join(re.sub(r"[^a-z0-9 ]", " ", text.lower()).split())
+
+
+def unique(items):
+    """Removes duplicates from a list of strings, ignoring case and punctuation and keeping order"""
+    seen = set()
+    result = []
+    for item in items:
+        key = normalize_text(item)
+        if key not in seen:
+            seen.add(key)
+            result.append(item)
+    return result
+
+
+def unique_id(item_id, used_ids):
+    """Returns item_id, suffixed if another merged item already uses it"""
+    candidate = item_id
+    suffix = 2
+    while candidate in used_ids:
+        candidate = f"{item_id}-{suffix}"
+        suffix += 1
+    used_ids.add(candidate)
+    return candidate
+
+
+def merge_protocol_analyses(analyses):
+    """Merges per-chunk protocol analyses into one, deduplicating every list"""
+    analyses = [analysis for analysis in analyses if analysis is not None]
+    if not analyses:
+        return None
+    merged = analyses[0].model_copy()
+    for field in type(merged).model_fields:
+        setattr(merged, field, unique([item for analysis in analyses for item in getattr(analysis, field)]))
+    return merged
+
+
+def merge_safety_alerts(alerts):
+    """Merges alerts describing the same or a near-identical concern, keeping the highest severity and all recommendations"""
+    merged = {}
+    for alert, key in zip(alerts, cluster([normalize_text(alert.description) for alert in alerts])):
+        if key not in merged:
+            merged[key] = alert.model_copy()
+            continue
+        existing = merged[key]
+        if SEVERITY_RANK.get(alert.severity.lower(), 0) > SEVERITY_RANK.get(existing.severity.lower(), 0):
+            existing.severity = alert.severity
+        existing.recommendations = unique(existing.recommendations + alert.recommendations)
+        existing.related_criteria = unique(existing.related_criteria + alert.related_criteria)
+
+    used_ids = set()
+    for alert in merged.values():
+        alert.alert_id = unique_id(alert.alert_id, used_ids)
+    return list(merged.values())
+
+
+def merge_quality_issues(issues):
+    """Merges quality issues in the same category with near-identical descriptions, keeping the highest impact"""
+    merged = {}
+    keys = cluster([normalize_text(issue.description) for issue in issues],
+                   groups=[normalize_text(issue.category) for issue in issues])
+    for issue, key in zip(issues, keys):
+        if key not in merged:
+            merged[key] = issue.model_copy()
+            continue
+        existing = merged[key]
+        if SEVERITY_RANK.get(issue.impact_level.lower(), 0) > SEVERITY_RANK.get(existing.impact_level.lower(), 0):
+            existing.impact_level = issue.impact_level
+
+    used_ids = set()
+    for issue in merged.values():
+        issue.issue_id = unique_id(issue.issue_id, used_ids)
+    return list(merged.values())
+
+
+def merge_recommendations(recommendations):
+    """Merges near-identical recommendations, keeping the highest priority and all linked alerts and issues"""
+    merged = {}
+    recommendations = [rec for rec in recommendations if rec.recommendation.strip()]
+    for rec, key in zip(recommendations, cluster([normalize_text(rec.recommendation) for rec in recommendations])):
+        if key not in merged:
+            merged[key] = rec.model_copy()
+            continue
+        existing = merged[key]
+        if SEVERITY_RANK.get(rec.priority.lower(), 0) > SEVERITY_RANK.get(existing.priority.lower(), 0):
+            existing.priority = rec.priority
+        existing.related_alert_ids = unique(existing.related_alert_ids + rec.related_alert_ids)
+        existing.related_issue_ids = unique(existing.related_issue_ids + rec.related_issue_ids)
+    return list(merged.values())
@@ -1,17 +1,155 @@
+import os
 from pathlib import Path
 
 # Project configuration
 PROJECT_ROOT = Path(__file__).parent
 DATA_DIR = PROJECT_ROOT / "data"
 MODELS_DIR = PROJECT_ROOT / "models"
+APP_CONFIG_PATH = PROJECT_ROOT / "clinical_trial_ai.json"
 
-# LLM configuration
+# Default LLM settings; per-agent routes in clinical_trial_ai.json override them (see routing.py)
 LLM_CONFIG = {
-    "model": "gpt-40-mini",
+    "provider": "openai",
+    "model": "gpt-4o-mini",
     "temperature": 0
 }
 
+# LLM response cache (set LLM_CACHE_DISABLED=1 to opt out)
+CACHE_CONFIG = {
+    "enabled": os.getenv("LLM_CACHE_DISABLED", "").lower() not in ("1", "true", "yes"),
+    "path": DATA_DIR / "llm_cache.sqlite",
+    "max_entries": 10000
+}
+
+# Batch analysis
+BATCH_CONFIG = {
+    "max_concurrency": 4,
+    "requests_per_minute": 500,
+    "tokens_per_minute": 200000
+}
+
+# Document chunking for map-reduce extraction
+CHUNK_CONFIG = {
+    "chunk_tokens": 12000,
+    "max_parallel_chunks": 4
+}
+
+# Node metrics registry and Prometheus endpoint
+METRICS_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 9464,
+    "max_trials": 1000,
+    # Per-node JSON log records go to stderr at this level; empty leaves them to the root logger's handlers
+    "log_level": os.getenv("METRICS_LOG_LEVEL", "INFO")
+}
+
+# Upload ingestion
+INGESTION_CONFIG = {
+    "max_workers": 4,
+    "encoding_prefix_bytes": 64 * 1024,
+    "read_chunk_bytes": 1024 * 1024,
+    "inline_max_bytes": 1024 * 1024
+}
+
+# Content-addressed document text under DATA_DIR; text not stored again within max_age_days is pruned
+CONTENT_STORE_CONFIG = {
+    "max_age_days": 30
+}
+
+# Retrieval over large document sets (BM25 index per trial under DATA_DIR)
+RETRIEVAL_CONFIG = {
+    "enabled": True,
+    "min_corpus_tokens": 24000,
+    "passage_tokens": 400,
+    "top_k": 8,
+    "context_tokens": 8000,
+    # Trial indexes kept in memory per process, least recently used evicted first
+    "max_cached_indexes": 8
+}
+
+# Rule-based pre-screening of tabular case report content
+RULES_CONFIG = {
+    "enabled": True,
+    "sniff_chars": 8192,
+    "free_text_min_chars": 40,
+    "medium_impact_fraction": 0.01,
+    "high_impact_fraction": 0.05
+}
+
+# Token budgets for the compact summaries passed to downstream agents, and rows per table in the final report
+SUMMARY_CONFIG = {
+    "item_chars": 300,
+    "protocol_tokens": 800,
+    "alerts_tokens": 1500,
+    "issues_tokens": 1500,
+    "recommendations_tokens": 800,
+    "report_protocol_tokens": 400,
+    "report_findings_tokens": 600,
+    "report_table_rows": 50
+}
+
+# Near-duplicate detection for merging alerts and quality issues (MinHash with LSH)
+DEDUP_CONFIG = {
+    "shingle_chars": 4,
+    "num_perm": 128,
+    "bands": 32,
+    "threshold": 0.6,
+    "cache_size": 20000
+}
+
 # System configuration
 MAX_DOCUMENTS = 100
 MAX_RETRIES = 3
-TIMEOUT = 300  # seconds
\ No newline at end of file
+TIMEOUT = 300  # seconds
+
+# Resilient LLM calls: per-request timeout, retries with backoff, circuit breaker and hedging
+RESILIENCE_CONFIG = {
+    "request_timeout": TIMEOUT,
+    "max_retries": MAX_RETRIES,
+    "backoff_initial": 1.0,
+    "backoff_max": 60.0,
+    "breaker_failure_threshold": 5,
+    "breaker_reset_seconds": 30.0,
+    "hedge_after_seconds": 60.0,  # None disables hedging
+    "node_max_attempts": 2
+}
+
+# Background analysis jobs (SQLite queue under DATA_DIR) and the HTTP API
+JOBS_CONFIG = {
+    "path": DATA_DIR / "jobs.sqlite",
+    "worker_processes": int(os.getenv("JOB_WORKER_PROCESSES", "2")),
+    "jobs_per_worker": 2,
+    "poll_interval": 1.0,
+    "lease_seconds": 4 * TIMEOUT,  # a job whose worker stops renewing its lease is picked up again
+    "trial_lock_poll_interval": 0.2,  # how often a run waiting for another's lease on a trial checks again
+    "max_attempts": MAX_RETRIES
+}
+
+# Continuous safety monitoring of new reports (one subdirectory per trial under watch_dir)
+MONITOR_CONFIG = {
+    "watch_dir": DATA_DIR / "monitor",
+    "poll_interval": 2.0,
+    "settle_seconds": 1.0  # files modified more recently than this may still be being written
+}
+
+# Persistent, queryable store of analysis results
+RESULTS_CONFIG = {
+    "path": DATA_DIR / "results.sqlite",
+    "page_size": 50,
+    "max_page_size": 500
+}
+
+# Provider-side batch API runs for non-urgent re-scoring
+PROVIDER_BATCH_CONFIG = {
+    "poll_interval": 30.0,
+    "completion_window": "24h",
+    "max_requests_per_batch": 50000,
+    "max_wait_seconds": 26 * 3600
+}
+
+# Opt-in tracing of single runs (OTLP/JSON span files and per-node cProfile dumps)
+PROFILING_CONFIG = {
+    "dir": DATA_DIR / "traces",
+    "cprofile_nodes": False,
+    "flame_chart_max_spans": 2000
+}
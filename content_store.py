@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from config import CONTENT_STORE_CONFIG, DATA_DIR
+from ingestion import hash_file
+
+CONTENT_DIR = DATA_DIR / "content"
+
+# A reference is the hex SHA-256 of the text, so it can never name a path outside the store
+REF_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ContentStore:
+    """Content-addressed store of document text, keyed on the SHA-256 of its UTF-8 bytes
+
+    Documents hold only a reference into the store and read their text through
+    a memory map, so pages are shared between sessions and processes and
+    released by the OS under pressure instead of living on the Python heap.
+
+    Storing text again refreshes its modification time; prune() deletes text
+    that has not been stored for a while, so the store only grows with the
+    documents in recent use.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or CONTENT_DIR
+
+    def path(self, ref):
+        if not isinstance(ref, str) or not REF_PATTERN.match(ref):
+            raise ValueError(f"Invalid content reference: {ref!r}")
+        path = self.root / ref[:2] / f"{ref}.txt"
+        if not path.resolve().is_relative_to(self.root.resolve()):
+            raise ValueError(f"Content reference {ref!r} is outside the store")
+        return path
+
+    def _store(self, ref, write):
+        """Writes content for ref through a temporary file unless it is already stored"""
+        path = self.path(ref)
+        if path.exists():
+            # Marks the text as in use for prune()
+            os.utime(path)
+            return ref
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        os.close(fd)
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return ref
+
+    def put(self, text):
+        """Stores text and returns its reference"""
+        data = text.encode("utf-8")
+
+        def write(temp_path):
+            with open(temp_path, "wb") as f:
+                f.write(data)
+
+        return self._store(hashlib.sha256(data).hexdigest(), write)
+
+    def put_file(self, source_path):
+        """Stores a UTF-8 text file, such as an extraction from ingestion, without reading it into memory"""
+        ref = hash_file(source_path)
+
+        def write(temp_path):
+            # A hard link shares the file's blocks; copy when the store is on another filesystem
+            try:
+                os.unlink(temp_path)
+                os.link(source_path, temp_path)
+            except OSError:
+                shutil.copyfile(source_path, temp_path)
+
+        return self._store(ref, write)
+
+    def size(self, ref):
+        """Returns the stored text's size in bytes"""
+        return self.path(ref).stat().st_size
+
+    @contextmanager
+    def open(self, ref):
+        """Yields a read-only memory map of the stored text (bytes for empty text, which cannot be mapped)"""
+        with open(self.path(ref), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def read(self, ref):
+        with self.open(ref) as mapped:
+            return mapped[:].decode("utf-8")
+
+    def read_prefix(self, ref, max_chars):
+        """Returns up to max_chars characters from the start of the stored text"""
+        with self.open(ref) as mapped:
+            # A UTF-8 character is at most 4 bytes; a sequence cut at the end is dropped
+            return mapped[:max_chars * 4].decode("utf-8", errors="ignore")[:max_chars]
+
+    def read_span(self, ref, start, end):
+        """Returns the text between two byte offsets"""
+        with self.open(ref) as mapped:
+            return mapped[start:end].decode("utf-8")
+
+    def paragraphs(self, ref, separator="\n\n"):
+        """Yields the text's paragraphs one at a time, as text.split(separator) would return them"""
+        marker = separator.encode("utf-8")
+        with self.open(ref) as mapped:
+            start = 0
+            while (end := mapped.find(marker, start)) != -1:
+                yield mapped[start:end].decode("utf-8")
+                start = end + len(marker)
+            yield mapped[start:].decode("utf-8")
+
+    def prune(self, max_age_days=None):
+        """Deletes text last stored more than max_age_days ago, returning the number of files removed
+
+        Documents referencing pruned text can no longer be read, e.g. queued jobs
+        or checkpoints older than that; re-submitting the documents stores them again.
+        """
+        max_age_days = CONTENT_STORE_CONFIG["max_age_days"] if max_age_days is None else max_age_days
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for path in self.root.glob("*/*.txt"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+
+content_store = ContentStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the document content store")
+    parser.add_argument("--prune", action="store_true", help="Delete text not stored again recently")
+    parser.add_argument("--max-age-days", type=float, default=CONTENT_STORE_CONFIG["max_age_days"])
+    args = parser.parse_args()
+    if args.prune:
+        print(f"Removed {content_store.prune(args.max_age_days)} files from {content_store.root}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import re
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from config import DEDUP_CONFIG
+
+# MinHash over character shingles, with h(x) = (a * x + b) mod p for a fixed set of (a, b)
+MERSENNE_PRIME = (1 << 61) - 1
+_random = np.random.RandomState(1)
+_A = _random.randint(1, 1 << 31, size=DEDUP_CONFIG["num_perm"], dtype=np.uint64)
+_B = _random.randint(0, 1 << 31, size=DEDUP_CONFIG["num_perm"], dtype=np.uint64)
+
+NUMBER_PATTERN = re.compile(r"\d+")
+
+
+def shingles(text):
+    """Returns the set of character n-grams of already normalized text"""
+    size = DEDUP_CONFIG["shingle_chars"]
+    if len(text) <= size:
+        return frozenset([text])
+    return frozenset(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+@lru_cache(maxsize=DEDUP_CONFIG["cache_size"])
+def signature(text):
+    """Returns the shingles of text and the LSH bucket keys of its MinHash signature"""
+    grams = shingles(text)
+    hashes = np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64, count=len(grams))
+    # a < 2**31 and crc32 < 2**32, so a * x + b cannot overflow 64 bits
+    values = ((np.outer(hashes, _A) + _B) % MERSENNE_PRIME).min(axis=0).tobytes()
+    # Texts only share a bucket if they also mention the same numbers
+    numbers = tuple(sorted(set(NUMBER_PATTERN.findall(text))))
+    width = len(values) // DEDUP_CONFIG["bands"]
+    keys = tuple((band, numbers, values[band * width:(band + 1) * width]) for band in range(DEDUP_CONFIG["bands"]))
+    return grams, keys
+
+
+def jaccard(left, right):
+    return len(left & right) / len(left | right)
+
+
+class SimilarityIndex:
+    """Locality-sensitive hashing index that finds earlier texts similar to a new one
+
+    Signatures are split into DEDUP_CONFIG["bands"] bands; texts sharing any
+    band are candidates, and a candidate matches if the Jaccard similarity of
+    the two shingle sets is at least DEDUP_CONFIG["threshold"]. Texts must
+    also mention the same numbers, so alerts about different subjects, doses
+    or grades are never merged. Lookups cost about the same however many
+    texts are indexed.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = DEDUP_CONFIG["threshold"] if threshold is None else threshold
+        self.buckets = defaultdict(list)
+        self.shingles = []
+
+    def match(self, text):
+        """Returns the position of the most similar indexed text, or None if none is similar enough"""
+        grams, keys = signature(text)
+        candidates = {position for key in keys for position in self.buckets.get(key, ())}
+        best, best_score = None, 0.0
+        for position in sorted(candidates):
+            score = jaccard(grams, self.shingles[position])
+            if score >= self.threshold and score > best_score:
+                best, best_score = position, score
+        return best
+
+    def add(self, text):
+        """Indexes text and returns its position"""
+        grams, keys = signature(text)
+        position = len(self.shingles)
+        self.shingles.append(grams)
+        for key in keys:
+            self.buckets[key].append(position)
+        return position
+
+
+def cluster(texts, groups=None):
+    """Assigns each normalized text to a cluster of near-duplicates, returning one cluster number per text
+
+    The first text of a cluster is its representative and later texts join the
+    cluster of the most similar representative. Texts with different groups,
+    e.g. quality issue categories, never share a cluster.
+    """
+    indexes = defaultdict(SimilarityIndex)
+    # Cluster number of each indexed representative, by group and index position
+    representatives = defaultdict(list)
+    clusters = []
+    count = 0
+    for i, text in enumerate(texts):
+        group = groups[i] if groups is not None else None
+        position = indexes[group].match(text)
+        if position is None:
+            position = indexes[group].add(text)
+            representatives[group].append(count)
+            count += 1
+        clusters.append(representatives[group][position])
+    return clusters
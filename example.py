@@ -4,13 +4,13 @@ from main import analyze_clinical_trial
 def run_example():
     # Create sample documents
     documents = [
-        ClinicalDocument(
+        ClinicalDocument.from_text(
             doc_id="PROTO-001",
             doc_type="protocol",
             content="Sample protocol content describing trial design and criteria",
             metadata={"version": "1.0"}
         ),
-        ClinicalDocument(
+        ClinicalDocument.from_text(
             doc_id="SAFETY-001",
             doc_type="safety_report",
             content="Safety monitoring data and observations",
@@ -33,7 +33,7 @@ def run_example():
     print(results['quality_issues'])
     print("\nRecommendations:")
     for rec in results['recommendations']:
-        print(f"- {rec}")
+        print(f"- [{rec.priority}] {rec.recommendation} ({rec.rationale})")
     print("\nFinal Report:")
     print(results['final_report'])
 
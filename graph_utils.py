@@ -1,15 +1,17 @@
 from IPython.display import Image, display
 import streamlit as st
-from main import create_trial_graph
+from main import get_trial_graph
+
+@st.cache_data(show_spinner=False)
+def get_graph_png():
+    """Renders the compiled graph to PNG once per process instead of on every rerun"""
+    return get_trial_graph().get_graph(xray=1).draw_mermaid_png()
 
 def display_langgraph_visualization():
     """Display the LangGraph visualization using draw_mermaid_png"""
     try:
-        # Create the graph
-        graph = create_trial_graph()
-        
         # Get the mermaid PNG visualization
-        mermaid_png = graph.get_graph(xray=1).draw_mermaid_png()
+        mermaid_png = get_graph_png()
         
         # Display in Streamlit
         st.image(mermaid_png, caption="LangGraph Workflow Visualization", use_column_width=True)
@@ -28,5 +30,5 @@ def display_langgraph_visualization():
 
 def display_notebook_visualization():
     """Display the visualization in a Jupyter notebook"""
-    graph = create_trial_graph()
-    display(Image(graph.get_graph(xray=1).draw_mermaid_png()))
\ No newline at end of file
+    graph = get_trial_graph()
+    display(Image(graph.get_graph(xray=1).draw_mermaid_png()))
@@ -0,0 +1,214 @@
+import codecs
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import chardet
+
+from config import DATA_DIR, INGESTION_CONFIG
+
+UPLOADS_DIR = DATA_DIR / "uploads"
+EXTRACTED_DIR = DATA_DIR / "extracted"
+
+SUPPORTED_EXTENSIONS = {"txt", "pdf", "doc", "docx"}
+
+
+def detect_encoding(prefix):
+    """Detects the encoding of a file from a bounded prefix of its bytes"""
+    try:
+        prefix.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # The prefix may cut a multi-byte UTF-8 sequence in half at its end
+        if e.start >= len(prefix) - 3 and e.reason == "unexpected end of data":
+            return "utf-8"
+    return chardet.detect(prefix)["encoding"] or "utf-8"
+
+
+def _write_atomic(target_path, write):
+    """Writes text to target_path through a temporary file so readers never see partial output"""
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=target_path.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            write(out)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _transcode(source_path, out, encoding, errors):
+    """Decodes source_path in fixed-size blocks so the whole file is never held as bytes and text at once"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    with open(source_path, "rb") as f:
+        while block := f.read(INGESTION_CONFIG["read_chunk_bytes"]):
+            out.write(decoder.decode(block))
+    out.write(decoder.decode(b"", final=True))
+
+
+def extract_text_file(source_path, target_path):
+    with open(source_path, "rb") as f:
+        prefix = f.read(INGESTION_CONFIG["encoding_prefix_bytes"])
+    encoding = detect_encoding(prefix)
+    try:
+        _write_atomic(target_path, lambda out: _transcode(source_path, out, encoding, "strict"))
+    except (UnicodeDecodeError, LookupError):
+        # The prefix was not representative; fall back to UTF-8, dropping undecodable bytes
+        _write_atomic(target_path, lambda out: _transcode(source_path, out, "utf-8", "ignore"))
+
+
+def extract_pdf(source_path, target_path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ValueError("PDF support requires the pypdf package")
+
+    def write(out):
+        for page in PdfReader(source_path).pages:
+            out.write((page.extract_text() or "") + "\n\n")
+
+    _write_atomic(target_path, write)
+
+
+def extract_docx(source_path, target_path):
+    try:
+        import docx
+    except ImportError:
+        raise ValueError("DOCX support requires the python-docx package")
+
+    def write(out):
+        for paragraph in docx.Document(source_path).paragraphs:
+            out.write(paragraph.text + "\n\n")
+
+    _write_atomic(target_path, write)
+
+
+def extract_to_cache(source_path, extension, target_path):
+    """Extracts the text of an uploaded file to target_path; runs in a worker process"""
+    if extension == "pdf":
+        extract_pdf(source_path, target_path)
+    elif extension == "docx":
+        extract_docx(source_path, target_path)
+    else:
+        # Plain text, and legacy .doc files decoded as text as before
+        extract_text_file(source_path, target_path)
+    return str(target_path)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the shared extraction process pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers avoid forking the multi-threaded Streamlit server
+            _pool = ProcessPoolExecutor(
+                max_workers=INGESTION_CONFIG["max_workers"],
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _blocks(buffer):
+    block_size = INGESTION_CONFIG["read_chunk_bytes"]
+    for start in range(0, len(buffer), block_size):
+        yield buffer[start:start + block_size]
+
+
+def hash_upload(uploaded_file):
+    """Hashes an uploaded file block by block without copying its buffer"""
+    digest = hashlib.sha256()
+    for block in _blocks(uploaded_file.getbuffer()):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    """Hashes a file on disk block by block"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(INGESTION_CONFIG["read_chunk_bytes"]):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def spool_upload(uploaded_file, path):
+    """Writes an uploaded file to disk block by block so a worker process can read it"""
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(path.suffix + ".part")
+    with open(temp_path, "wb") as f:
+        for block in _blocks(uploaded_file.getbuffer()):
+            f.write(block)
+    os.replace(temp_path, path)
+
+
+def file_extension(name):
+    return name.rsplit(".", 1)[-1].lower() if "." in name else "txt"
+
+
+def extracted_path(file_hash):
+    return EXTRACTED_DIR / f"{file_hash}.txt"
+
+
+def ingest_uploads(uploaded_files, hashes=None):
+    """Extracts the text of uploaded files in parallel, reusing earlier extractions of identical files
+
+    Returns a list with one (file_hash, text_path, error) tuple per file, in order.
+    hashes optionally maps an upload's file_id to its already computed hash.
+    """
+    hashes = hashes if hashes is not None else {}
+    results = [None] * len(uploaded_files)
+    pending = {}
+
+    for index, uploaded_file in enumerate(uploaded_files):
+        file_id = getattr(uploaded_file, "file_id", None)
+        file_hash = hashes.get(file_id) or hash_upload(uploaded_file)
+        if file_id is not None:
+            hashes[file_id] = file_hash
+
+        target_path = extracted_path(file_hash)
+        if target_path.exists():
+            results[index] = (file_hash, target_path, None)
+            continue
+
+        extension = file_extension(uploaded_file.name)
+        if extension not in SUPPORTED_EXTENSIONS:
+            results[index] = (file_hash, None, f"Unsupported file type: .{extension}")
+            continue
+
+        source_path = UPLOADS_DIR / f"{file_hash}.{extension}"
+        try:
+            spool_upload(uploaded_file, source_path)
+            if extension == "txt" and uploaded_file.getbuffer().nbytes <= INGESTION_CONFIG["inline_max_bytes"]:
+                # Small text files are cheaper to decode here than to ship to a worker
+                extract_to_cache(source_path, extension, target_path)
+                results[index] = (file_hash, target_path, None)
+                source_path.unlink(missing_ok=True)
+            else:
+                pending[index] = (file_hash, target_path, source_path, get_pool().submit(
+                    extract_to_cache, str(source_path), extension, target_path
+                ))
+        except Exception as e:
+            results[index] = (file_hash, None, str(e))
+            source_path.unlink(missing_ok=True)
+
+    for index, (file_hash, target_path, source_path, future) in pending.items():
+        try:
+            future.result()
+            results[index] = (file_hash, target_path, None)
+        except Exception as e:
+            results[index] = (file_hash, None, str(e))
+        finally:
+            source_path.unlink(missing_ok=True)
+
+    return results
+
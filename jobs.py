@@ -0,0 +1,333 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from batch import state_to_dict, to_jsonable
+from config import JOBS_CONFIG
+from main import analyze_clinical_trial_incremental, create_initial_state, get_trial_graph
+from models import ClinicalDocument
+from results import results_store
+
+logger = logging.getLogger("clinical_trial_ai.jobs")
+
+
+class JobQueue:
+    """Persistent queue of analysis jobs in SQLite, shared by the API and worker processes
+
+    Workers claim a job by taking a lease on it and renew the lease while the
+    job runs; a job whose lease expires, e.g. because its worker process died,
+    is handed to another worker, up to JOBS_CONFIG["max_attempts"] times.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or JOBS_CONFIG["path"]
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Opens the queue database on first use"""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Autocommit, with explicit transactions where a read and write must be atomic
+            self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            # WAL lets the API read job status while workers write results
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    trial_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_expires_at REAL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_trial ON jobs (trial_id, created_at)")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS trial_leases (
+                    trial_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    lease_expires_at REAL NOT NULL
+                )"""
+            )
+        return self._conn
+
+    def submit(self, trial_id, documents, incremental=False):
+        """Enqueues an analysis of documents and returns the new job's ID"""
+        job_id = uuid.uuid4().hex
+        request = {
+            "documents": [doc.model_dump() for doc in documents],
+            "incremental": incremental
+        }
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO jobs (job_id, trial_id, status, request, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, trial_id, json.dumps(request), time.time())
+            )
+        return job_id
+
+    def claim(self, worker_id):
+        """Leases the oldest runnable job to worker_id, returning it with its request, or None if there is none"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    now = time.time()
+                    row = conn.execute(
+                        """SELECT * FROM jobs
+                           WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?)
+                           ORDER BY created_at LIMIT 1""",
+                        (now,)
+                    ).fetchone()
+                    if row is None:
+                        conn.execute("COMMIT")
+                        return None
+                    if row["attempts"] >= JOBS_CONFIG["max_attempts"]:
+                        conn.execute(
+                            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                            (f"Abandoned after {row['attempts']} attempts", now, row["job_id"])
+                        )
+                        continue
+                    conn.execute(
+                        """UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                           lease_expires_at = ?, started_at = ? WHERE job_id = ?""",
+                        (worker_id, now + JOBS_CONFIG["lease_seconds"], now, row["job_id"])
+                    )
+                    conn.execute("COMMIT")
+                    job = dict(row)
+                    job["request"] = json.loads(job["request"])
+                    return job
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def renew(self, job_id, worker_id):
+        """Extends the lease on a running job; False if the job is no longer this worker's"""
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (time.time() + JOBS_CONFIG["lease_seconds"], job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        """Stores the JSON result of a job"""
+        self._finish(job_id, worker_id, "completed", result=result)
+
+    def fail(self, job_id, worker_id, error):
+        self._finish(job_id, worker_id, "failed", error=error)
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None):
+        with self._lock:
+            self._connect().execute(
+                """UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL
+                   WHERE job_id = ? AND worker = ? AND status = 'running'""",
+                (status, result, error, time.time(), job_id, worker_id)
+            )
+
+    def lease_trial(self, trial_id, owner):
+        """Takes or extends owner's lease on a trial's checkpoint; False while another owner holds it"""
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                """INSERT INTO trial_leases (trial_id, owner, lease_expires_at) VALUES (?, ?, ?)
+                   ON CONFLICT (trial_id) DO UPDATE SET owner = excluded.owner,
+                       lease_expires_at = excluded.lease_expires_at
+                   WHERE trial_leases.owner = excluded.owner OR trial_leases.lease_expires_at < ?""",
+                (trial_id, owner, now + JOBS_CONFIG["lease_seconds"], now)
+            )
+            return cursor.rowcount == 1
+
+    def release_trial(self, trial_id, owner):
+        with self._lock:
+            self._connect().execute("DELETE FROM trial_leases WHERE trial_id = ? AND owner = ?", (trial_id, owner))
+
+    def get(self, job_id):
+        """Returns a job's status and, once completed, its result, or None if the job does not exist"""
+        with self._lock:
+            row = self._connect().execute(
+                """SELECT job_id, trial_id, status, result, error, attempts, created_at, started_at, finished_at
+                   FROM jobs WHERE job_id = ?""",
+                (job_id,)
+            ).fetchone()
+        return self._to_job(row)
+
+    def latest(self, trial_id):
+        """Returns the most recent job for a trial, or None"""
+        with self._lock:
+            row = self._connect().execute(
+                """SELECT job_id, trial_id, status, result, error, attempts, created_at, started_at, finished_at
+                   FROM jobs WHERE trial_id = ? ORDER BY created_at DESC LIMIT 1""",
+                (trial_id,)
+            ).fetchone()
+        return self._to_job(row)
+
+    @staticmethod
+    def _to_job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self):
+        """Returns the number of jobs in each status"""
+        with self._lock:
+            rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+@contextmanager
+def trial_lock(queue, trial_id):
+    """Holds the lease on a trial's checkpoint, waiting for any other holder in any process
+
+    Incremental jobs and monitoring read a trial's checkpoint and write it
+    back, so they run one at a time per trial. The lease is renewed while
+    held and expires if its holder dies, like a job's.
+    """
+    owner = uuid.uuid4().hex
+    while not queue.lease_trial(trial_id, owner):
+        time.sleep(JOBS_CONFIG["trial_lock_poll_interval"])
+    released = threading.Event()
+
+    def renew():
+        while not released.wait(JOBS_CONFIG["lease_seconds"] / 3):
+            queue.lease_trial(trial_id, owner)
+
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+    try:
+        yield
+    finally:
+        released.set()
+        renewer.join()
+        queue.release_trial(trial_id, owner)
+
+
+def analyze_incremental_locked(queue, trial_id, documents):
+    with trial_lock(queue, trial_id):
+        return analyze_clinical_trial_incremental(trial_id, documents)
+
+
+class Worker:
+    """Runs queued analyses, up to jobs_per_worker at a time, until stop_event is set"""
+
+    def __init__(self, worker_id, queue=None, jobs_per_worker=None, stop_event=None):
+        self.worker_id = worker_id
+        self.queue = queue or JobQueue()
+        self.jobs_per_worker = jobs_per_worker or JOBS_CONFIG["jobs_per_worker"]
+        self.stop_event = stop_event
+
+    def stopping(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    async def renew_lease(self, job_id):
+        while True:
+            await asyncio.sleep(JOBS_CONFIG["lease_seconds"] / 3)
+            await asyncio.to_thread(self.queue.renew, job_id, self.worker_id)
+
+    async def run_job(self, job):
+        job_id, trial_id = job["job_id"], job["trial_id"]
+        heartbeat = asyncio.create_task(self.renew_lease(job_id))
+        started = time.monotonic()
+        try:
+            documents = [ClinicalDocument(**doc) for doc in job["request"]["documents"]]
+            if job["request"].get("incremental"):
+                # The checkpointed incremental path is synchronous
+                state = await asyncio.to_thread(analyze_incremental_locked, self.queue, trial_id, documents)
+            else:
+                state = await get_trial_graph().ainvoke(create_initial_state(trial_id, documents))
+            await asyncio.to_thread(results_store.save, state, "api", job_id)
+            result = json.dumps(state_to_dict(state), default=to_jsonable)
+            await asyncio.to_thread(self.queue.complete, job_id, self.worker_id, result)
+            logger.info("Job %s for %s completed in %.1fs", job_id, trial_id, time.monotonic() - started)
+        except Exception as e:
+            logger.exception("Job %s for %s failed", job_id, trial_id)
+            await asyncio.to_thread(self.queue.fail, job_id, self.worker_id, str(e))
+        finally:
+            heartbeat.cancel()
+
+    async def run(self):
+        pending = set()
+        while not self.stopping():
+            while len(pending) < self.jobs_per_worker:
+                job = await asyncio.to_thread(self.queue.claim, self.worker_id)
+                if job is None:
+                    break
+                pending.add(asyncio.create_task(self.run_job(job)))
+            if pending:
+                _, pending = await asyncio.wait(
+                    pending, timeout=JOBS_CONFIG["poll_interval"], return_when=asyncio.FIRST_COMPLETED
+                )
+            else:
+                await asyncio.sleep(JOBS_CONFIG["poll_interval"])
+        # Let in-flight jobs finish rather than leaving them to lease expiry
+        if pending:
+            await asyncio.wait(pending)
+
+
+def worker_main(stop_event):
+    """Entry point of a worker process"""
+    # The parent handles Ctrl+C and sets stop_event so in-flight jobs can finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    asyncio.run(Worker(worker_id, stop_event=stop_event).run())
+
+
+def start_workers(processes=None):
+    """Starts worker processes, returning (stop_event, processes) for stop_workers"""
+    processes = JOBS_CONFIG["worker_processes"] if processes is None else processes
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    workers = [context.Process(target=worker_main, args=(stop_event,), daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    return stop_event, workers
+
+
+def stop_workers(stop_event, workers, timeout=None):
+    """Asks workers to finish their in-flight jobs and exit, terminating any still running after timeout"""
+    stop_event.set()
+    for worker in workers:
+        worker.join(timeout)
+        if worker.is_alive():
+            worker.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run analysis workers for jobs submitted to the HTTP API")
+    parser.add_argument("--processes", type=int, default=JOBS_CONFIG["worker_processes"])
+    args = parser.parse_args()
+
+    stop_event, workers = start_workers(args.processes)
+    print(f"Started {len(workers)} worker processes; press Ctrl+C to stop")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("Stopping workers after their in-flight jobs...")
+        stop_workers(stop_event, workers)
+
+
+if __name__ == "__main__":
+    main()
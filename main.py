@@ -1,8 +1,16 @@
+import sqlite3
+from functools import lru_cache
 from typing import List
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, START, END
 
+from config import DATA_DIR
+from metrics import instrument_node, ainstrument_node
+from profiling import tracing
+from resilience import node_retry_policy
 from models import TrialState, ClinicalDocument
 from agents import (
+    documents_to_review,
     ProtocolAgent,
     SafetyAgent,
     QualityAgent,
@@ -10,48 +18,297 @@ from agents import (
     ReportGenerator
 )
 
-def create_trial_graph():
+def agent_node(name, func, afunc):
+    """Wraps an agent's sync and async methods so the node runs natively under both invoke and ainvoke,
+    recording its metrics either way"""
+    return RunnableLambda(instrument_node(name, func), afunc=ainstrument_node(name, afunc), name=name)
+
+# Sync and async agent functions of each graph node
+NODE_FUNCTIONS = {
+    "analyze_protocol": (ProtocolAgent.analyze_protocol, ProtocolAgent.aanalyze_protocol),
+    "monitor_safety": (SafetyAgent.monitor_safety, SafetyAgent.amonitor_safety),
+    "monitor_quality": (QualityAgent.monitor_data_quality, QualityAgent.amonitor_data_quality),
+    "generate_recommendations": (
+        RecommendationsAgent.generate_recommendations, RecommendationsAgent.agenerate_recommendations),
+    "generate_report": (ReportGenerator.generate_final_report, ReportGenerator.agenerate_final_report)
+}
+
+# Graph nodes grouped by execution level; nodes in the same level run concurrently
+NODE_LEVELS = [
+    ["analyze_protocol"],
+    ["monitor_safety", "monitor_quality"],
+    ["generate_recommendations"],
+    ["generate_report"]
+]
+ALL_NODES = frozenset(node for level in NODE_LEVELS for node in level)
+
+# Nodes that only review protocols (True) or only other documents (False); a node is skipped
+# when none of the documents under review is of its kind. Any non-protocol type, including
+# free-form ones like "lab report", gets safety and quality review.
+NODE_REVIEWS_PROTOCOLS = {
+    "analyze_protocol": True,
+    "monitor_safety": False,
+    "monitor_quality": False
+}
+
+# Nodes run by each analysis mode; focused modes skip the other review and the final report
+ANALYSIS_MODES = {
+    "comprehensive": ALL_NODES,
+    "safety": frozenset(["analyze_protocol", "monitor_safety", "generate_recommendations"]),
+    "quality": frozenset(["monitor_quality", "generate_recommendations"])
+}
+
+def node_needed(node, state, enabled_nodes=ALL_NODES):
+    """True if a node has documents to review
+
+    Nodes that build on the reviews, i.e. recommendations and the report, are
+    only needed when one of the enabled review nodes has documents to review.
+    """
+    protocols = NODE_REVIEWS_PROTOCOLS.get(node)
+    if protocols is None:
+        return any(node_needed(review, state) for review in NODE_REVIEWS_PROTOCOLS if review in enabled_nodes)
+    return any((doc.doc_type == "protocol") == protocols for doc in documents_to_review(state))
+
+def next_nodes(levels, enabled_nodes=ALL_NODES):
+    """Returns a router that sends the state to the first of levels with nodes that have work, or to END"""
+    def route(state):
+        for level in levels:
+            needed = [node for node in level if node_needed(node, state, enabled_nodes)]
+            if needed:
+                return needed
+        return END
+    return route
+
+# State types the checkpointer may deserialize
+CHECKPOINT_TYPES = [
+    ("models", "ClinicalDocument"),
+    ("models", "ProtocolAnalysis"),
+    ("models", "SafetyAlert"),
+    ("models", "DataQualityIssue"),
+    ("models", "Recommendation")
+]
+
+def checkpoint_serializer():
+    """Returns a checkpoint serializer that allows the state's Pydantic models"""
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    try:
+        return JsonPlusSerializer(allowed_msgpack_modules=CHECKPOINT_TYPES)
+    except TypeError:
+        # Older langgraph versions allow every type and do not take the argument
+        return JsonPlusSerializer()
+
+@lru_cache(maxsize=1)
+def get_checkpointer():
+    """Returns the checkpointer that persists trial state between incremental runs
+
+    Uses a SQLite database under DATA_DIR when langgraph-checkpoint-sqlite is
+    installed, otherwise an in-memory saver that lasts for the process.
+    """
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError:
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver(serde=checkpoint_serializer())
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(DATA_DIR / "checkpoints.sqlite"), check_same_thread=False)
+    return SqliteSaver(conn, serde=checkpoint_serializer())
+
+def create_trial_graph(enabled_nodes=ALL_NODES, checkpointer=None):
     """Creates and returns the clinical trial analysis graph"""
     
     # Build the graph
     builder = StateGraph(TrialState)
 
     # Add nodes
-    builder.add_node("analyze_protocol", ProtocolAgent.analyze_protocol)
-    builder.add_node("monitor_safety", SafetyAgent.monitor_safety)
-    builder.add_node("monitor_quality", QualityAgent.monitor_data_quality)
-    builder.add_node("generate_recommendations", RecommendationsAgent.generate_recommendations)
-    builder.add_node("generate_report", ReportGenerator.generate_final_report)
-
-    # Add edges - Fixed to handle parallel paths correctly
-    builder.add_edge(START, "analyze_protocol")
-    builder.add_edge("analyze_protocol", "monitor_safety")
-    builder.add_edge("analyze_protocol", "monitor_quality")
-    builder.add_edge("monitor_safety", "generate_recommendations")
-    builder.add_edge("monitor_quality", "generate_recommendations")
-    builder.add_edge("generate_recommendations", "generate_report")
-    builder.add_edge("generate_report", END)
+    nodes = {name: agent_node(name, func, afunc) for name, (func, afunc) in NODE_FUNCTIONS.items()}
+    # Nodes that still fail transiently after the LLM layer's own retries are
+    # re-run by the graph; completed LLM requests are served from the cache
+    retry_policy = node_retry_policy()
+    for name, node in nodes.items():
+        if name in enabled_nodes:
+            builder.add_node(name, node, retry_policy=retry_policy)
+
+    # Add edges - every enabled node routes to the nodes of the next level that
+    # have documents to review, skipping levels with none, so monitor_safety and
+    # monitor_quality run in the same step and, under ainvoke, their LLM calls
+    # are in flight concurrently
+    levels = [[node for node in level if node in enabled_nodes] for level in NODE_LEVELS]
+    levels = [level for level in levels if level]
+    for index, sources in enumerate([[START]] + levels):
+        later = levels[index:]
+        destinations = [node for level in later for node in level] + [END]
+        for source in sources:
+            builder.add_conditional_edges(source, next_nodes(later, enabled_nodes), destinations)
 
     # Compile the graph
-    return builder.compile()
+    return builder.compile(checkpointer=checkpointer)
 
-def analyze_clinical_trial(trial_id: str, documents: List[ClinicalDocument]):
-    """Process a clinical trial through the multi-agent system"""
-    
-    # Create initial state
-    initial_state = {
+@lru_cache(maxsize=None)
+def _compiled_trial_graph(enabled_nodes: frozenset, checkpointed: bool):
+    return create_trial_graph(enabled_nodes, checkpointer=get_checkpointer() if checkpointed else None)
+
+def get_trial_graph(enabled_nodes=None, checkpointed=False):
+    """Returns the process-wide compiled graph for the given configuration, compiling it once"""
+    enabled_nodes = ALL_NODES if enabled_nodes is None else frozenset(enabled_nodes)
+    unknown = enabled_nodes - ALL_NODES
+    if unknown:
+        raise ValueError(f"Unknown graph nodes: {', '.join(sorted(unknown))}")
+    return _compiled_trial_graph(enabled_nodes, checkpointed)
+
+def mode_nodes(analysis_mode):
+    """Returns the nodes enabled for an analysis mode"""
+    if analysis_mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode {analysis_mode!r}; expected one of {', '.join(ANALYSIS_MODES)}")
+    return ANALYSIS_MODES[analysis_mode]
+
+def create_initial_state(trial_id: str, documents: List[ClinicalDocument]):
+    """Creates the initial graph state for a trial"""
+    return {
         "trial_id": trial_id,
         "documents": documents,
+        "document_fingerprints": {doc.doc_id: doc.fingerprint for doc in documents},
+        "changed_doc_ids": None,
+        "monitored_fingerprints": {},
         "protocol_analysis": None,
         "safety_alerts": [],
         "quality_issues": [],
         "recommendations": [],
         "final_report": ""
     }
+
+def analyze_clinical_trial(trial_id: str, documents: List[ClinicalDocument], incremental: bool = False,
+                           analysis_mode: str = "comprehensive", profile: bool = False):
+    """Process a clinical trial through the multi-agent system
+
+    analysis_mode is one of ANALYSIS_MODES: "safety" and "quality" run only the
+    agents that mode needs and produce no final report. Agents are also skipped
+    when no document under review is of a kind they handle (NODE_REVIEWS_PROTOCOLS).
+
+    With incremental=True the trial's state is persisted by the graph checkpointer
+    and later runs only re-execute the agents whose inputs changed: protocol
+    analysis is skipped unless a protocol document changed, and safety and
+    quality review only see new or changed documents, merging their findings
+    into the alerts and issues from earlier runs. Incremental runs are always
+    comprehensive, so the checkpoint holds every agent's findings.
+
+    With profile=True the run is traced (see profiling.py): spans for each
+    node, LLM call, prompt construction and output parsing are written as an
+    OTLP/JSON file under PROFILING_CONFIG["dir"], with per-node cProfile dumps
+    if PROFILING_CONFIG["cprofile_nodes"] is set.
+    """
+    if profile:
+        recording = tracing(f"analyze_clinical_trial {trial_id}", trial_id=trial_id, analysis_mode=analysis_mode,
+                            incremental=incremental, documents=len(documents))
+        try:
+            with recording as trace:
+                return analyze_clinical_trial(trial_id, documents, incremental, analysis_mode)
+        finally:
+            # Failed runs are exported too, with the failing spans marked as errors
+            trace.export()
+
+    if incremental:
+        if analysis_mode != "comprehensive":
+            raise ValueError("Incremental analysis only supports the comprehensive mode")
+        return analyze_clinical_trial_incremental(trial_id, documents)
+    
+    # Create initial state
+    initial_state = create_initial_state(trial_id, documents)
     
     # Get the graph
-    graph = create_trial_graph()
+    graph = get_trial_graph(mode_nodes(analysis_mode))
     
     # Run the analysis
     final_state = graph.invoke(initial_state)
-    return final_state
\ No newline at end of file
+    return final_state
+
+def analyze_clinical_trial_incremental(trial_id: str, documents: List[ClinicalDocument]):
+    """Re-analyzes a trial against its checkpointed state, feeding only changed documents to the agents"""
+
+    graph = get_trial_graph(checkpointed=True)
+    config = {"configurable": {"thread_id": trial_id}}
+    previous_state = graph.get_state(config).values
+
+    if not previous_state:
+        return graph.invoke(create_initial_state(trial_id, documents), config)
+
+    fingerprints = {doc.doc_id: doc.fingerprint for doc in documents}
+    previous_fingerprints = previous_state.get("document_fingerprints", {})
+    changed_doc_ids = [
+        doc_id for doc_id, fingerprint in fingerprints.items()
+        if previous_fingerprints.get(doc_id) != fingerprint
+    ]
+    if not changed_doc_ids and fingerprints.keys() == previous_fingerprints.keys():
+        return previous_state
+
+    # Alerts and issues are omitted so their reducers keep the checkpointed values; monitored
+    # documents are among the changed ones, so they now get the full analysis
+    return graph.invoke(
+        {
+            "trial_id": trial_id,
+            "documents": documents,
+            "document_fingerprints": fingerprints,
+            "changed_doc_ids": changed_doc_ids,
+            "monitored_fingerprints": {}
+        },
+        config
+    )
+
+async def analyze_clinical_trial_async(trial_id: str, documents: List[ClinicalDocument],
+                                       analysis_mode: str = "comprehensive"):
+    """Async variant of analyze_clinical_trial; safety and quality review run concurrently"""
+
+    initial_state = create_initial_state(trial_id, documents)
+    graph = get_trial_graph(mode_nodes(analysis_mode))
+
+    final_state = await graph.ainvoke(initial_state)
+    return final_state
+
+# Nodes whose free-text LLM output is streamed token by token
+STREAMED_NODES = {"generate_report"}
+
+def _stream_event(mode, payload):
+    """Converts a multi-mode graph stream item into an (event, node, data) tuple, or None to skip it"""
+    if mode == "messages":
+        chunk, metadata = payload
+        node = metadata.get("langgraph_node")
+        if node in STREAMED_NODES and isinstance(chunk.content, str) and chunk.content:
+            return ("token", node, chunk.content)
+        return None
+    if mode == "updates":
+        # Each update maps the node that just finished to the state it produced
+        node, update = next(iter(payload.items()))
+        return ("update", node, update or {})
+    return None
+
+def stream_clinical_trial(trial_id: str, documents: List[ClinicalDocument], analysis_mode: str = "comprehensive"):
+    """Runs the analysis and yields (event, node, data) tuples as it progresses
+
+    Yields ("update", node, state_update) as each agent finishes, ("token", node, text)
+    for each token of the final report and finally ("done", None, final_state).
+    """
+    graph = get_trial_graph(mode_nodes(analysis_mode))
+    final_state = None
+    for mode, payload in graph.stream(
+        create_initial_state(trial_id, documents),
+        stream_mode=["updates", "messages", "values"]
+    ):
+        if mode == "values":
+            final_state = payload
+        elif (event := _stream_event(mode, payload)) is not None:
+            yield event
+    yield ("done", None, final_state)
+
+async def astream_clinical_trial(trial_id: str, documents: List[ClinicalDocument],
+                                 analysis_mode: str = "comprehensive"):
+    """Async variant of stream_clinical_trial"""
+    graph = get_trial_graph(mode_nodes(analysis_mode))
+    final_state = None
+    async for mode, payload in graph.astream(
+        create_initial_state(trial_id, documents),
+        stream_mode=["updates", "messages", "values"]
+    ):
+        if mode == "values":
+            final_state = payload
+        elif (event := _stream_event(mode, payload)) is not None:
+            yield event
+    yield ("done", None, final_state)
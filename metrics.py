@@ -0,0 +1,227 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_CONFIG
+from profiling import node_span, span
+
+logger = logging.getLogger("clinical_trial_ai.metrics")
+if METRICS_CONFIG["log_level"]:
+    # The root logger drops INFO by default, which would hide the node records
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(METRICS_CONFIG["log_level"])
+    logger.propagate = False
+
+COUNTERS = (
+    "calls",
+    "errors",
+    "wall_seconds",
+    "wait_seconds",
+    "llm_requests",
+    "prompt_tokens",
+    "completion_tokens",
+    "retries",
+    "hedges",
+    "escalations",
+    "cache_hits",
+    "cache_misses",
+    "batch_served"
+)
+
+COUNTER_HELP = {
+    "calls": "Node executions",
+    "errors": "Node executions that raised",
+    "wall_seconds": "Wall time spent in the node",
+    "wait_seconds": "Time the node spent waiting on rate limits, retry backoff and chunk concurrency slots",
+    "llm_requests": "LLM requests sent by the node",
+    "prompt_tokens": "Prompt tokens sent by the node",
+    "completion_tokens": "Completion tokens received by the node",
+    "retries": "LLM request retries",
+    "hedges": "Duplicate LLM requests sent because the first was slow",
+    "escalations": "Structured outputs retried on the escalation model after failing validation",
+    "cache_hits": "LLM response cache hits",
+    "cache_misses": "LLM response cache misses",
+    "batch_served": "LLM responses served from provider batch job output"
+}
+
+
+class NodeRun:
+    """Counters for one execution of one graph node"""
+
+    def __init__(self, trial_id, node):
+        self.trial_id = trial_id
+        self.node = node
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self.counters[name] += value
+
+
+# The node run the current code executes in; copied into chunk threads and tasks
+current_run = contextvars.ContextVar("current_node_run", default=None)
+
+
+def record(**counters):
+    """Adds to the counters of the node run in progress, if any"""
+    run = current_run.get()
+    if run is not None:
+        run.add(**counters)
+
+
+class MetricsRegistry:
+    """In-process registry of per-node and per-trial metrics"""
+
+    def __init__(self, max_trials=1000):
+        self.max_trials = max_trials
+        self._nodes = {}
+        self._trials = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, run: NodeRun):
+        """Folds a finished node run into the node and trial totals"""
+        with self._lock:
+            node_totals = self._nodes.setdefault(run.node, dict.fromkeys(COUNTERS, 0))
+            trial = self._trials.setdefault(run.trial_id, {})
+            self._trials.move_to_end(run.trial_id)
+            trial_totals = trial.setdefault(run.node, dict.fromkeys(COUNTERS, 0))
+            for name, value in run.counters.items():
+                node_totals[name] += value
+                trial_totals[name] += value
+            while len(self._trials) > self.max_trials:
+                self._trials.popitem(last=False)
+
+    def node_summary(self):
+        """Returns totals per node"""
+        with self._lock:
+            return {node: dict(totals) for node, totals in self._nodes.items()}
+
+    def trial_summary(self, trial_id):
+        """Returns totals per node for one trial"""
+        with self._lock:
+            return {node: dict(totals) for node, totals in self._trials.get(trial_id, {}).items()}
+
+    def reset(self):
+        with self._lock:
+            self._nodes.clear()
+            self._trials.clear()
+
+    def to_prometheus(self):
+        """Renders the node totals in the Prometheus text exposition format"""
+        nodes = self.node_summary()
+        lines = []
+        for name in COUNTERS:
+            metric = f"trial_node_{name}_total"
+            lines.append(f"# HELP {metric} {COUNTER_HELP[name]}")
+            lines.append(f"# TYPE {metric} counter")
+            for node, totals in sorted(nodes.items()):
+                lines.append(f'{metric}{{node="{node}"}} {totals[name]}')
+        return "\n".join(lines) + "\n"
+
+
+# Shared registry instance
+registry = MetricsRegistry(max_trials=METRICS_CONFIG["max_trials"])
+
+
+def _start_run(node, state):
+    run = NodeRun(state.get("trial_id", ""), node)
+    return run, current_run.set(run)
+
+
+def _finish_run(run, token, started, error=None, active=None):
+    current_run.reset(token)
+    run.add(calls=1, wall_seconds=time.perf_counter() - started, errors=1 if error else 0)
+    if active is not None:
+        active.set(trial_id=run.trial_id, **run.counters)
+    registry.observe(run)
+    logger.info(json.dumps({
+        "event": "node_finished",
+        "trial_id": run.trial_id,
+        "node": run.node,
+        "error": str(error) if error else None,
+        **{name: round(value, 4) if isinstance(value, float) else value for name, value in run.counters.items()}
+    }))
+
+
+def instrument_node(node, func):
+    """Wraps a sync graph node to record wall time, tokens, retries and cache hits
+
+    While a trace is being recorded the node also gets a span, and is run
+    under cProfile if the trace asks for it.
+    """
+    @functools.wraps(func)
+    def wrapper(state):
+        with node_span(node) as active:
+            run, token = _start_run(node, state)
+            started = time.perf_counter()
+            try:
+                result = func(state)
+            except Exception as e:
+                _finish_run(run, token, started, error=e, active=active)
+                raise
+            _finish_run(run, token, started, active=active)
+            return result
+    return wrapper
+
+
+def ainstrument_node(node, afunc):
+    """Async variant of instrument_node
+
+    Nodes get a span but no cProfile dump, as a profiler on the event loop
+    thread would also count the other nodes' coroutines.
+    """
+    @functools.wraps(afunc)
+    async def wrapper(state):
+        with span(f"node {node}", node=node) as active:
+            run, token = _start_run(node, state)
+            started = time.perf_counter()
+            try:
+                result = await afunc(state)
+            except Exception as e:
+                _finish_run(run, token, started, error=e, active=active)
+                raise
+            _finish_run(run, token, started, active=active)
+            return result
+    return wrapper
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(host=None, port=None):
+    """Serves /metrics for Prometheus from a background thread; safe to call more than once"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(
+                (host or METRICS_CONFIG["host"], port or METRICS_CONFIG["port"]),
+                MetricsHandler
+            )
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server.server_address
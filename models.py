@@ -1,14 +1,65 @@
 from typing import List, Optional, Annotated
 from typing_extensions import TypedDict
-from pydantic import BaseModel, Field
-import operator
+from pydantic import BaseModel, Field, model_validator
+import hashlib
+
+from chunking import merge_safety_alerts, merge_quality_issues
+from content_store import REF_PATTERN, content_store
 
 class ClinicalDocument(BaseModel):
+    """A document whose text lives in the content store; create new ones with from_text, from_file or content=..."""
     doc_id: str
     doc_type: str = Field(description="Type of clinical document (protocol, case report, etc)")
-    content: str
+    content_ref: str = Field(
+        pattern=REF_PATTERN.pattern, description="SHA-256 of the document text in the content store")
     metadata: dict
 
+    @model_validator(mode="before")
+    @classmethod
+    def store_content(cls, data):
+        """Accepts ClinicalDocument(content=...) as before, storing the text and keeping its reference"""
+        if isinstance(data, dict) and "content" in data and "content_ref" not in data:
+            data = dict(data)
+            data["content_ref"] = content_store.put(data.pop("content"))
+        return data
+
+    @classmethod
+    def from_text(cls, doc_id, doc_type, content, metadata):
+        """Creates a document, storing its text in the content store"""
+        return cls(doc_id=doc_id, doc_type=doc_type, content_ref=content_store.put(content), metadata=metadata)
+
+    @classmethod
+    def from_file(cls, doc_id, doc_type, path, metadata):
+        """Creates a document from a UTF-8 text file without reading it into memory"""
+        return cls(doc_id=doc_id, doc_type=doc_type, content_ref=content_store.put_file(path), metadata=metadata)
+
+    @property
+    def content(self) -> str:
+        """The full text; prefer paragraphs() for large documents"""
+        return content_store.read(self.content_ref)
+
+    def paragraphs(self):
+        """Streams the text's blank-line separated paragraphs from the content store"""
+        return content_store.paragraphs(self.content_ref)
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash used to detect new or changed documents between runs
+
+        content_ref is already the text's SHA-256, so the text is never re-read.
+        """
+        return hashlib.sha256(f"{self.doc_type}\0{self.content_ref}".encode("utf-8")).hexdigest()
+
+class DocumentInput(BaseModel):
+    """A document as sent by clients (API requests, batch input files), with its full text"""
+    doc_id: str
+    doc_type: str = Field(description="Type of clinical document (protocol, case report, etc)")
+    content: str
+    metadata: dict = {}
+
+    def to_document(self) -> ClinicalDocument:
+        return ClinicalDocument.from_text(self.doc_id, self.doc_type, self.content, self.metadata)
+
 class ProtocolAnalysis(BaseModel):
     key_criteria: List[str]
     inclusion_criteria: List[str]
@@ -30,11 +81,33 @@ class DataQualityIssue(BaseModel):
     impact_level: str
     suggested_resolution: str
 
+class Recommendation(BaseModel):
+    recommendation: str
+    priority: str = Field(description="Priority of the recommendation: high, medium or low")
+    rationale: str
+    related_alert_ids: List[str] = Field(description="IDs of the safety alerts the recommendation addresses")
+    related_issue_ids: List[str] = Field(description="IDs of the quality issues the recommendation addresses")
+
+def add_safety_alerts(left: List[SafetyAlert], right: List[SafetyAlert]) -> List[SafetyAlert]:
+    """Reducer that merges new alerts into existing ones instead of appending duplicates or near-duplicates"""
+    return merge_safety_alerts(left + right)
+
+def add_quality_issues(left: List[DataQualityIssue], right: List[DataQualityIssue]) -> List[DataQualityIssue]:
+    """Reducer that merges new quality issues into existing ones instead of appending duplicates or near-duplicates"""
+    return merge_quality_issues(left + right)
+
 class TrialState(TypedDict):
     trial_id: str
     documents: List[ClinicalDocument]
+    # Fingerprints of the analyzed documents by doc_id, and the documents that are
+    # new or changed since the previous run (None means analyze everything)
+    document_fingerprints: dict
+    changed_doc_ids: Optional[List[str]]
+    # Fingerprints of documents only safety-reviewed by monitor.py, which the
+    # next incremental run still treats as changed
+    monitored_fingerprints: dict
     protocol_analysis: Optional[ProtocolAnalysis]
-    safety_alerts: Annotated[List[SafetyAlert], operator.add]
-    quality_issues: Annotated[List[DataQualityIssue], operator.add]
-    recommendations: List[str]
-    final_report: str
\ No newline at end of file
+    safety_alerts: Annotated[List[SafetyAlert], add_safety_alerts]
+    quality_issues: Annotated[List[DataQualityIssue], add_quality_issues]
+    recommendations: List[Recommendation]
+    final_report: str
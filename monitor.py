@@ -0,0 +1,186 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+from agents import SafetyAgent
+from batch import to_jsonable
+from chunking import normalize_text
+from config import MONITOR_CONFIG
+from dedup import SimilarityIndex
+from ingestion import extract_to_cache, extracted_path, file_extension, hash_file
+from jobs import JobQueue, trial_lock
+from main import analyze_clinical_trial_incremental, get_trial_graph, NODE_LEVELS
+from metrics import instrument_node
+from models import ClinicalDocument
+from results import results_store
+from summaries import severity_rank
+
+logger = logging.getLogger("clinical_trial_ai.monitor")
+
+# Monitoring updates are attributed to the last node so the trial's thread stays finished
+LAST_NODE = NODE_LEVELS[-1][-1]
+
+# Trial leases are taken in the job queue database, so workers running incremental jobs wait for monitoring
+leases = JobQueue()
+
+def novel_alerts(existing, alerts):
+    """Returns the alerts not raised before, or raised before at a lower severity
+
+    Alerts are matched with the same near-duplicate similarity the state
+    reducers use to merge them.
+    """
+    index = SimilarityIndex()
+    for alert in existing:
+        index.add(normalize_text(alert.description))
+    novel = []
+    for alert in alerts:
+        position = index.match(normalize_text(alert.description))
+        if position is None or severity_rank(alert.severity) > severity_rank(existing[position].severity):
+            novel.append(alert)
+    return novel
+
+
+def monitor_documents(trial_id, documents, queue=None):
+    """Reviews a trial's new or changed documents for safety concerns against its checkpointed analysis
+
+    Only documents whose fingerprint differs from the trial's checkpoint are
+    reviewed, by the safety agent alone against the stored protocol analysis;
+    the resulting alerts are merged into the checkpoint. Their fingerprints are
+    kept in monitored_fingerprints rather than document_fingerprints, so the
+    next incremental analysis still gives them quality review, recommendations
+    and a report. A trial without a checkpoint, or a changed protocol, gets a
+    full incremental analysis instead, run here or, when a JobQueue is given,
+    submitted to it as an incremental job. The trial's lease in the job queue
+    database is held throughout, so runs in other processes wait, and the
+    updated state is saved to the results store.
+    Returns (reviewed doc IDs, new or escalated alerts, queued job ID or None).
+    """
+    with trial_lock(queue or leases, trial_id):
+        graph = get_trial_graph(checkpointed=True)
+        config = {"configurable": {"thread_id": trial_id}}
+        state = graph.get_state(config).values or {}
+        fingerprints = {**state.get("document_fingerprints", {}), **state.get("monitored_fingerprints", {})}
+        delta = [doc for doc in documents if fingerprints.get(doc.doc_id) != doc.fingerprint]
+        if not delta:
+            return [], [], None
+
+        previous_alerts = state.get("safety_alerts", [])
+        all_documents = {doc.doc_id: doc for doc in state.get("documents", [])}
+        all_documents.update((doc.doc_id, doc) for doc in delta)
+        all_documents = list(all_documents.values())
+
+        if state.get("protocol_analysis") is None or any(doc.doc_type == "protocol" for doc in delta):
+            if queue is not None:
+                return [doc.doc_id for doc in delta], [], queue.submit(trial_id, all_documents, incremental=True)
+            final_state = analyze_clinical_trial_incremental(trial_id, all_documents)
+        else:
+            review = instrument_node("monitor_safety", SafetyAgent.monitor_safety)
+            # Only the delta is reviewed; the full list keeps the trial's retrieval index intact
+            alerts = review({
+                "trial_id": trial_id,
+                "documents": all_documents,
+                "protocol_analysis": state["protocol_analysis"],
+                "changed_doc_ids": [doc.doc_id for doc in delta]
+            })["safety_alerts"]
+            # The safety_alerts reducer merges the new alerts into the stored ones
+            graph.update_state(config, {
+                "documents": all_documents,
+                "monitored_fingerprints": {
+                    **state.get("monitored_fingerprints", {}),
+                    **{doc.doc_id: doc.fingerprint for doc in delta}
+                },
+                "safety_alerts": alerts
+            }, as_node=LAST_NODE)
+            final_state = graph.get_state(config).values
+
+        results_store.save(final_state, "monitor")
+        # Report the stored alerts, so IDs match the trial's state
+        return [doc.doc_id for doc in delta], novel_alerts(previous_alerts, final_state["safety_alerts"]), None
+
+
+def load_document(path):
+    """Reads a monitored file into a ClinicalDocument, reusing the ingestion text cache"""
+    file_hash = hash_file(path)
+    text_path = extracted_path(file_hash)
+    if not text_path.exists():
+        extract_to_cache(path, file_extension(path.name), text_path)
+    return ClinicalDocument.from_file(
+        doc_id=path.name,
+        doc_type="protocol" if "protocol" in path.name.lower() else "safety_report",
+        path=text_path,
+        metadata={"source": str(path), "sha256": file_hash}
+    )
+
+
+def watch_directory(root=None, poll_interval=None):
+    """Polls root/<trial_id>/ for new or changed files, yielding (trial_id, alert) for each new alert
+
+    Files named like "*protocol*" are treated as protocols, everything else as
+    safety reports. Only files that changed since the last poll are read, and
+    only those the trial's checkpoint has not seen are sent to the LLM, so a
+    restarted watcher does not re-review old reports.
+    """
+    root = root or MONITOR_CONFIG["watch_dir"]
+    poll_interval = poll_interval or MONITOR_CONFIG["poll_interval"]
+    root.mkdir(parents=True, exist_ok=True)
+    seen = {}
+    while True:
+        now = time.time()
+        for trial_dir in sorted(path for path in root.iterdir() if path.is_dir()):
+            changed = []
+            for path in sorted(trial_dir.iterdir()):
+                if not path.is_file() or path.name.startswith("."):
+                    continue
+                stat = path.stat()
+                signature = (stat.st_mtime, stat.st_size)
+                if seen.get(path) == signature or now - stat.st_mtime < MONITOR_CONFIG["settle_seconds"]:
+                    continue
+                seen[path] = signature
+                try:
+                    changed.append(load_document(path))
+                except Exception:
+                    logger.exception("Could not read %s", path)
+            if not changed:
+                continue
+
+            try:
+                reviewed, alerts, _ = monitor_documents(trial_dir.name, changed)
+            except Exception:
+                logger.exception("Monitoring %s failed; will retry", trial_dir.name)
+                for doc in changed:
+                    seen.pop(trial_dir / doc.doc_id, None)
+                continue
+            if reviewed:
+                logger.info("%s: reviewed %s, %d new alerts", trial_dir.name, ", ".join(reviewed), len(alerts))
+            for alert in alerts:
+                yield trial_dir.name, alert
+        time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a directory of trial folders and emit new safety alerts")
+    parser.add_argument("--dir", type=Path, default=MONITOR_CONFIG["watch_dir"],
+                        help="Directory with one subdirectory per trial")
+    parser.add_argument("--interval", type=float, default=MONITOR_CONFIG["poll_interval"], help="Seconds between polls")
+    parser.add_argument("-o", "--output", help="JSONL file to append alerts to (defaults to stdout)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for trial_id, alert in watch_directory(args.dir, args.interval):
+            output.write(json.dumps({"trial_id": trial_id, "detected_at": time.time(), **alert.model_dump()},
+                                    default=to_jsonable) + "\n")
+            output.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
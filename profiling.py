@@ -0,0 +1,341 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.runnables import ensure_config
+
+from config import PROFILING_CONFIG
+
+logger = logging.getLogger("clinical_trial_ai.profiling")
+
+# Trace being recorded in this context and the span new spans are children of
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.error = f"{type(error).__name__}: {error}"
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Trace:
+    """Span tree of one profiled run, exported as OpenTelemetry OTLP/JSON
+
+    With cprofile=True each sync graph node is also run under cProfile and its
+    stats are dumped next to the trace; cProfile only sees the node's own
+    thread, so time in parallel chunk requests shows up in the spans instead.
+    """
+
+    def __init__(self, name, cprofile=False):
+        self.name = name
+        self.trace_id = uuid4().hex
+        self.cprofile = cprofile
+        self.spans = []
+        self.profiles = {}
+        self._lock = threading.Lock()
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)[:60]
+        self.path = PROFILING_CONFIG["dir"] / f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}-{self.trace_id[:8]}.json"
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def add_profile(self, node, profile):
+        """Dumps a node's cProfile stats beside the trace, returning the file path"""
+        directory = self.path.with_suffix("")
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            index = len(self.profiles)
+            path = directory / f"{index:02d}-{node}.prof"
+            self.profiles[path.name] = path
+        profile.dump_stats(path)
+        return path
+
+    def to_otlp(self):
+        with self._lock:
+            spans = [span for span in self.spans if span.end_ns is not None]
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": otlp_value("clinical-trial-ai")},
+                    {"key": "process.pid", "value": otlp_value(os.getpid())}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "clinical_trial_ai.profiling"},
+                    "spans": [
+                        {
+                            "traceId": self.trace_id,
+                            "spanId": span.span_id,
+                            **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                            "name": span.name,
+                            "kind": 1,
+                            "startTimeUnixNano": str(span.start_ns),
+                            "endTimeUnixNano": str(span.end_ns),
+                            "attributes": [
+                                {"key": key, "value": otlp_value(value)} for key, value in span.attributes.items()
+                            ],
+                            "status": {"code": span.status, **({"message": span.error} if span.error else {})}
+                        }
+                        for span in spans
+                    ]
+                }]
+            }]
+        }
+
+    def export(self):
+        """Writes the finished spans to the trace file and returns its path"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix(".json.part")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_otlp(), f)
+        os.replace(temp_path, self.path)
+        logger.info("Trace written to %s", self.path)
+        return self.path
+
+
+@contextmanager
+def tracing(name, cprofile=None, **attributes):
+    """Records a trace of everything run in this context under a root span, yielding the Trace
+
+    Call trace.export() after the block to write it out.
+    """
+    trace = Trace(name, PROFILING_CONFIG["cprofile_nodes"] if cprofile is None else cprofile)
+    token = current_trace.set(trace)
+    try:
+        with span(name, **attributes):
+            yield trace
+    finally:
+        current_trace.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Records a child span of the current one while a trace is active; yields the Span, or None"""
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = current_span.get()
+    active = Span(name, parent.span_id if parent else None, attributes)
+    trace.add(active)
+    token = current_span.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.end(error=e)
+        raise
+    else:
+        active.end()
+    finally:
+        current_span.reset(token)
+
+
+def annotate(**attributes):
+    """Sets attributes on the current span, if a trace is being recorded"""
+    active = current_span.get()
+    if active is not None and current_trace.get() is not None:
+        active.set(**attributes)
+
+
+def traced_iter(items, name):
+    """Yields from items, recording the time to produce each one as a span"""
+    items = iter(items)
+    while True:
+        trace, parent = current_trace.get(), current_span.get()
+        if trace is None:
+            yield from items
+            return
+        active = Span(name, parent.span_id if parent else None, {})
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        except BaseException as e:
+            active.end(error=e)
+            trace.add(active)
+            raise
+        active.end()
+        trace.add(active)
+        yield item
+
+
+@contextmanager
+def node_span(node):
+    """Span for a graph node, also run under cProfile when the trace asks for it"""
+    with span(f"node {node}", node=node) as active:
+        trace = current_trace.get()
+        if active is None or not trace.cprofile:
+            yield active
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield active
+        finally:
+            profile.disable()
+            active.set(cprofile_file=trace.add_profile(node, profile).name)
+
+
+class SpanCallbackHandler(BaseCallbackHandler):
+    """Records LangChain runs inside an LLM call, e.g. the chat model request and output parsing, as spans"""
+
+    # Called in order on the calling thread, also for async runs
+    run_inline = True
+
+    def __init__(self, trace, parent):
+        self.trace = trace
+        self.parent = parent
+        self.spans = {}
+
+    def _start(self, run_id, parent_run_id, name, **attributes):
+        parent = self.spans.get(parent_run_id) or self.parent
+        active = Span(name, parent.span_id if parent else None, attributes)
+        self.trace.add(active)
+        self.spans[run_id] = active
+
+    def _end(self, run_id, error=None):
+        active = self.spans.pop(run_id, None)
+        if active is not None:
+            active.end(error=error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name") or "chat_model", kind="llm_request")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name") or "llm", kind="llm_request")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "chain"
+        self._start(run_id, parent_run_id, name, kind="parse" if "Parser" in name else "chain")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+def callback_config():
+    """Runnable config that records LangChain runs under the current span, or None when not tracing
+
+    The handler is added to the callbacks inherited from the running graph,
+    which stream the report's tokens, rather than replacing them.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return None
+    handler = SpanCallbackHandler(trace, current_span.get())
+    callbacks = ensure_config().get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler)
+        return {"callbacks": callbacks}
+    return {"callbacks": list(callbacks or []) + [handler]}
+
+
+def list_traces():
+    """Returns the exported trace files, newest first"""
+    directory = PROFILING_CONFIG["dir"]
+    if not directory.exists():
+        return []
+    return sorted(directory.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True)
+
+
+def load_spans(path):
+    """Reads an OTLP/JSON trace file into flat span dicts with depth and times in ms from the trace start"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    spans = [
+        span
+        for resource in data.get("resourceSpans", [])
+        for scope in resource.get("scopeSpans", [])
+        for span in scope.get("spans", [])
+    ]
+    if not spans:
+        return []
+    by_id = {span["spanId"]: span for span in spans}
+    origin = min(int(span["startTimeUnixNano"]) for span in spans)
+
+    def depth(span):
+        level = 0
+        while span.get("parentSpanId") in by_id:
+            span = by_id[span["parentSpanId"]]
+            level += 1
+        return level
+
+    rows = []
+    for span in spans:
+        start = (int(span["startTimeUnixNano"]) - origin) / 1e6
+        end = (int(span["endTimeUnixNano"]) - origin) / 1e6
+        attributes = {item["key"]: next(iter(item["value"].values())) for item in span.get("attributes", [])}
+        rows.append({
+            "span_id": span["spanId"],
+            "parent_id": span.get("parentSpanId"),
+            "name": span["name"],
+            "depth": depth(span),
+            "start_ms": start,
+            "end_ms": end,
+            "duration_ms": end - start,
+            "error": span.get("status", {}).get("code") == STATUS_ERROR,
+            "attributes": attributes
+        })
+    return sorted(rows, key=lambda row: (row["start_ms"], row["depth"]))
+
+
+def self_times(rows):
+    """Totals each span name's count, wall time and self time (excluding children), slowest first"""
+    child_time = {}
+    for row in rows:
+        if row["parent_id"]:
+            child_time[row["parent_id"]] = child_time.get(row["parent_id"], 0.0) + row["duration_ms"]
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(row["name"], {"name": row["name"], "count": 0, "total_ms": 0.0, "self_ms": 0.0})
+        total["count"] += 1
+        total["total_ms"] += row["duration_ms"]
+        # Children running in parallel can add up to more than their parent
+        total["self_ms"] += max(row["duration_ms"] - child_time.get(row["span_id"], 0.0), 0.0)
+    return sorted(totals.values(), key=lambda total: -total["self_ms"])
@@ -0,0 +1,261 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from typing import get_type_hints
+
+from agents import DeferredToBatch, batch_run
+from batch import BatchResult, load_trials, serialize_result
+from cache import llm_cache
+from config import PROVIDER_BATCH_CONFIG
+from main import NODE_FUNCTIONS, NODE_LEVELS, create_initial_state, node_needed
+from metrics import instrument_node
+from models import TrialState
+from results import results_store
+
+logger = logging.getLogger("clinical_trial_ai.provider_batch")
+
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Reducers of the state keys that merge updates instead of replacing them
+REDUCERS = {
+    name: hint.__metadata__[0]
+    for name, hint in get_type_hints(TrialState, include_extras=True).items()
+    if hasattr(hint, "__metadata__")
+}
+
+
+def apply_update(state, update):
+    """Applies a node's state update the way the graph would"""
+    for key, value in update.items():
+        state[key] = REDUCERS[key](state.get(key) or [], value) if key in REDUCERS else value
+
+
+def request_body(llm, messages, schema):
+    """Builds the chat completions request the agent would have sent for messages
+
+    The parameters come from the client itself, so e.g. the token cap is sent
+    as max_completion_tokens exactly as on the interactive path.
+    """
+    body = llm._get_request_payload(messages)
+    body.pop("stream", None)
+    if schema:
+        body["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema()}
+        }
+    return body
+
+
+class ProviderBatchRun:
+    """Collects agents' LLM requests into provider batch jobs and serves the results back to them
+
+    While collecting, a request that misses the response cache is recorded and
+    the node is interrupted with DeferredToBatch. After flush, recorded
+    requests are answered from the batch output; any the batch could not
+    answer, e.g. invalid structured output, are sent interactively as usual.
+    """
+
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval or PROVIDER_BATCH_CONFIG["poll_interval"]
+        self.collecting = False
+        self.requests = {}
+        self.results = {}
+        self.batches = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, key, llm, messages, schema):
+        """Returns the batch result for a request, or records it and raises DeferredToBatch while collecting"""
+        if key in self.results:
+            return self.results[key]
+        if not self.collecting:
+            return None
+        with self._lock:
+            self.requests.setdefault(key, (llm, messages, schema))
+        raise DeferredToBatch(key)
+
+    def flush(self):
+        """Runs the recorded requests as batch jobs, one or more per provider client, and waits for them"""
+        with self._lock:
+            requests, self.requests = self.requests, {}
+        if not requests:
+            return
+
+        # Requests are grouped by client so each route's provider and credentials are used
+        groups = {}
+        for key, (llm, messages, schema) in requests.items():
+            client = llm.root_client
+            groups.setdefault(id(client), (client, []))[1].append(key)
+
+        jobs = []
+        size = PROVIDER_BATCH_CONFIG["max_requests_per_batch"]
+        for client, keys in groups.values():
+            for start in range(0, len(keys), size):
+                lines = [
+                    {
+                        "custom_id": key,
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": request_body(*requests[key])
+                    }
+                    for key in keys[start:start + size]
+                ]
+                jobs.append((client, self.submit(client, lines), keys[start:start + size]))
+
+        deadline = time.monotonic() + PROVIDER_BATCH_CONFIG["max_wait_seconds"]
+        pending = list(jobs)
+        while pending:
+            time.sleep(self.poll_interval)
+            still_pending = []
+            for client, job, keys in pending:
+                job = client.batches.retrieve(job.id)
+                if job.status in FINISHED_STATUSES:
+                    self.collect(client, job, {key: requests[key] for key in keys})
+                elif time.monotonic() > deadline:
+                    logger.warning("Batch %s did not finish in time; cancelling it", job.id)
+                    client.batches.cancel(job.id)
+                    self.failed += len(keys)
+                else:
+                    still_pending.append((client, job, keys))
+            pending = still_pending
+
+    def submit(self, client, lines):
+        payload = "\n".join(json.dumps(line) for line in lines).encode("utf-8")
+        input_file = client.files.create(file=("requests.jsonl", payload), purpose="batch")
+        job = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=PROVIDER_BATCH_CONFIG["completion_window"]
+        )
+        self.batches += 1
+        logger.info("Submitted batch %s with %d requests", job.id, len(lines))
+        return job
+
+    def collect(self, client, job, requests):
+        """Stores the successful responses of a finished batch job"""
+        logger.info("Batch %s %s", job.id, job.status)
+        if not job.output_file_id:
+            self.failed += len(requests)
+            return
+        for line in client.files.content(job.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            key = record["custom_id"]
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200 or key not in requests:
+                self.failed += 1
+                continue
+            body = response["body"]
+            usage = body.get("usage") or {}
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            content = body["choices"][0]["message"].get("content") or ""
+            schema = requests[key][2]
+            if schema:
+                try:
+                    content = schema.model_validate_json(content).model_dump_json()
+                except ValueError:
+                    # Left for the interactive path, which can escalate to a larger model
+                    self.failed += 1
+                    continue
+            self.results[key] = content
+            llm_cache.set(key, content)
+
+
+def analyze_trials_provider_batch(trials, poll_interval=None):
+    """Analyzes many trials through provider batch jobs, one graph level at a time
+
+    For each level, every trial's nodes are first run to collect their
+    uncached LLM requests, which are submitted together as batch jobs. Once
+    the jobs finish, the nodes run again and are served from the batch
+    results, and their updates are applied before moving to the next level.
+    Returns a BatchResult per trial and the ProviderBatchRun with its totals.
+    """
+    started = time.monotonic()
+    states = {trial_id: create_initial_state(trial_id, documents) for trial_id, documents in trials}
+    errors = {}
+    run = ProviderBatchRun(poll_interval)
+    token = batch_run.set(run)
+    try:
+        for level in NODE_LEVELS:
+            run.collecting = True
+            for state in states.values():
+                if state["trial_id"] in errors:
+                    continue
+                for node in level:
+                    if not node_needed(node, state):
+                        continue
+                    try:
+                        NODE_FUNCTIONS[node][0](state)
+                    except Exception:
+                        # DeferredToBatch is expected; other errors surface again when the node runs for real
+                        pass
+            run.collecting = False
+            run.flush()
+
+            for trial_id, state in states.items():
+                if trial_id in errors:
+                    continue
+                try:
+                    # Nodes of one level see the same input state, as in the graph
+                    updates = [
+                        instrument_node(node, NODE_FUNCTIONS[node][0])(state)
+                        for node in level if node_needed(node, state)
+                    ]
+                except Exception as e:
+                    errors[trial_id] = str(e)
+                    continue
+                for update in updates:
+                    apply_update(state, update)
+    finally:
+        batch_run.reset(token)
+
+    elapsed = time.monotonic() - started
+    results = [
+        BatchResult(trial_id=trial_id, error=errors[trial_id], elapsed=elapsed) if trial_id in errors
+        else BatchResult(trial_id=trial_id, result=state, elapsed=elapsed)
+        for trial_id, state in states.items()
+    ]
+    return results, run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score many trials through an OpenAI-compatible batch API")
+    parser.add_argument("input", help="JSONL file with one {\"trial_id\", \"documents\"} record per line")
+    parser.add_argument("-o", "--output", help="JSONL file for results (defaults to stdout)")
+    parser.add_argument("--poll-interval", type=float, default=PROVIDER_BATCH_CONFIG["poll_interval"],
+                        help="Seconds between batch status checks")
+    parser.add_argument("--no-store", action="store_true", help="Do not save results to the results store")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results, run = analyze_trials_provider_batch(load_trials(args.input), args.poll_interval)
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for result in results:
+            output.write(serialize_result(result) + "\n")
+            if result.result is not None and not args.no_store:
+                results_store.save(result.result, source="provider_batch")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(json.dumps({
+        "trials": len(results),
+        "failed": sum(1 for result in results if result.error),
+        "batch_jobs": run.batches,
+        "batch_requests_served": len(run.results),
+        "batch_requests_failed": run.failed,
+        "prompt_tokens": run.prompt_tokens,
+        "completion_tokens": run.completion_tokens
+    }, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from config import SUMMARY_CONFIG
+from summaries import severity_counts, severity_rank, truncate
+
+
+def cell(text):
+    """Makes text safe for a markdown table cell"""
+    return truncate(str(text)).replace("|", "\\|")
+
+
+def table(headers, rows, noun):
+    """Renders a markdown table of at most SUMMARY_CONFIG["report_table_rows"] rows"""
+    limit = SUMMARY_CONFIG["report_table_rows"]
+    lines = [
+        "| " + " | ".join(headers) + " |",
+        "|" + "---|" * len(headers)
+    ]
+    lines.extend("| " + " | ".join(cell(value) for value in row) + " |" for row in rows[:limit])
+    if len(rows) > limit:
+        lines.append(f"\n_{len(rows) - limit} more {noun} not shown._")
+    return "\n".join(lines)
+
+
+def protocol_section(protocol):
+    if protocol is None:
+        return "No protocol analysis available."
+    sections = []
+    for field in type(protocol).model_fields:
+        items = getattr(protocol, field)
+        if items:
+            sections.append(f"### {field.replace('_', ' ').capitalize()}\n" + "\n".join(f"- {item}" for item in items))
+    return "\n\n".join(sections) or "No protocol details extracted."
+
+
+def safety_section(alerts):
+    if not alerts:
+        return "No safety alerts were raised."
+    alerts = sorted(alerts, key=lambda alert: -severity_rank(alert.severity))
+    return f"Alerts by severity: {severity_counts(alerts, 'severity')}.\n\n" + table(
+        ["ID", "Severity", "Description", "Recommended actions"],
+        [(alert.alert_id, alert.severity, alert.description, "; ".join(alert.recommendations)) for alert in alerts],
+        "alerts"
+    )
+
+
+def quality_section(issues):
+    if not issues:
+        return "No data quality issues were found."
+    issues = sorted(issues, key=lambda issue: -severity_rank(issue.impact_level))
+    return f"Issues by impact: {severity_counts(issues, 'impact_level')}.\n\n" + table(
+        ["ID", "Category", "Impact", "Description", "Suggested resolution"],
+        [
+            (issue.issue_id, issue.category, issue.impact_level, issue.description, issue.suggested_resolution)
+            for issue in issues
+        ],
+        "issues"
+    )
+
+
+def recommendations_section(recommendations):
+    if not recommendations:
+        return "No recommendations."
+    lines = []
+    for index, rec in enumerate(sorted(recommendations, key=lambda rec: -severity_rank(rec.priority)), 1):
+        line = f"{index}. **[{rec.priority.capitalize()}]** {rec.recommendation}"
+        if rec.rationale:
+            line += f"  \n   {rec.rationale}"
+        linked = rec.related_alert_ids + rec.related_issue_ids
+        if linked:
+            line += f"  \n   Addresses: {', '.join(linked)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def render_report(state, summary):
+    """Assembles the final markdown report from structured state around an executive summary"""
+    return "\n\n".join([
+        f"# Clinical Trial Analysis Report: {state['trial_id']}",
+        "## Executive Summary",
+        summary.strip(),
+        "## Protocol Overview",
+        protocol_section(state.get("protocol_analysis")),
+        "## Safety Findings",
+        safety_section(state.get("safety_alerts") or []),
+        "## Data Quality Findings",
+        quality_section(state.get("quality_issues") or []),
+        "## Recommendations",
+        recommendations_section(state.get("recommendations") or [])
+    ]) + "\n"
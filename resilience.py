@@ -0,0 +1,275 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+
+import metrics
+from config import RESILIENCE_CONFIG
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Transport errors raised by the OpenAI client, matched by name so the client stays an optional import
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+
+def status_code(error):
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code
+
+
+def is_retryable(error):
+    """True for transient failures: timeouts, connection errors, rate limits and server errors"""
+    if isinstance(error, (TimeoutError, ConnectionError, CircuitOpenError)):
+        return True
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(error):
+    """Returns the delay in seconds requested by the error's Retry-After header, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, error=None):
+    """Exponential backoff with full jitter, but never shorter than the provider's Retry-After"""
+    ceiling = min(RESILIENCE_CONFIG["backoff_max"], RESILIENCE_CONFIG["backoff_initial"] * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    requested = retry_after(error) if error is not None else None
+    if requested is not None:
+        delay = max(delay, min(requested, RESILIENCE_CONFIG["backoff_max"]))
+    return delay
+
+
+class CircuitBreaker:
+    """Stops sending requests to a failing provider for a cool-down period
+
+    The breaker opens after breaker_failure_threshold consecutive retryable
+    failures. Once breaker_reset_seconds have passed, requests are let through
+    again and a single further failure re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or RESILIENCE_CONFIG["breaker_failure_threshold"]
+        self.reset_seconds = reset_seconds or RESILIENCE_CONFIG["breaker_reset_seconds"]
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(f"Circuit for {self.name} is open; retry in {remaining:.0f}s")
+            # Half-open: let requests through, but re-open on the next failure
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Returns the process-wide circuit breaker for a provider or model"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the thread pool that runs sync requests so they can be timed out and hedged"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-request")
+        return _executor
+
+
+def hedge_delay(timeout):
+    hedge_after = RESILIENCE_CONFIG["hedge_after_seconds"]
+    return hedge_after if hedge_after is not None and hedge_after < timeout else None
+
+
+def request_context(hedge=False):
+    """Copy of the current context for one request, so callbacks and metrics follow the node
+
+    A hedged duplicate drops the callbacks inherited from the running graph,
+    so only the first request streams its tokens; the two would otherwise be
+    interleaved in stream mode.
+    """
+    context = contextvars.copy_context()
+    if hedge:
+        from langchain_core.runnables.config import var_child_runnable_config
+        config = context.get(var_child_runnable_config)
+        if config and config.get("callbacks"):
+            context.run(var_child_runnable_config.set, {**config, "callbacks": None})
+    return context
+
+
+def attempt(call):
+    """Runs call once within the request timeout, sending a duplicate request if the first is slow
+
+    The first request to succeed wins. Requests that lose or time out cannot
+    be interrupted and are left to finish in the background.
+    """
+    timeout = RESILIENCE_CONFIG["request_timeout"]
+    deadline = time.monotonic() + timeout
+    pool = get_executor()
+
+    def submit(hedge=False):
+        return pool.submit(request_context(hedge).run, call)
+
+    pending = {submit()}
+    hedge_after = hedge_delay(timeout)
+    error = None
+    while pending:
+        wait_for = deadline - time.monotonic()
+        if hedge_after is not None:
+            wait_for = min(wait_for, hedge_after)
+        done, pending = wait(pending, timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        if hedge_after is not None and not done:
+            metrics.record(hedges=1)
+            pending.add(submit(hedge=True))
+            hedge_after = None
+        elif not done:
+            raise TimeoutError(f"LLM request timed out after {timeout}s")
+    raise error
+
+
+async def aattempt(call):
+    """Async variant of attempt; the losing request is cancelled"""
+    timeout = RESILIENCE_CONFIG["request_timeout"]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    def submit(hedge=False):
+        # call() runs in the request's context too, as it builds the request's config
+        return request_context(hedge).run(lambda: asyncio.ensure_future(call()))
+
+    pending = {submit()}
+    hedge_after = hedge_delay(timeout)
+    error = None
+    try:
+        while pending:
+            wait_for = deadline - loop.time()
+            if hedge_after is not None:
+                wait_for = min(wait_for, hedge_after)
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if hedge_after is not None and not done:
+                metrics.record(hedges=1)
+                pending.add(submit(hedge=True))
+                hedge_after = None
+            elif not done:
+                raise TimeoutError(f"LLM request timed out after {timeout}s")
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def call_with_retries(call, name):
+    """Calls call() with timeouts, hedging and retries of transient failures, guarded by name's circuit breaker"""
+    breaker = get_breaker(name)
+    for retry in range(RESILIENCE_CONFIG["max_retries"] + 1):
+        breaker.before_call()
+        try:
+            result = attempt(call)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            breaker.record_failure()
+            if retry == RESILIENCE_CONFIG["max_retries"]:
+                raise
+            delay = backoff_delay(retry, e)
+            metrics.record(retries=1, wait_seconds=delay)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+async def acall_with_retries(call, name):
+    """Async variant of call_with_retries; call returns an awaitable"""
+    breaker = get_breaker(name)
+    for retry in range(RESILIENCE_CONFIG["max_retries"] + 1):
+        breaker.before_call()
+        try:
+            result = await aattempt(call)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            breaker.record_failure()
+            if retry == RESILIENCE_CONFIG["max_retries"]:
+                raise
+            delay = backoff_delay(retry, e)
+            metrics.record(retries=1, wait_seconds=delay)
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+def node_retry_policy():
+    """Graph-level retry for nodes that still fail transiently, e.g. while a circuit breaker is open"""
+    from langgraph.types import RetryPolicy
+    return RetryPolicy(
+        max_attempts=RESILIENCE_CONFIG["node_max_attempts"],
+        initial_interval=RESILIENCE_CONFIG["breaker_reset_seconds"],
+        retry_on=is_retryable
+    )
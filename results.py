@@ -0,0 +1,340 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import List
+
+from pydantic import BaseModel
+
+from config import RESULTS_CONFIG
+from models import DataQualityIssue, ProtocolAnalysis, Recommendation, SafetyAlert
+from summaries import severity_rank
+
+
+class Page(BaseModel):
+    items: List[dict]
+    total: int
+    limit: int
+    offset: int
+
+
+def page_bounds(limit, offset):
+    limit = min(limit or RESULTS_CONFIG["page_size"], RESULTS_CONFIG["max_page_size"])
+    return max(limit, 1), max(offset or 0, 0)
+
+
+class ResultsStore:
+    """Persistent SQLite store of analysis results, queryable across trials and over time
+
+    Every saved analysis keeps its protocol analysis, recommendations and
+    report, and its alerts and quality issues are stored as indexed rows so
+    they can be filtered by severity, category or impact without loading
+    whole trials.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or RESULTS_CONFIG["path"]
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Opens the results database on first use"""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS analyses (
+                    analysis_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    trial_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    source TEXT,
+                    job_id TEXT,
+                    document_ids TEXT NOT NULL,
+                    protocol_analysis TEXT,
+                    recommendations TEXT NOT NULL,
+                    final_report TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_analyses_trial ON analyses (trial_id, analysis_id);
+                CREATE INDEX IF NOT EXISTS idx_analyses_created ON analyses (created_at);
+
+                CREATE TABLE IF NOT EXISTS safety_alerts (
+                    analysis_id INTEGER NOT NULL REFERENCES analyses (analysis_id) ON DELETE CASCADE,
+                    trial_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    alert_id TEXT NOT NULL,
+                    severity TEXT NOT NULL,
+                    severity_rank INTEGER NOT NULL,
+                    description TEXT NOT NULL,
+                    recommendations TEXT NOT NULL,
+                    related_criteria TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_alerts_analysis ON safety_alerts (analysis_id);
+                CREATE INDEX IF NOT EXISTS idx_alerts_severity ON safety_alerts (severity_rank, created_at);
+                CREATE INDEX IF NOT EXISTS idx_alerts_trial ON safety_alerts (trial_id, severity_rank);
+
+                CREATE TABLE IF NOT EXISTS quality_issues (
+                    analysis_id INTEGER NOT NULL REFERENCES analyses (analysis_id) ON DELETE CASCADE,
+                    trial_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    issue_id TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    impact_level TEXT NOT NULL,
+                    impact_rank INTEGER NOT NULL,
+                    description TEXT NOT NULL,
+                    suggested_resolution TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_issues_analysis ON quality_issues (analysis_id);
+                CREATE INDEX IF NOT EXISTS idx_issues_category ON quality_issues (category, impact_rank);
+                CREATE INDEX IF NOT EXISTS idx_issues_impact ON quality_issues (impact_rank, created_at);
+                CREATE INDEX IF NOT EXISTS idx_issues_trial ON quality_issues (trial_id, impact_rank);
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def save(self, state, source=None, job_id=None):
+        """Stores the outputs of a final graph state and returns the new analysis ID"""
+        trial_id = state["trial_id"]
+        now = time.time()
+        protocol = state.get("protocol_analysis")
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    """INSERT INTO analyses (trial_id, created_at, source, job_id, document_ids,
+                       protocol_analysis, recommendations, final_report) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        trial_id, now, source, job_id,
+                        json.dumps(sorted({
+                            **(state.get("document_fingerprints") or {}), **(state.get("monitored_fingerprints") or {})
+                        })),
+                        protocol.model_dump_json() if protocol is not None else None,
+                        json.dumps([rec.model_dump() for rec in state.get("recommendations") or []]),
+                        state.get("final_report") or ""
+                    )
+                )
+                analysis_id = cursor.lastrowid
+                conn.executemany(
+                    "INSERT INTO safety_alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            analysis_id, trial_id, now, alert.alert_id, alert.severity, severity_rank(alert.severity),
+                            alert.description, json.dumps(alert.recommendations), json.dumps(alert.related_criteria)
+                        )
+                        for alert in state.get("safety_alerts") or []
+                    ]
+                )
+                conn.executemany(
+                    "INSERT INTO quality_issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            analysis_id, trial_id, now, issue.issue_id, issue.category, issue.impact_level,
+                            severity_rank(issue.impact_level), issue.description, issue.suggested_resolution
+                        )
+                        for issue in state.get("quality_issues") or []
+                    ]
+                )
+        return analysis_id
+
+    def load(self, analysis_id):
+        """Returns a stored analysis as a state dict with model instances, or None"""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT * FROM analyses WHERE analysis_id = ?", (analysis_id,)).fetchone()
+            if row is None:
+                return None
+            alerts = conn.execute(
+                "SELECT * FROM safety_alerts WHERE analysis_id = ? ORDER BY rowid", (analysis_id,)
+            ).fetchall()
+            issues = conn.execute(
+                "SELECT * FROM quality_issues WHERE analysis_id = ? ORDER BY rowid", (analysis_id,)
+            ).fetchall()
+        return {
+            "analysis_id": row["analysis_id"],
+            "trial_id": row["trial_id"],
+            "created_at": row["created_at"],
+            "source": row["source"],
+            "job_id": row["job_id"],
+            "document_ids": json.loads(row["document_ids"]),
+            "protocol_analysis": (
+                ProtocolAnalysis.model_validate_json(row["protocol_analysis"]) if row["protocol_analysis"] else None
+            ),
+            "safety_alerts": [alert_from_row(alert) for alert in alerts],
+            "quality_issues": [issue_from_row(issue) for issue in issues],
+            "recommendations": recommendations_from_json(json.loads(row["recommendations"])),
+            "final_report": row["final_report"]
+        }
+
+    def latest(self, trial_id):
+        """Returns the trial's most recent analysis, or None"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT MAX(analysis_id) FROM analyses WHERE trial_id = ?", (trial_id,)
+            ).fetchone()
+        return self.load(row[0]) if row[0] is not None else None
+
+    def list_trials(self, limit=None, offset=None):
+        """Pages through trials with their latest analysis, most recently analyzed first"""
+        limit, offset = page_bounds(limit, offset)
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute("SELECT COUNT(DISTINCT trial_id) FROM analyses").fetchone()[0]
+            rows = conn.execute(
+                """SELECT a.trial_id, a.analysis_id, a.created_at, counts.analyses,
+                          (SELECT COUNT(*) FROM safety_alerts WHERE analysis_id = a.analysis_id) AS alerts,
+                          (SELECT COUNT(*) FROM quality_issues WHERE analysis_id = a.analysis_id) AS issues
+                   FROM analyses a
+                   JOIN (SELECT trial_id, MAX(analysis_id) AS latest_id, COUNT(*) AS analyses
+                         FROM analyses GROUP BY trial_id) counts ON a.analysis_id = counts.latest_id
+                   ORDER BY a.analysis_id DESC LIMIT ? OFFSET ?""",
+                (limit, offset)
+            ).fetchall()
+        return Page(items=[dict(row) for row in rows], total=total, limit=limit, offset=offset)
+
+    def history(self, trial_id, limit=None, offset=None):
+        """Pages through a trial's analyses over time, newest first, with their alert and issue counts"""
+        limit, offset = page_bounds(limit, offset)
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute("SELECT COUNT(*) FROM analyses WHERE trial_id = ?", (trial_id,)).fetchone()[0]
+            rows = conn.execute(
+                """SELECT a.analysis_id, a.created_at, a.source, a.job_id,
+                          (SELECT COUNT(*) FROM safety_alerts WHERE analysis_id = a.analysis_id) AS alerts,
+                          (SELECT COUNT(*) FROM safety_alerts WHERE analysis_id = a.analysis_id
+                           AND severity_rank >= 2) AS high_severity_alerts,
+                          (SELECT COUNT(*) FROM quality_issues WHERE analysis_id = a.analysis_id) AS issues
+                   FROM analyses a WHERE a.trial_id = ?
+                   ORDER BY a.analysis_id DESC LIMIT ? OFFSET ?""",
+                (trial_id, limit, offset)
+            ).fetchall()
+        return Page(items=[dict(row) for row in rows], total=total, limit=limit, offset=offset)
+
+    def _query(self, table, where, params, order, limit, offset, latest_only):
+        limit, offset = page_bounds(limit, offset)
+        if latest_only:
+            where.append("analysis_id IN (SELECT MAX(analysis_id) FROM analyses GROUP BY trial_id)")
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute(f"SELECT COUNT(*) FROM {table} {clause}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT * FROM {table} {clause} ORDER BY {order} LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return rows, total, limit, offset
+
+    def query_alerts(self, trial_id=None, severities=None, min_severity=None, since=None, until=None,
+                     latest_only=True, limit=None, offset=None):
+        """Pages through safety alerts, most severe and most recent first
+
+        By default only each trial's latest analysis is searched; pass
+        latest_only=False to search every stored analysis, e.g. with since and
+        until (Unix timestamps) to look at a period.
+        """
+        where, params = [], []
+        if trial_id:
+            where.append("trial_id = ?")
+            params.append(trial_id)
+        if severities:
+            where.append(f"LOWER(severity) IN ({', '.join('?' * len(severities))})")
+            params.extend(severity.lower() for severity in severities)
+        if min_severity:
+            where.append("severity_rank >= ?")
+            params.append(severity_rank(min_severity))
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        rows, total, limit, offset = self._query(
+            "safety_alerts", where, params, "severity_rank DESC, created_at DESC, rowid", limit, offset, latest_only
+        )
+        items = [
+            {
+                "trial_id": row["trial_id"],
+                "analysis_id": row["analysis_id"],
+                "created_at": row["created_at"],
+                **alert_from_row(row).model_dump()
+            }
+            for row in rows
+        ]
+        return Page(items=items, total=total, limit=limit, offset=offset)
+
+    def query_issues(self, trial_id=None, categories=None, impact_levels=None, min_impact=None, since=None,
+                     until=None, latest_only=True, limit=None, offset=None):
+        """Pages through quality issues, highest impact and most recent first; see query_alerts"""
+        where, params = [], []
+        if trial_id:
+            where.append("trial_id = ?")
+            params.append(trial_id)
+        if categories:
+            where.append(f"category IN ({', '.join('?' * len(categories))})")
+            params.extend(categories)
+        if impact_levels:
+            where.append(f"LOWER(impact_level) IN ({', '.join('?' * len(impact_levels))})")
+            params.extend(level.lower() for level in impact_levels)
+        if min_impact:
+            where.append("impact_rank >= ?")
+            params.append(severity_rank(min_impact))
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        rows, total, limit, offset = self._query(
+            "quality_issues", where, params, "impact_rank DESC, created_at DESC, rowid", limit, offset, latest_only
+        )
+        items = [
+            {
+                "trial_id": row["trial_id"],
+                "analysis_id": row["analysis_id"],
+                "created_at": row["created_at"],
+                **issue_from_row(row).model_dump()
+            }
+            for row in rows
+        ]
+        return Page(items=items, total=total, limit=limit, offset=offset)
+
+    def categories(self):
+        """Returns the distinct quality issue categories, for filters"""
+        with self._lock:
+            rows = self._connect().execute("SELECT DISTINCT category FROM quality_issues ORDER BY category").fetchall()
+        return [row[0] for row in rows]
+
+
+def recommendations_from_json(values):
+    """Builds Recommendations from stored dicts; analyses saved before they were structured hold plain lines"""
+    return [
+        Recommendation(**value) if isinstance(value, dict)
+        else Recommendation(recommendation=value, priority="medium", rationale="", related_alert_ids=[],
+                            related_issue_ids=[])
+        for value in values
+        if isinstance(value, dict) or value.strip()
+    ]
+
+
+def alert_from_row(row):
+    return SafetyAlert(
+        alert_id=row["alert_id"],
+        severity=row["severity"],
+        description=row["description"],
+        recommendations=json.loads(row["recommendations"]),
+        related_criteria=json.loads(row["related_criteria"])
+    )
+
+
+def issue_from_row(row):
+    return DataQualityIssue(
+        issue_id=row["issue_id"],
+        category=row["category"],
+        description=row["description"],
+        impact_level=row["impact_level"],
+        suggested_resolution=row["suggested_resolution"]
+    )
+
+
+results_store = ResultsStore()
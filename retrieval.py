@@ -0,0 +1,266 @@
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from chunking import iter_chunks
+from content_store import content_store
+from config import DATA_DIR, RETRIEVAL_CONFIG
+from tokens import count_tokens
+
+INDEX_DIR = DATA_DIR / "indexes"
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = set(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+SAFETY_QUERIES = [
+    "adverse event reported subject",
+    "serious adverse event hospitalization death",
+    "laboratory abnormality elevated liver enzymes",
+    "dose reduction discontinuation toxicity"
+]
+QUALITY_QUERIES = [
+    "missing data not recorded",
+    "inconsistent date visit window",
+    "protocol deviation",
+    "out of range value units",
+    "duplicate subject record",
+    "open query unresolved discrepancy"
+]
+
+
+def tokenize(text):
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+def index_path(trial_id):
+    # Hashed so distinct trial IDs never share a file, whatever characters they contain
+    return INDEX_DIR / f"{hashlib.sha256(trial_id.encode('utf-8')).hexdigest()}.json"
+
+
+def passage_entries(doc):
+    """Chunks a document into passages with their term counts and byte spans in the content store
+
+    Passages are contiguous in the document, so the index keeps only where
+    each one starts and ends; a passage that cannot be located keeps its text.
+    """
+    entries = []
+    with content_store.open(doc.content_ref) as mapped:
+        cursor = 0
+        for text in iter_chunks([doc], RETRIEVAL_CONFIG["passage_tokens"]):
+            entry = {"terms": dict(Counter(tokenize(text)))}
+            encoded = text.encode("utf-8")
+            start = mapped.find(encoded, cursor)
+            if start == -1:
+                entry["text"] = text
+            else:
+                entry["start"], entry["end"] = start, start + len(encoded)
+                cursor = entry["end"]
+            entries.append(entry)
+    return entries
+
+
+class TrialIndex:
+    """On-disk BM25 index over the passages of one trial's documents
+
+    Passages are stored per document with its fingerprint, as spans of the
+    document in the content store, so updating the index only re-chunks
+    documents that are new or changed and the index never holds their text.
+    Entries for documents no longer in the trial are dropped, including the
+    rule-residue documents derived from them. Searches are restricted to the
+    documents being reviewed.
+    """
+
+    def __init__(self, trial_id):
+        self.trial_id = trial_id
+        self.path = index_path(trial_id)
+        self.documents = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.documents = json.load(f)["documents"]
+        self._postings = None
+        # Guards documents and postings between updates and searches from parallel nodes
+        self._lock = threading.RLock()
+
+    def update(self, documents, present_ids=None):
+        """Indexes new or changed documents and, given the trial's current doc IDs, drops ones no longer present"""
+        with self._lock:
+            self._update(documents, present_ids)
+
+    def _update(self, documents, present_ids):
+        changed = False
+        if present_ids is not None:
+            for doc_id, entry in list(self.documents.items()):
+                # Residue documents (see rules.py) stay as long as the document they came from
+                if entry.get("source_id", doc_id) not in present_ids:
+                    del self.documents[doc_id]
+                    changed = True
+        for doc in documents:
+            doc_id = doc.doc_id
+            entry = self.documents.get(doc_id)
+            if entry and entry["fingerprint"] == doc.fingerprint:
+                continue
+            self.documents[doc_id] = {
+                "fingerprint": doc.fingerprint,
+                "doc_type": doc.doc_type,
+                "content_ref": doc.content_ref,
+                "source_id": doc.metadata.get("residue_of", doc_id),
+                "passages": passage_entries(doc)
+            }
+            changed = True
+        if changed:
+            self._postings = None
+            self.save()
+
+    def save(self):
+        INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        # A temporary file of its own, so processes updating the same trial never interleave writes
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=INDEX_DIR, suffix=".part", delete=False
+        ) as f:
+            json.dump({"trial_id": self.trial_id, "documents": self.documents}, f)
+        try:
+            os.replace(f.name, self.path)
+        except OSError:
+            os.unlink(f.name)
+            raise
+
+    def _build_postings(self):
+        """Builds the in-memory inverted index: term -> [(doc_id, passage index, term frequency)]"""
+        postings = defaultdict(list)
+        lengths = {}
+        for doc_id, entry in self.documents.items():
+            for position, passage in enumerate(entry["passages"]):
+                lengths[(doc_id, position)] = sum(passage["terms"].values())
+                for term, frequency in passage["terms"].items():
+                    postings[term].append((doc_id, position, frequency))
+        self._postings = (postings, lengths)
+
+    def search(self, query, k=None, doc_ids=None):
+        """Returns the top k (score, doc_id, passage index) matches for query, optionally within doc_ids"""
+        with self._lock:
+            if self._postings is None:
+                self._build_postings()
+            # Updates replace the postings rather than changing them, so this snapshot stays consistent
+            postings, lengths = self._postings
+        if doc_ids is not None:
+            lengths = {key: length for key, length in lengths.items() if key[0] in doc_ids}
+        if not lengths:
+            return []
+
+        passage_count = len(lengths)
+        average_length = sum(lengths.values()) / passage_count
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            matches = [match for match in postings.get(term, []) if (match[0], match[1]) in lengths]
+            if not matches:
+                continue
+            idf = math.log(1 + (passage_count - len(matches) + 0.5) / (len(matches) + 0.5))
+            for doc_id, position, frequency in matches:
+                length = lengths[(doc_id, position)]
+                scores[(doc_id, position)] += idf * frequency * (K1 + 1) / (
+                    frequency + K1 * (1 - B + B * length / average_length)
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:k or RETRIEVAL_CONFIG["top_k"]]
+        return [(score, doc_id, position) for (doc_id, position), score in ranked]
+
+    def passage(self, doc_id, position):
+        with self._lock:
+            entry = self.documents[doc_id]
+            passage = entry["passages"][position]
+        if "text" in passage:
+            return passage["text"]
+        return content_store.read_span(entry["content_ref"], passage["start"], passage["end"])
+
+
+# Recently used trial indexes; evicted ones are reloaded from disk when needed again
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(trial_id, documents, present_ids=None):
+    """Returns the trial's index, brought up to date with documents (see TrialIndex.update)"""
+    with _indexes_lock:
+        index = _indexes.get(trial_id)
+        if index is None:
+            index = _indexes[trial_id] = TrialIndex(trial_id)
+        _indexes.move_to_end(trial_id)
+        while len(_indexes) > RETRIEVAL_CONFIG["max_cached_indexes"]:
+            _indexes.popitem(last=False)
+    index.update(documents, present_ids)
+    return index
+
+
+def use_retrieval(documents):
+    """True when the documents are large enough that retrieval beats sending them in full"""
+    if not RETRIEVAL_CONFIG["enabled"]:
+        return False
+    total = 0
+    for doc in documents:
+        for paragraph in doc.paragraphs():
+            total += count_tokens(paragraph)
+            if total > RETRIEVAL_CONFIG["min_corpus_tokens"]:
+                return True
+    return False
+
+
+def retrieve_context(trial_id, all_documents, documents, queries, max_tokens=None):
+    """Returns the passages of documents most relevant to queries, packed within max_tokens
+
+    all_documents are the trial's current documents; index entries for any
+    others are dropped. Each query contributes its top matches in turn, so
+    every question gets coverage before any one of them fills the budget.
+    """
+    max_tokens = max_tokens or RETRIEVAL_CONFIG["context_tokens"]
+    index = get_index(trial_id, documents, {doc.doc_id for doc in all_documents})
+    doc_ids = {doc.doc_id for doc in documents}
+    results = [index.search(query, doc_ids=doc_ids) for query in queries if query.strip()]
+
+    selected = []
+    seen = set()
+    used = 0
+    for rank in range(RETRIEVAL_CONFIG["top_k"]):
+        for matches in results:
+            if rank >= len(matches):
+                continue
+            _, doc_id, position = matches[rank]
+            if (doc_id, position) in seen:
+                continue
+            text = index.passage(doc_id, position)
+            tokens = count_tokens(text)
+            if used + tokens > max_tokens:
+                continue
+            seen.add((doc_id, position))
+            selected.append((doc_id, position, text))
+            used += tokens
+
+    # Present passages in document order so related passages read naturally
+    selected.sort(key=lambda item: (item[0], item[1]))
+    return "\n\n".join(f"[{doc_id} passage {position + 1}]\n{text}" for doc_id, position, text in selected)
+
+
+def safety_queries(protocol):
+    """Targeted safety questions: one per protocol safety-monitoring requirement plus general ones"""
+    queries = list(SAFETY_QUERIES)
+    if protocol is not None:
+        queries = protocol.safety_monitoring + protocol.exclusion_criteria + queries
+    return queries
+
+
+def quality_queries(protocol):
+    """Targeted data quality questions, including the protocol's endpoints and key criteria"""
+    queries = list(QUALITY_QUERIES)
+    if protocol is not None:
+        queries = queries + protocol.study_endpoints + protocol.key_criteria
+    return queries
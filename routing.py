@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+from functools import lru_cache
+
+from config import APP_CONFIG_PATH, LLM_CONFIG, RESILIENCE_CONFIG
+
+# Providers served through the OpenAI client; local servers (vLLM, Ollama, LM Studio, llama.cpp)
+# expose the same API at their own base_url
+PROVIDERS = {"openai", "openai_compatible"}
+
+
+@lru_cache(maxsize=1)
+def load_routing():
+    """Loads the model routing from the "configuration.llm" section of clinical_trial_ai.json
+
+    The section holds default model settings, optionally a "routes" object of
+    per-agent overrides and an "escalation" model used when an agent's
+    structured output fails validation. Settings missing from the file fall
+    back to LLM_CONFIG.
+    """
+    path = os.getenv("CLINICAL_TRIAL_AI_CONFIG", APP_CONFIG_PATH)
+    try:
+        with open(path, "r") as f:
+            section = json.load(f).get("configuration", {}).get("llm", {})
+    except FileNotFoundError:
+        section = {}
+    routes = section.get("routes", {})
+    escalation = section.get("escalation")
+    default = {
+        **LLM_CONFIG,
+        **{name: value for name, value in section.items() if name not in ("routes", "escalation")}
+    }
+    return default, routes, escalation
+
+
+def route_for(agent=None):
+    """Returns the model settings for an agent: the defaults overlaid with its route"""
+    default, routes, _ = load_routing()
+    return {**default, **routes.get(agent, {})} if agent else dict(default)
+
+
+def escalation_for(agent=None):
+    """Returns the model settings to retry an agent's failed or truncated structured output with, or None"""
+    default, routes, escalation = load_routing()
+    route = routes.get(agent, {}) if agent else {}
+    escalation = route.get("escalation", escalation)
+    if not escalation:
+        return None
+    if isinstance(escalation, str):
+        escalation = {"model": escalation}
+    # The agent's max_tokens cap is not inherited: output truncated at it is a reason to escalate
+    route = {name: value for name, value in route_for(agent).items() if name != "max_tokens"}
+    settings = {**route, **escalation}
+    # Escalating to the model that just failed would only repeat the failure
+    return settings if settings["model"] != route_for(agent)["model"] else None
+
+
+def create_chat_model(route):
+    """Builds a chat model client for route settings"""
+    provider = route.get("provider", "openai")
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unsupported LLM provider: {provider}")
+    from langchain_openai import ChatOpenAI
+
+    base_url = route.get("base_url")
+    api_key = os.getenv(route.get("api_key_env", "OPENAI_API_KEY"))
+    if provider == "openai_compatible":
+        if not base_url:
+            raise ValueError(f"Model route for {route['model']} needs a base_url")
+        # Local servers usually ignore the key, but the client requires one
+        api_key = api_key or "not-needed"
+    options = {"max_tokens": route["max_tokens"]} if route.get("max_tokens") else {}
+    return ChatOpenAI(
+        model=route["model"],
+        temperature=route.get("temperature", 0),
+        api_key=api_key,
+        base_url=base_url,
+        timeout=RESILIENCE_CONFIG["request_timeout"],
+        # Retries are handled by the resilience layer, with backoff and a circuit breaker
+        max_retries=0,
+        **options
+    )
+
+
+def client_route(llm):
+    """Returns the settings of a chat model client that determine its responses"""
+    return {
+        # The client class and base_url identify the provider and endpoint
+        "client": type(llm).__name__,
+        "base_url": getattr(llm, "openai_api_base", None),
+        "model": llm.model_name,
+        "temperature": llm.temperature,
+        "max_tokens": getattr(llm, "max_tokens", None)
+    }
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(route):
+    """Returns the shared client for route settings, creating it on first use"""
+    key = json.dumps(route, sort_keys=True, default=str)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = create_chat_model(route)
+        return model
@@ -0,0 +1,214 @@
+import csv
+import re
+
+import numpy as np
+import pandas as pd
+
+from config import RULES_CONFIG
+from content_store import content_store
+from models import ClinicalDocument, DataQualityIssue
+
+# Plausible value ranges, matched against normalized column names
+RANGE_RULES = [
+    (re.compile(r"^age(_years)?$"), 0, 120),
+    (re.compile(r"weight(_kg)?$"), 1, 400),
+    (re.compile(r"height(_cm)?$"), 30, 250),
+    (re.compile(r"^bmi$"), 10, 80),
+    (re.compile(r"(systolic|sbp)"), 50, 260),
+    (re.compile(r"(diastolic|dbp)"), 30, 160),
+    (re.compile(r"(heart_rate|pulse|^hr$)"), 20, 250),
+    (re.compile(r"(temperature|temp_c|^temp$)"), 30, 45),
+    (re.compile(r"(resp(iratory)?_rate|^rr$)"), 4, 60),
+    (re.compile(r"(spo2|oxygen_saturation)"), 50, 100)
+]
+SUBJECT_COLUMN = re.compile(r"^(usubjid|subjid|subject(_id|_no|_number)?|patient(_id)?|participant(_id)?)$")
+VISIT_COLUMN = re.compile(r"^(visit(_id|_name|_no|num|_number)?|visitnum|timepoint)$")
+DATE_COLUMN = re.compile(r"(date|_dt$|^dt_|dtc$)")
+UNIT_COLUMN = re.compile(r"(unit|units|_u)$")
+EMBEDDED_UNIT = re.compile(r"^\s*-?\d+(\.\d+)?\s*([A-Za-z%/°]+[A-Za-z0-9/²]*)\s*$")
+
+
+def normalize_column(name):
+    return re.sub(r"[^a-z0-9]+", "_", str(name).strip().lower()).strip("_")
+
+
+def parse_table(doc):
+    """Parses a delimited tabular document into a DataFrame of strings, or None if it is not a table
+
+    The document is sniffed from a prefix and then parsed from its file in the
+    content store, so non-tabular documents are never read in full.
+    """
+    sample = content_store.read_prefix(doc.content_ref, RULES_CONFIG["sniff_chars"])
+    lines = [line for line in sample.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return None
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines[:20]), delimiters=",\t;|")
+    except csv.Error:
+        return None
+    try:
+        frame = pd.read_csv(
+            content_store.path(doc.content_ref), sep=dialect.delimiter, dtype=str, keep_default_na=False,
+            skipinitialspace=True, encoding="utf-8"
+        )
+    except (pd.errors.ParserError, ValueError):
+        return None
+    if frame.shape[1] < 2 or frame.empty:
+        return None
+    frame.columns = [normalize_column(column) for column in frame.columns]
+    return frame
+
+
+def blank_mask(series):
+    return series.str.strip().isin(["", "na", "n/a", "NA", "N/A", "null", "NULL", "."])
+
+
+def example_rows(mask, limit=5):
+    rows = np.flatnonzero(mask.to_numpy())[:limit] + 2  # 1-based, after the header row
+    return ", ".join(str(row) for row in rows)
+
+
+def impact_for(fraction):
+    if fraction >= RULES_CONFIG["high_impact_fraction"]:
+        return "high"
+    if fraction >= RULES_CONFIG["medium_impact_fraction"]:
+        return "medium"
+    return "low"
+
+
+class RuleEngine:
+    """Vectorized data quality rules over one tabular case report export"""
+
+    def __init__(self, doc: ClinicalDocument, frame: pd.DataFrame):
+        self.doc = doc
+        self.frame = frame
+        self.findings = []
+
+    def add(self, category, column, mask, description, resolution):
+        count = int(mask.sum())
+        if count == 0:
+            return
+        self.findings.append({
+            "category": category,
+            "description": (
+                f"{self.doc.doc_id}: {description} in column '{column}' "
+                f"({count} of {len(self.frame)} rows, e.g. rows {example_rows(mask)})"
+            ),
+            "impact_level": impact_for(count / len(self.frame)),
+            "suggested_resolution": resolution
+        })
+
+    def check_dates(self):
+        for column in self.frame.columns:
+            if not DATE_COLUMN.search(column):
+                continue
+            values = self.frame[column]
+            missing = blank_mask(values)
+            self.add("Missing Data", column, missing, "Missing dates",
+                     "Query the sites to supply the missing dates or document why they are unknown")
+            parsed = pd.to_datetime(values.where(~missing), errors="coerce", format="mixed")
+            invalid = parsed.isna() & ~missing
+            self.add("Invalid Date", column, invalid, "Unparseable dates",
+                     "Correct the dates to the protocol's date format (ISO 8601)")
+
+    def check_ranges(self):
+        for column in self.frame.columns:
+            for pattern, low, high in RANGE_RULES:
+                if not pattern.search(column):
+                    continue
+                values = pd.to_numeric(self.frame[column].str.extract(r"(-?\d+(?:\.\d+)?)")[0], errors="coerce")
+                out_of_range = (values < low) | (values > high)
+                self.add("Out of Range", column, out_of_range,
+                         f"Values outside the plausible range {low}-{high}",
+                         "Verify the values against source documents and correct transcription errors")
+                break
+
+    def check_duplicates(self):
+        subject_columns = [column for column in self.frame.columns if SUBJECT_COLUMN.match(column)]
+        if not subject_columns:
+            return
+        subject = subject_columns[0]
+        visit_columns = [column for column in self.frame.columns if VISIT_COLUMN.match(column)]
+        # Longitudinal exports repeat subjects across visits, so duplicates are per subject and visit
+        keys = [subject] + visit_columns[:1]
+        present = ~blank_mask(self.frame[subject])
+        duplicated = self.frame.duplicated(subset=keys, keep=False) & present
+        label = " and ".join(keys)
+        self.add("Duplicate Records", subject, duplicated, f"Duplicate records for the same {label}",
+                 "Reconcile the duplicate records and remove or merge the extra entries")
+        self.add("Missing Data", subject, ~present, "Missing subject IDs",
+                 "Assign each record to its subject ID")
+
+    def check_units(self):
+        for column in self.frame.columns:
+            values = self.frame[column]
+            if UNIT_COLUMN.search(column):
+                units = values.str.strip().str.lower()
+                units = units[units != ""]
+                if units.nunique() > 1:
+                    minority = units.value_counts().index[1:]
+                    mask = values.str.strip().str.lower().isin(minority)
+                    self.add("Inconsistent Units", column, mask,
+                             f"Mixed units ({', '.join(sorted(units.unique()))})",
+                             "Convert the values to a single unit and record it consistently")
+                continue
+            # Numeric columns with units typed into the values
+            embedded = values.str.extract(EMBEDDED_UNIT)[1].str.lower()
+            if embedded.dropna().nunique() > 1:
+                minority = embedded.value_counts().index[1:]
+                mask = embedded.isin(minority)
+                self.add("Inconsistent Units", column, mask,
+                         f"Values recorded in mixed units ({', '.join(sorted(embedded.dropna().unique()))})",
+                         "Convert the values to a single unit and record it consistently")
+
+    def run(self):
+        self.check_dates()
+        self.check_ranges()
+        self.check_duplicates()
+        self.check_units()
+        return self.findings
+
+    def free_text(self):
+        """Returns the table's free-text columns, with the subject column for context, as CSV"""
+        text_columns = [
+            column for column in self.frame.columns
+            if self.frame[column].str.len().replace(0, np.nan).mean() >= RULES_CONFIG["free_text_min_chars"]
+        ]
+        if not text_columns:
+            return None
+        subject_columns = [column for column in self.frame.columns if SUBJECT_COLUMN.match(column)]
+        columns = subject_columns[:1] + [column for column in text_columns if column not in subject_columns]
+        residue = self.frame[columns]
+        residue = residue[~residue[text_columns].apply(blank_mask).all(axis=1)]
+        return residue.to_csv(index=False) if not residue.empty else None
+
+
+def prescreen_documents(documents):
+    """Runs the rule engine over tabular documents
+
+    Returns the rule-based DataQualityIssue objects and the documents left for
+    the LLM: non-tabular documents unchanged, and for tables only their
+    free-text columns.
+    """
+    if not RULES_CONFIG["enabled"]:
+        return [], list(documents)
+
+    issues = []
+    residue = []
+    for doc in documents:
+        frame = parse_table(doc)
+        if frame is None:
+            residue.append(doc)
+            continue
+        engine = RuleEngine(doc, frame)
+        for finding in engine.run():
+            issues.append(DataQualityIssue(issue_id=f"DQ-RULE-{len(issues) + 1:03d}", **finding))
+        free_text = engine.free_text()
+        if free_text:
+            residue.append(ClinicalDocument.from_text(
+                doc_id=f"{doc.doc_id}#free-text",
+                doc_type=doc.doc_type,
+                content=free_text,
+                metadata={**doc.metadata, "residue_of": doc.doc_id}
+            ))
+    return issues, residue
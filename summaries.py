@@ -0,0 +1,111 @@
+from collections import Counter
+
+from chunking import SEVERITY_RANK, merge_quality_issues, merge_recommendations, merge_safety_alerts, unique
+from config import SUMMARY_CONFIG
+from tokens import count_tokens
+
+
+def truncate(text, max_chars=None):
+    """Collapses whitespace and shortens text to max_chars"""
+    max_chars = max_chars or SUMMARY_CONFIG["item_chars"]
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+
+def within_budget(lines, max_tokens, overflow):
+    """Keeps lines in order until max_tokens is reached, noting how many were dropped"""
+    kept = []
+    used = 0
+    for index, line in enumerate(lines):
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            kept.append(overflow(len(lines) - index))
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept)
+
+
+def severity_rank(level):
+    return SEVERITY_RANK.get(level.lower(), 0)
+
+
+def summarize_protocol(protocol, max_tokens=None):
+    """Renders a protocol analysis as compact labelled lines"""
+    if protocol is None:
+        return "None"
+    lines = []
+    for field in type(protocol).model_fields:
+        items = [truncate(item) for item in unique(getattr(protocol, field))]
+        if items:
+            lines.append(f"{field.replace('_', ' ').capitalize()}: " + "; ".join(items))
+    return within_budget(
+        lines,
+        max_tokens or SUMMARY_CONFIG["protocol_tokens"],
+        lambda dropped: f"({dropped} more sections omitted)"
+    )
+
+
+def summarize_alerts(alerts, max_tokens=None, details=True):
+    """Renders safety alerts one per line, most severe first, deduplicated and within a token budget"""
+    if not alerts:
+        return "None"
+    alerts = sorted(merge_safety_alerts(alerts), key=lambda alert: -severity_rank(alert.severity))
+    lines = []
+    for alert in alerts:
+        line = f"{alert.alert_id} [{alert.severity}] {truncate(alert.description)}"
+        if details and alert.related_criteria:
+            line += f" | criteria: {truncate('; '.join(alert.related_criteria))}"
+        if details and alert.recommendations:
+            line += f" | actions: {truncate('; '.join(alert.recommendations))}"
+        lines.append(line)
+    return within_budget(
+        lines,
+        max_tokens or SUMMARY_CONFIG["alerts_tokens"],
+        lambda dropped: f"({dropped} lower-severity alerts omitted)"
+    )
+
+
+def summarize_issues(issues, max_tokens=None, details=True):
+    """Renders quality issues one per line, highest impact first, deduplicated and within a token budget"""
+    if not issues:
+        return "None"
+    issues = sorted(merge_quality_issues(issues), key=lambda issue: -severity_rank(issue.impact_level))
+    lines = []
+    for issue in issues:
+        line = f"{issue.issue_id} [{issue.impact_level}] {issue.category}: {truncate(issue.description)}"
+        if details and issue.suggested_resolution:
+            line += f" | resolution: {truncate(issue.suggested_resolution)}"
+        lines.append(line)
+    return within_budget(
+        lines,
+        max_tokens or SUMMARY_CONFIG["issues_tokens"],
+        lambda dropped: f"({dropped} lower-impact issues omitted)"
+    )
+
+
+def summarize_recommendations(recommendations, max_tokens=None):
+    """Renders recommendations one per line, highest priority first, with the findings each addresses"""
+    if not recommendations:
+        return "None"
+    recommendations = sorted(merge_recommendations(recommendations), key=lambda rec: -severity_rank(rec.priority))
+    lines = []
+    for rec in recommendations:
+        line = f"- [{rec.priority}] {truncate(rec.recommendation)}"
+        linked = rec.related_alert_ids + rec.related_issue_ids
+        if linked:
+            line += f" | addresses: {', '.join(linked)}"
+        lines.append(line)
+    return within_budget(
+        lines,
+        max_tokens or SUMMARY_CONFIG["recommendations_tokens"],
+        lambda dropped: f"({dropped} more recommendations omitted)"
+    )
+
+
+def severity_counts(items, attribute):
+    """Summarizes how many items fall in each severity or impact level, e.g. "high: 2, low: 5\""""
+    counts = Counter(getattr(item, attribute).lower() for item in items)
+    if not counts:
+        return "none"
+    return ", ".join(f"{level}: {count}" for level, count in sorted(counts.items(), key=lambda kv: -severity_rank(kv[0])))
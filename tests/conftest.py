@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from content_store import content_store
+
+
+@pytest.fixture
+def content_root(tmp_path, monkeypatch):
+    """Stores document text under a temporary directory instead of data/content"""
+    monkeypatch.setattr(content_store, "root", tmp_path / "content")
+    return content_store.root
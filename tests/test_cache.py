@@ -0,0 +1,51 @@
+import itertools
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+import cache as cache_module
+from cache import LLMResponseCache
+from models import SafetyAlert
+from routing import client_route, create_chat_model
+
+MESSAGES = [SystemMessage(content="You review safety reports."), HumanMessage(content="Subject 3 fainted.")]
+
+
+def route(**settings):
+    model = create_chat_model({
+        "provider": "openai_compatible", "base_url": "http://localhost:8000/v1", "model": "llama-3.1-8b",
+        "temperature": 0, "max_tokens": 1000, **settings
+    })
+    return client_route(model)
+
+
+def test_key_is_stable_for_the_same_route_and_prompt():
+    assert LLMResponseCache.make_key(route(), MESSAGES) == LLMResponseCache.make_key(route(), MESSAGES)
+
+
+def test_key_covers_the_endpoint():
+    assert (LLMResponseCache.make_key(route(), MESSAGES)
+            != LLMResponseCache.make_key(route(base_url="http://localhost:11434/v1"), MESSAGES))
+
+
+def test_key_covers_max_tokens():
+    assert LLMResponseCache.make_key(route(), MESSAGES) != LLMResponseCache.make_key(route(max_tokens=4000), MESSAGES)
+    assert LLMResponseCache.make_key(route(), MESSAGES) != LLMResponseCache.make_key(route(max_tokens=None), MESSAGES)
+
+
+def test_key_covers_the_schema_and_messages():
+    key = LLMResponseCache.make_key(route(), MESSAGES)
+    assert key != LLMResponseCache.make_key(route(), MESSAGES, SafetyAlert)
+    assert key != LLMResponseCache.make_key(route(), MESSAGES[:1])
+
+
+def test_entries_round_trip_and_are_evicted_least_recently_used_first(tmp_path, monkeypatch):
+    # Access times one second apart, so recency never ties
+    clock = itertools.count(1000)
+    monkeypatch.setattr(cache_module.time, "time", lambda: next(clock))
+    cache = LLMResponseCache(tmp_path / "llm_cache.sqlite", max_entries=2)
+    cache.set("a", "first")
+    cache.set("b", "second")
+    assert cache.get("a") == "first"
+    cache.set("c", "third")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("first", "third")
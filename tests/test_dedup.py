@@ -0,0 +1,57 @@
+from chunking import merge_quality_issues, merge_safety_alerts
+from models import DataQualityIssue, SafetyAlert
+
+
+def alert(alert_id, severity, description, recommendations=(), related_criteria=()):
+    return SafetyAlert(alert_id=alert_id, severity=severity, description=description,
+                       recommendations=list(recommendations), related_criteria=list(related_criteria))
+
+
+def issue(issue_id, category, impact_level, description):
+    return DataQualityIssue(issue_id=issue_id, category=category, description=description,
+                            impact_level=impact_level, suggested_resolution="Query the site")
+
+
+def test_near_duplicate_alerts_merge_keeping_highest_severity():
+    merged = merge_safety_alerts([
+        alert("A1", "Medium", "Subject 012 had grade 3 ALT elevation after dose 2", ["Repeat LFTs"], ["Liver"]),
+        alert("A2", "High", "Subject 012 had a grade 3 ALT elevation after dose 2.", ["Hold dosing"], ["Liver"])
+    ])
+    assert len(merged) == 1
+    assert merged[0].alert_id == "A1"
+    assert merged[0].severity == "High"
+    assert merged[0].recommendations == ["Repeat LFTs", "Hold dosing"]
+    assert merged[0].related_criteria == ["Liver"]
+
+
+def test_alerts_with_different_numbers_stay_separate():
+    merged = merge_safety_alerts([
+        alert("A1", "High", "Subject 012 had grade 3 ALT elevation after dose 2"),
+        alert("A2", "High", "Subject 013 had grade 3 ALT elevation after dose 2")
+    ])
+    assert len(merged) == 2
+
+
+def test_distinct_alerts_with_the_same_id_get_suffixed_ids():
+    merged = merge_safety_alerts([
+        alert("SA-1", "High", "Anaphylaxis during the first infusion"),
+        alert("SA-1", "Low", "Mild headache reported at the week 4 visit"),
+        alert("SA-1", "Medium", "Missed ECG at screening for subject 7")
+    ])
+    assert [item.alert_id for item in merged] == ["SA-1", "SA-1-2", "SA-1-3"]
+
+
+def test_merging_does_not_modify_the_input_alerts():
+    first = alert("A1", "Low", "Subject 5 reported nausea after dose 1")
+    merge_safety_alerts([first, alert("A2", "High", "Subject 5 reported nausea after dose 1")])
+    assert first.severity == "Low"
+
+
+def test_quality_issues_only_merge_within_a_category():
+    description = "Visit date missing for subject 21 at visit 3"
+    merged = merge_quality_issues([
+        issue("Q1", "Missing data", "Low", description),
+        issue("Q2", "Missing data", "High", description),
+        issue("Q3", "Protocol deviation", "Medium", description)
+    ])
+    assert [(item.issue_id, item.impact_level) for item in merged] == [("Q1", "High"), ("Q3", "Medium")]
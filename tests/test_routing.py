@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from config import LLM_CONFIG
+from routing import escalation_for, load_routing, route_for
+
+
+@pytest.fixture
+def routing_config(tmp_path, monkeypatch):
+    """Writes a configuration.llm section to a temporary app config and loads routing from it"""
+    def write(section):
+        path = tmp_path / "clinical_trial_ai.json"
+        path.write_text(json.dumps({"configuration": {"llm": section}}))
+        monkeypatch.setenv("CLINICAL_TRIAL_AI_CONFIG", str(path))
+        load_routing.cache_clear()
+    yield write
+    load_routing.cache_clear()
+
+
+def test_routes_overlay_the_defaults(routing_config):
+    routing_config({"model": "gpt-4o-mini", "max_tokens": 2000, "routes": {"report_generator": {"max_tokens": 800}}})
+    assert route_for("report_generator")["model"] == "gpt-4o-mini"
+    assert route_for("report_generator")["max_tokens"] == 800
+    assert route_for("safety_monitor")["max_tokens"] == 2000
+    assert route_for()["temperature"] == LLM_CONFIG["temperature"]
+
+
+def test_escalation_does_not_inherit_the_agents_max_tokens(routing_config):
+    routing_config({
+        "model": "gpt-4o-mini",
+        "temperature": 0.2,
+        "max_tokens": 2000,
+        "routes": {"safety_monitor": {"max_tokens": 1500}},
+        "escalation": "gpt-4o"
+    })
+    settings = escalation_for("safety_monitor")
+    assert settings["model"] == "gpt-4o"
+    assert settings["temperature"] == 0.2
+    assert "max_tokens" not in settings
+
+
+def test_escalation_keeps_its_own_max_tokens(routing_config):
+    routing_config({
+        "model": "gpt-4o-mini",
+        "routes": {"safety_monitor": {"max_tokens": 1500}},
+        "escalation": {"model": "gpt-4o", "max_tokens": 6000}
+    })
+    assert escalation_for("safety_monitor")["max_tokens"] == 6000
+
+
+def test_a_route_can_override_the_escalation_model(routing_config):
+    routing_config({
+        "model": "gpt-4o-mini",
+        "routes": {"protocol_analyzer": {"escalation": {"model": "o3-mini"}}},
+        "escalation": "gpt-4o"
+    })
+    assert escalation_for("protocol_analyzer")["model"] == "o3-mini"
+    assert escalation_for("quality_monitor")["model"] == "gpt-4o"
+
+
+def test_no_escalation_to_the_same_model_or_without_one(routing_config):
+    routing_config({"model": "gpt-4o-mini", "routes": {"report_generator": {"model": "gpt-4o"}}, "escalation": "gpt-4o"})
+    assert escalation_for("report_generator") is None
+    routing_config({"model": "gpt-4o-mini"})
+    assert escalation_for("safety_monitor") is None
@@ -0,0 +1,58 @@
+from models import ClinicalDocument
+from rules import prescreen_documents
+
+
+def table(text, doc_id="crf.csv"):
+    return ClinicalDocument.from_text(doc_id, "case_report", text, {})
+
+
+def issues_by_category(issues):
+    found = {}
+    for issue in issues:
+        found.setdefault(issue.category, []).append(issue.description)
+    return found
+
+
+def test_implausible_vitals_are_flagged_per_column(content_root):
+    issues, _ = prescreen_documents([table(
+        "subject_id,age,systolic_bp,heart_rate,temperature\n"
+        "001,54,128,72,36.8\n"
+        "002,250,300 mmHg,71 bpm,37.1\n"
+        "003,61,119,15,36.5\n"
+    )])
+    out_of_range = issues_by_category(issues)["Out of Range"]
+    assert len(out_of_range) == 3
+    assert any("'age'" in text and "0-120" in text and "1 of 3 rows" in text and "rows 3" in text
+               for text in out_of_range)
+    assert any("'systolic_bp'" in text and "50-260" in text for text in out_of_range)
+    assert any("'heart_rate'" in text and "rows 4" in text for text in out_of_range)
+    assert not any("'temperature'" in text for text in out_of_range)
+
+
+def test_missing_and_unparseable_dates_are_flagged_separately(content_root):
+    issues, _ = prescreen_documents([table(
+        "subject_id,visit,visit_date\n"
+        "001,1,2024-01-15\n"
+        "001,2,\n"
+        "002,1,2024-13-45\n"
+        "002,2,15/02/2024\n"
+    )])
+    found = issues_by_category(issues)
+    assert found["Missing Data"] == ["crf.csv: Missing dates in column 'visit_date' (1 of 4 rows, e.g. rows 3)"]
+    assert found["Invalid Date"] == [
+        "crf.csv: Unparseable dates in column 'visit_date' (1 of 4 rows, e.g. rows 4)"
+    ]
+
+
+def test_issue_ids_are_numbered_and_impact_follows_the_affected_fraction(content_root):
+    rows = "".join(f"{i:03d},{40 + i % 30},2024-01-{1 + i % 28:02d}\n" for i in range(199))
+    issues, _ = prescreen_documents([table("subject_id,age,visit_date\n" + rows + "199,999,\n")])
+    assert [issue.issue_id for issue in issues] == ["DQ-RULE-001", "DQ-RULE-002"]
+    assert {issue.impact_level for issue in issues} == {"low"}
+
+
+def test_non_tabular_documents_are_left_for_the_llm(content_root):
+    report = ClinicalDocument.from_text("sae.txt", "safety_report", "Subject 4 was hospitalized with pneumonia.", {})
+    issues, residue = prescreen_documents([report])
+    assert issues == []
+    assert residue == [report]
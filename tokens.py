@@ -0,0 +1,27 @@
+from functools import lru_cache
+
+# Rough characters-per-token ratio used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """Loads the tiktoken encoding, or returns None if it cannot be loaded"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    """Counts the tokens in text, estimating from its length without tiktoken"""
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages):
+    """Counts the prompt tokens of a list of chat messages"""
+    return sum(count_tokens(message.content) for message in messages)